@@ -0,0 +1 @@
+"""Offline benchmarks of the moderation service, run with `python -m benchmarks.<name>`"""
@@ -0,0 +1,66 @@
+"""Micro-benchmark of the message decoding: the original decode path against DecodedMessage,
+full events and header only (view=summary).
+
+python -m benchmarks.bench_decode --count 20000
+"""
+
+import argparse
+import json
+import time
+from collections.abc import Callable
+
+from msfwk.desp.rabbitmq.mq_message import DespMQMessage
+
+from benchmarks.payloads import make_payloads
+from moderation.decoding import DecodedMessage
+from moderation.models.interfaces import Event, EventSummary
+
+
+def legacy_decode(body: bytes) -> Event:
+    """The path used before DecodedMessage: str copy, json.loads, DespMQMessage then Event copy"""
+    return Event.from_message(DespMQMessage.from_dict(json.loads(body.decode())))
+
+
+def fast_decode(body: bytes) -> Event:
+    """Event validated straight from the raw body"""
+    return DecodedMessage.from_body(body).event
+
+
+def summary_decode(body: bytes) -> EventSummary:
+    """Header only, the content stays raw bytes"""
+    return DecodedMessage.from_body(body).summary
+
+
+def measure(decode: Callable[[bytes], Event | EventSummary], payloads: list[bytes], rounds: int) -> float:
+    """Return the best throughput in messages per second over the rounds"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for body in payloads:
+            decode(body)
+        best = min(best, time.perf_counter() - start)
+    return len(payloads) / best
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=20000, help="number of messages decoded per round")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds, the best one is kept")
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.count)
+    if legacy_decode(payloads[0]) != fast_decode(payloads[0]):
+        message = "Both decode paths must build the same Event"
+        raise SystemExit(message)
+
+    legacy = measure(legacy_decode, payloads, args.rounds)
+    fast = measure(fast_decode, payloads, args.rounds)
+    summary = measure(summary_decode, payloads, args.rounds)
+    print(f"legacy decode: {legacy:12,.0f} msg/s")  # noqa: T201
+    print(f"fast decode:   {fast:12,.0f} msg/s  (x{fast / legacy:.2f})")  # noqa: T201
+    print(f"summary only:  {summary:12,.0f} msg/s  (x{summary / legacy:.2f})")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Benchmark of the queue bound operations behind the endpoints, against the in-memory broker of fake_amqp.
+
+python -m benchmarks.bench_endpoints --sizes 1000 10000 100000 --latency-ms 0.1
+python -m benchmarks.bench_endpoints --output results.json --baseline baseline.json --tolerance 0.2
+
+For each queue depth the manual moderation queue is seeded with that many messages, then every operation is called
+`--calls` times on the ids at the tail of the queue (the worst case for a scan). The report gives the throughput,
+the p50/p95/p99 latency and the peak memory allocated by one more call, measured apart so tracing doesn't skew the
+timings. A call that does not find, list or remove its messages stops the run. With `--baseline`, the run fails
+when an operation gets slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+import tracemalloc
+from collections.abc import Awaitable, Callable, Iterator
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from msfwk.mqclient import RabbitMQConfig
+
+from benchmarks.fake_amqp import FakeBroker, install_fake_pool
+from benchmarks.payloads import make_payloads
+from moderation.apply_moderation import accept_message
+from moderation.decision_pipeline import start_decision_pipeline, stop_decision_pipeline
+from moderation.delete_messages import safe_delete_messages_from_queue
+from moderation.fetch_messages import get_messages_from_queue, retrieve_message
+from moderation.models.config import ModerationConfig
+from moderation.mq_pool import close_mq_pool
+from moderation.pending_index import start_pending_index, stop_pending_indexes
+from moderation.queue_stats import get_queue_stats, track_pending_index
+
+HANDLING_QUEUE = "bench.to_handling"
+OPERATIONS = ("list", "get", "stats", "accept", "delete")
+
+
+@dataclass
+class OperationResult:
+    """Measures of an operation at a queue depth"""
+
+    operation: str
+    queue_depth: int
+    calls: int
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    peak_memory_mib: float
+
+
+def configure_queues() -> str:
+    """Give the RabbitMQ settings a value when no config has been loaded, return the moderation queue"""
+    RabbitMQConfig.MANUAL_MODERATION_QUEUE = RabbitMQConfig.MANUAL_MODERATION_QUEUE or "manual_moderation"
+    RabbitMQConfig.MODERATION_EXCHANGE = RabbitMQConfig.MODERATION_EXCHANGE or "moderation"
+    RabbitMQConfig.TO_HANDLING_RKEY = RabbitMQConfig.TO_HANDLING_RKEY or "to_handling"
+    return RabbitMQConfig.MANUAL_MODERATION_QUEUE
+
+
+def percentile(samples: list[float], rank: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(rank * len(ordered)) - 1)]
+
+
+def check(operation: str, result: object) -> None:
+    """Stop the run on a call that did not do its work, its timing would be meaningless"""
+    match operation, result:
+        case "list", (messages, errors) if not messages or errors:
+            message = f"list returned {len(messages)} messages and {len(errors)} errors"
+        case "get", None:
+            message = "get did not find the message"
+        case "delete", (deleted, success) if not success or sum(deleted.values()) != 1:
+            message = f"delete removed {deleted}, success: {success}"
+        case _:
+            return
+    raise SystemExit(message)
+
+
+async def measure(
+    operation: str, queue_depth: int, call: Callable[[], Awaitable[object]], calls: int
+) -> OperationResult:
+    """Time `calls` calls, then trace the allocations of one more"""
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        result = await call()
+        durations.append(time.perf_counter() - start)
+        check(operation, result)
+
+    tracemalloc.start()
+    try:
+        result = await call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    check(operation, result)
+
+    return OperationResult(
+        operation=operation,
+        queue_depth=queue_depth,
+        calls=calls,
+        throughput=calls / sum(durations),
+        p50_ms=percentile(durations, 0.50) * 1000,
+        p95_ms=percentile(durations, 0.95) * 1000,
+        p99_ms=percentile(durations, 0.99) * 1000,
+        peak_memory_mib=peak / 2**20,
+    )
+
+
+async def bench_depth(queue_depth: int, args: argparse.Namespace) -> list[OperationResult]:
+    """Seed a fresh broker with `queue_depth` messages and measure every operation"""
+    queue_name = configure_queues()
+    broker = FakeBroker(latency=args.latency_ms / 1000)
+    broker.seed(queue_name, make_payloads(queue_depth))
+    broker.bind(HANDLING_QUEUE, RabbitMQConfig.MODERATION_EXCHANGE, RabbitMQConfig.TO_HANDLING_RKEY)
+    pool = await install_fake_pool(broker)
+    if args.index:
+        index = await start_pending_index(pool, queue_name)
+        track_pending_index(index)
+        while len(index) < min(queue_depth, index.prefetch_count):  # noqa: ASYNC110
+            await asyncio.sleep(0)
+    if args.pipeline:
+        start_decision_pipeline()
+
+    # Decisions and deletions consume their message, each call takes the next id from the tail
+    tail_ids: Iterator[str] = (f"bench-{i:08d}" for i in range(queue_depth - 1, -1, -1))
+    last_id = f"bench-{queue_depth - 1:08d}"
+    operations: dict[str, Callable[[], Awaitable[object]]] = {
+        "list": lambda: get_messages_from_queue(queue_name),
+        "get": lambda: retrieve_message(last_id, queue_name),
+        "stats": lambda: get_queue_stats(queue_name),
+        "accept": lambda: accept_message(next(tail_ids)),
+        "delete": lambda: safe_delete_messages_from_queue(queue_name, {next(tail_ids)}),
+    }
+    try:
+        results = [
+            await measure(operation, queue_depth, operations[operation], args.calls) for operation in args.operations
+        ]
+    finally:
+        await stop_decision_pipeline()
+        await stop_pending_indexes()
+        await close_mq_pool()
+
+    if "accept" in args.operations and len(broker.queues[HANDLING_QUEUE]) != args.calls + 1:
+        message = "Every accepted message must have been published to handling"
+        raise SystemExit(message)
+    return results
+
+
+def regressions(results: list[OperationResult], baseline_path: Path, tolerance: float) -> list[str]:
+    """List the operations slower than the baseline by more than the tolerance"""
+    baseline = {(item["operation"], item["queue_depth"]): item for item in json.loads(baseline_path.read_text())}
+    failures = []
+    for result in results:
+        reference = baseline.get((result.operation, result.queue_depth))
+        if reference is not None and result.throughput < reference["throughput"] * (1 - tolerance):
+            failures.append(
+                f"{result.operation} @ {result.queue_depth}: {result.throughput:,.1f} op/s "
+                f"against {reference['throughput']:,.1f} op/s in the baseline"
+            )
+    return failures
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="queue depths")
+    parser.add_argument("--calls", type=int, default=5, help="timed calls per operation and depth")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of every broker round trip")
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument(
+        "--index", action=argparse.BooleanOptionalAction, default=True, help="run the resident pending index"
+    )
+    parser.add_argument(
+        "--pipeline", action=argparse.BooleanOptionalAction, default=True, help="publish decisions in the background"
+    )
+    parser.add_argument("--prefetch", type=int, default=ModerationConfig.PENDING_INDEX_PREFETCH)
+    parser.add_argument(
+        "--bulk-fetch",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="read the queue with a consumer, one basic.get per message otherwise",
+    )
+    parser.add_argument(
+        "--freshness", type=float, default=0.0, help="seconds a shared read is served again, 0 times every read"
+    )
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput loss against the baseline")
+    args = parser.parse_args()
+
+    ModerationConfig.PENDING_INDEX_PREFETCH = args.prefetch
+    ModerationConfig.READ_FRESHNESS_SECONDS = args.freshness
+    ModerationConfig.BULK_FETCH_ENABLED = args.bulk_fetch
+
+    results: list[OperationResult] = []
+    print(f"{'operation':<10}{'depth':>10}{'op/s':>12}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'peak MiB':>12}")  # noqa: T201
+    for size in args.sizes:
+        for result in asyncio.run(bench_depth(size, args)):
+            results.append(result)
+            print(  # noqa: T201
+                f"{result.operation:<10}{result.queue_depth:>10}{result.throughput:>12,.1f}{result.p50_ms:>12.2f}"
+                f"{result.p95_ms:>12.2f}{result.p99_ms:>12.2f}{result.peak_memory_mib:>12.2f}"
+            )
+
+    if args.output is not None:
+        args.output.write_text(json.dumps([asdict(result) for result in results], indent=2))
+    if args.baseline is not None:
+        failures = regressions(results, args.baseline, args.tolerance)
+        if failures:
+            print("\n".join(["Regressions:", *failures]), file=sys.stderr)  # noqa: T201
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
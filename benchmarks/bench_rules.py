@@ -0,0 +1,93 @@
+"""Micro-benchmark of the automatic moderation rules: the keyword automaton against a single regular expression
+alternating every keyword, then the whole evaluation of an event.
+
+python -m benchmarks.bench_rules --count 20000 --keywords 1000
+
+One event in `--hit-every` gets a deny keyword in its content, the others go through every rule.
+"""
+
+import argparse
+import json
+import random
+import re
+import string
+import time
+from collections.abc import Callable
+
+from msfwk.desp.rabbitmq.mq_message import DespMQMessage, MQContentType
+
+from benchmarks.payloads import load_template, make_payloads
+from moderation.decoding import DecodedMessage, content_text
+from moderation.rules import AutoModerationRules, RuleSet
+
+
+def make_keywords(count: int, seed: int = 0) -> list[str]:
+    """Distinct lowercase words of 4 to 10 letters"""
+    rng = random.Random(seed)
+    keywords: set[str] = set()
+    while len(keywords) < count:
+        keywords.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return sorted(keywords)
+
+
+def make_events(count: int, deny_keyword: str, hit_every: int) -> list[DecodedMessage]:
+    """Decoded events, one in `hit_every` holding the deny keyword"""
+    template = load_template()
+    events = []
+    for i, payload in enumerate(make_payloads(count, template)):
+        body = payload
+        if hit_every and i % hit_every == 0:
+            message = DespMQMessage.from_dict(json.loads(payload))
+            description = message.content.data_by_type[MQContentType.Text][-1]
+            description.value = f"{description.value} {deny_keyword}"
+            body = json.dumps(message.to_dict()).encode()
+        events.append(DecodedMessage.from_body(body))
+    return events
+
+
+def measure(run: Callable[[], object], count: int, rounds: int) -> float:
+    """Return the best throughput in events per second over the rounds"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="number of events evaluated per round")
+    parser.add_argument("--keywords", type=int, default=1000, help="number of keywords, half deny and half review")
+    parser.add_argument("--hit-every", type=int, default=10, help="one event in this many holds a deny keyword")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds, the best one is kept")
+    args = parser.parse_args()
+
+    keywords = make_keywords(args.keywords)
+    deny, review = keywords[: len(keywords) // 2], keywords[len(keywords) // 2 :]
+    rules = RuleSet(
+        AutoModerationRules(deny_keywords=deny, review_keywords=review, deny_patterns=[r"https?://[^ ]*\.invalid\b"])
+    )
+    alternation = re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + r")\b", re.IGNORECASE)
+    events = make_events(args.count, deny[0], args.hit_every)
+    texts = [content_text(event.body) for event in events]
+
+    for text in texts[: args.hit_every or 1]:
+        automaton_hits = {keyword for keyword, _ in rules.automaton.matches(text)}
+        regex_hits = {found.group().casefold() for found in alternation.finditer(text)}
+        if automaton_hits != regex_hits:
+            message = f"The automaton and the regular expression disagree: {automaton_hits} != {regex_hits}"
+            raise SystemExit(message)
+
+    regex = measure(lambda: [alternation.search(text) for text in texts], args.count, args.rounds)
+    automaton = measure(lambda: [rules.match_text(text) for text in texts], args.count, args.rounds)
+    evaluation = measure(lambda: [rules.evaluate(event) for event in events], args.count, args.rounds)
+    print(f"{args.keywords} keywords, {len(rules.automaton)} automaton states")  # noqa: T201
+    print(f"regex alternation: {regex:12,.0f} events/s")  # noqa: T201
+    print(f"keyword automaton: {automaton:12,.0f} events/s  (x{automaton / regex:.2f})")  # noqa: T201
+    print(f"full evaluation:   {evaluation:12,.0f} events/s")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
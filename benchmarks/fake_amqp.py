@@ -0,0 +1,337 @@
+"""In-memory stand-in for the part of the aio_pika API used by the service.
+
+Queues, channels, exchanges and deliveries behave like their RabbitMQ counterparts as far as the service
+can tell: basic.get, consumers with a prefetch window, ack/nack with requeue at the original position,
+publisher confirms and a default exchange routing on the queue name.
+Every broker round trip waits `latency` seconds so the benchmarks can model a remote broker.
+"""
+
+import asyncio
+import heapq
+import itertools
+from collections.abc import Awaitable, Callable
+from types import SimpleNamespace
+
+from aio_pika import exceptions as aio_pika_exceptions
+from aio_pika.abc import AbstractMessage
+
+from moderation import mq_pool
+from moderation.models.config import ModerationConfig
+from moderation.mq_pool import MQChannelPool
+
+Consumer = Callable[["FakeIncomingMessage"], Awaitable[None]]
+
+
+class FakeBroker:
+    """Holds the queues, the bindings and the latency shared by every fake connection"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.queues: dict[str, FakeQueueState] = {}
+        # (exchange, routing key) -> bound queue names
+        self.bindings: dict[tuple[str, str], list[str]] = {}
+        self.published: dict[str, int] = {}
+        self.round_trips = 0
+
+    async def round_trip(self) -> None:
+        """Simulate a request to the broker"""
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+
+    def declare(self, queue_name: str) -> "FakeQueueState":
+        """Create the queue if needed"""
+        if queue_name not in self.queues:
+            self.queues[queue_name] = FakeQueueState(self, queue_name)
+        return self.queues[queue_name]
+
+    def bind(self, queue_name: str, exchange_name: str, routing_key: str) -> None:
+        """Route the messages published on the exchange with the routing key to the queue"""
+        self.declare(queue_name)
+        self.bindings.setdefault((exchange_name, routing_key), []).append(queue_name)
+
+    def seed(self, queue_name: str, bodies: list[bytes]) -> None:
+        """Fill a queue without any round trip"""
+        state = self.declare(queue_name)
+        for body in bodies:
+            state.ready.append((next(state.sequence), False, FakeMessage(body)))
+
+    def route(self, exchange_name: str, routing_key: str, message: "FakeMessage") -> None:
+        """Deliver a published message to its queues, unroutable messages are dropped"""
+        self.published[exchange_name] = self.published.get(exchange_name, 0) + 1
+        queue_names = [routing_key] if exchange_name == "" else self.bindings.get((exchange_name, routing_key), [])
+        for queue_name in queue_names:
+            if queue_name in self.queues:
+                self.queues[queue_name].push(message)
+
+
+class FakeMessage:
+    """A message stored in a queue"""
+
+    __slots__ = ("body", "content_type", "headers", "message_id")
+
+    def __init__(
+        self,
+        body: bytes,
+        headers: dict | None = None,
+        message_id: str | None = None,
+        content_type: str | None = None,
+    ) -> None:
+        self.body = body
+        self.headers = headers or {}
+        self.message_id = message_id
+        self.content_type = content_type
+
+
+class FakeQueueState:
+    """Ready messages and consumers of a queue"""
+
+    def __init__(self, broker: FakeBroker, name: str) -> None:
+        self.broker = broker
+        self.name = name
+        # Heap of (position, redelivered, message), a requeued message gets its position back
+        self.ready: list[tuple[int, bool, FakeMessage]] = []
+        self.sequence = itertools.count()
+        self.consumers: dict[str, tuple[FakeChannel, Consumer]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ready)
+
+    def push(self, message: FakeMessage) -> None:
+        """Append a published message to the queue"""
+        heapq.heappush(self.ready, (next(self.sequence), False, message))
+        self.dispatch()
+
+    def requeue(self, delivery: "FakeIncomingMessage") -> None:
+        """Put a delivery back at its original position"""
+        heapq.heappush(self.ready, (delivery.position, True, delivery.message))
+        self.dispatch()
+
+    def pop(self) -> tuple[int, bool, FakeMessage] | None:
+        """Take the next ready message"""
+        return heapq.heappop(self.ready) if self.ready else None
+
+    def dispatch(self) -> None:
+        """Push ready messages to the consumers with room left in their prefetch window"""
+        for channel, callback in list(self.consumers.values()):
+            while self.ready and channel.has_room():
+                delivery = channel.deliver(self, *self.pop())
+                asyncio.get_running_loop().create_task(callback(delivery))
+
+
+class FakeIncomingMessage:
+    """A delivery, mirrors aio_pika.IncomingMessage"""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        channel: "FakeChannel",
+        queue: FakeQueueState,
+        position: int,
+        message: FakeMessage,
+        delivery_tag: int,
+        *,
+        redelivered: bool,
+    ) -> None:
+        self.channel = channel
+        self.queue = queue
+        self.position = position
+        self.message = message
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+        self.processed = False
+
+    @property
+    def body(self) -> bytes:
+        return self.message.body
+
+    @property
+    def headers(self) -> dict:
+        return self.message.headers
+
+    @property
+    def message_id(self) -> str | None:
+        return self.message.message_id
+
+    @property
+    def content_type(self) -> str | None:
+        return self.message.content_type
+
+    async def ack(self) -> None:
+        self._settle()
+        await self.queue.broker.round_trip()
+        self.queue.dispatch()
+
+    async def nack(self, *, requeue: bool = True) -> None:
+        self._settle()
+        await self.queue.broker.round_trip()
+        if requeue:
+            self.queue.requeue(self)
+        else:
+            self.queue.dispatch()
+
+    async def reject(self, *, requeue: bool = False) -> None:
+        await self.nack(requeue=requeue)
+
+    def _settle(self) -> None:
+        if self.processed:
+            message = "Message already processed"
+            raise aio_pika_exceptions.MessageProcessError(message, self)
+        self.processed = True
+        self.channel.unacked.pop(self.delivery_tag, None)
+
+
+class FakeExchange:
+    """Exchange with publisher confirms"""
+
+    def __init__(self, broker: FakeBroker, name: str) -> None:
+        self.broker = broker
+        self.name = name
+
+    async def publish(self, message: AbstractMessage, routing_key: str) -> None:
+        await self.broker.round_trip()
+        stored = FakeMessage(
+            message.body,
+            headers=dict(message.headers or {}),
+            message_id=message.message_id,
+            content_type=message.content_type,
+        )
+        self.broker.route(self.name, routing_key, stored)
+
+
+class FakeQueue:
+    """A queue seen from a channel"""
+
+    def __init__(self, channel: "FakeChannel", state: FakeQueueState) -> None:
+        self.channel = channel
+        self.state = state
+        self.name = state.name
+
+    @property
+    def declaration_result(self) -> SimpleNamespace:
+        """Queue.DeclareOk of a passive declare"""
+        return SimpleNamespace(message_count=len(self.state.ready), consumer_count=len(self.state.consumers))
+
+    async def get(self, *, no_ack: bool = False, fail: bool = True) -> FakeIncomingMessage | None:
+        await self.state.broker.round_trip()
+        entry = self.state.pop()
+        if entry is None:
+            if fail:
+                raise aio_pika_exceptions.QueueEmpty
+            return None
+        delivery = self.channel.deliver(self.state, *entry)
+        if no_ack:
+            delivery.processed = True
+            self.channel.unacked.pop(delivery.delivery_tag, None)
+        return delivery
+
+    async def consume(self, callback: Consumer, *, no_ack: bool = False) -> str:  # noqa: ARG002
+        await self.state.broker.round_trip()
+        consumer_tag = f"ctag-{next(_tags)}"
+        self.state.consumers[consumer_tag] = self.channel, callback
+        self.channel.consumer_tags.add((self.state.name, consumer_tag))
+        self.state.dispatch()
+        return consumer_tag
+
+    async def cancel(self, consumer_tag: str) -> None:
+        await self.state.broker.round_trip()
+        self.state.consumers.pop(consumer_tag, None)
+        self.channel.consumer_tags.discard((self.state.name, consumer_tag))
+
+    async def purge(self) -> SimpleNamespace:
+        await self.state.broker.round_trip()
+        count = len(self.state.ready)
+        self.state.ready.clear()
+        return SimpleNamespace(message_count=count)
+
+
+class FakeChannel:
+    """Channel with a QoS window, its unacked deliveries go back to their queue when it closes"""
+
+    def __init__(self, broker: FakeBroker) -> None:
+        self.broker = broker
+        self.is_closed = False
+        self.prefetch_count = 0
+        self.close_callbacks: set[Callable[..., object]] = set()
+        self.unacked: dict[int, FakeIncomingMessage] = {}
+        self.consumer_tags: set[tuple[str, str]] = set()
+        self._delivery_tags = itertools.count(1)
+
+    @property
+    def default_exchange(self) -> FakeExchange:
+        return FakeExchange(self.broker, "")
+
+    def has_room(self) -> bool:
+        """True while the prefetch window allows one more delivery to the consumers"""
+        return not self.is_closed and (self.prefetch_count == 0 or len(self.unacked) < self.prefetch_count)
+
+    def deliver(
+        self, state: FakeQueueState, position: int, redelivered: bool, message: FakeMessage
+    ) -> FakeIncomingMessage:
+        """Hand a message over to this channel"""
+        delivery_tag = next(self._delivery_tags)
+        delivery = FakeIncomingMessage(self, state, position, message, delivery_tag, redelivered=redelivered)
+        self.unacked[delivery.delivery_tag] = delivery
+        return delivery
+
+    async def set_qos(self, prefetch_count: int = 0) -> None:
+        await self.broker.round_trip()
+        self.prefetch_count = prefetch_count
+
+    async def get_queue(self, name: str, *, ensure: bool = True) -> FakeQueue:  # noqa: ARG002
+        await self.broker.round_trip()
+        if name not in self.broker.queues:
+            message = f"NOT_FOUND - no queue '{name}'"
+            raise aio_pika_exceptions.ChannelNotFound(message)
+        return FakeQueue(self, self.broker.queues[name])
+
+    async def declare_queue(self, name: str, *, passive: bool = False, **_: object) -> FakeQueue:
+        await self.broker.round_trip()
+        if passive:
+            return await self.get_queue(name)
+        return FakeQueue(self, self.broker.declare(name))
+
+    async def get_exchange(self, name: str, *, ensure: bool = True) -> FakeExchange:  # noqa: ARG002
+        await self.broker.round_trip()
+        return FakeExchange(self.broker, name)
+
+    async def close(self) -> None:
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for queue_name, consumer_tag in self.consumer_tags:
+            self.broker.queues[queue_name].consumers.pop(consumer_tag, None)
+        self.consumer_tags.clear()
+        unacked, self.unacked = list(self.unacked.values()), {}
+        for delivery in unacked:
+            delivery.processed = True
+            delivery.queue.requeue(delivery)
+        for callback in list(self.close_callbacks):
+            callback(self, None)
+
+
+class FakeConnection:
+    """Connection opening fake channels"""
+
+    def __init__(self, broker: FakeBroker) -> None:
+        self.broker = broker
+        self.is_closed = False
+
+    async def channel(self) -> FakeChannel:
+        await self.broker.round_trip()
+        return FakeChannel(self.broker)
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+_tags = itertools.count(1)
+
+
+async def install_fake_pool(broker: FakeBroker) -> MQChannelPool:
+    """Open the service wide channel pool on the fake broker instead of RabbitMQ"""
+    await mq_pool.close_mq_pool()
+    pool = MQChannelPool(ModerationConfig.CHANNEL_POOL_SIZE, ModerationConfig.CHANNEL_ACQUIRE_TIMEOUT)
+    # A client already connected, _ensure_connection never calls connect_to_rabbitmq
+    pool._client = SimpleNamespace(connection=FakeConnection(broker))  # noqa: SLF001
+    await pool.open()
+    mq_pool._pool = pool  # noqa: SLF001
+    return pool
@@ -0,0 +1,86 @@
+"""Synthetic DespMQMessage payloads for the benchmarks.
+
+The payloads are built from `event_template.json`, a message serialized by `DespMQMessage.to_dict()`
+(`python -m benchmarks.payloads` writes it again from `build_template`). Point MODERATION_BENCH_TEMPLATE
+to a message exported from a real queue to benchmark with production shaped content.
+"""
+
+import json
+import os
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from msfwk.desp.rabbitmq.mq_message import (
+    DespFonctionnalArea,
+    DespMQMessage,
+    ModerationEventStatus,
+    MQContentByTypeModel,
+    MQContentModel,
+    MQContentType,
+)
+
+TEMPLATE_PATH = Path(os.environ.get("MODERATION_BENCH_TEMPLATE", Path(__file__).with_name("event_template.json")))
+START_DATE = datetime(2025, 1, 1, tzinfo=UTC)
+
+
+def build_template() -> dict:
+    """A pending message with a title, a description and a link, as published by msfwk"""
+    content = MQContentByTypeModel(
+        data_by_type={
+            MQContentType.Text: [
+                MQContentModel(name="title", value="Benchmark content"),
+                MQContentModel(
+                    name="description",
+                    value="Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt"
+                    " ut labore et dolore magna aliqua.",
+                ),
+            ],
+            MQContentType.Url: [MQContentModel(name="link", value="https://example.org/content/0")],
+        }
+    )
+    message = DespMQMessage(
+        body={
+            "status": ModerationEventStatus.Manual_Pending.value,
+            "content_id": 0,
+            "user_id": "benchmark-user",
+            "date": START_DATE.isoformat(),
+            "url": "https://example.org/content/0",
+            "fonctionnal_area": next(iter(DespFonctionnalArea)).value,
+            "content": content,
+            "auto_mod_routing": [],
+            "accept_callbacks": [],
+            "reject_callbacks": [],
+            "history": [],
+        },
+        exchange="moderation",
+        routing_key="moderation.manual",
+        message_id="00000000-0000-0000-0000-000000000000",
+    )
+    return message.to_dict()
+
+
+def load_template() -> dict:
+    """Read the event template"""
+    return json.loads(TEMPLATE_PATH.read_text())
+
+
+def make_payloads(count: int, template: dict | None = None) -> list[bytes]:
+    """Build `count` distinct message bodies, one second apart and cycling over the functional areas
+
+    Every body goes through `DespMQMessage.from_dict` and `to_dict`, it is a message the service can publish again.
+    """
+    template = template or load_template()
+    areas = list(DespFonctionnalArea)
+    payloads = []
+    for i in range(count):
+        message = DespMQMessage.from_dict(template)
+        message.id = f"bench-{i:08d}"
+        message.date = START_DATE + timedelta(seconds=i)
+        message.fonctionnal_area = areas[i % len(areas)]
+        message.user_id = f"user-{i % 100}"
+        payloads.append(json.dumps(message.to_dict()).encode())
+    return payloads
+
+
+if __name__ == "__main__":
+    TEMPLATE_PATH.write_text(json.dumps(build_template(), indent=4) + "\n")
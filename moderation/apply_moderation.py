@@ -1,42 +1,284 @@
-from msfwk.desp.rabbitmq.mq_message import ModerationEventStatus
-from msfwk.mqclient import RabbitMQConfig, send_mq_message
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.desp.rabbitmq.mq_message import DespMQMessage, ModerationEventStatus
+from msfwk.mqclient import RabbitMQConfig
 from msfwk.utils.logging import get_logger
 
-from moderation.fetch_messages import get_message
-from moderation.models.constants import ACCEPTED_HISTORY_MESSAGE, REJECTED_HISTORY_MESSAGE
-from moderation.models.exceptions import MQMessageNotFoundError
-from moderation.utils import connect_to_rabbitmq
+from moderation.coalescing import invalidate_reads
+from moderation.coordination import get_coordinator
+from moderation.decision_pipeline import dispatch_decisions
+from moderation.decoding import DecodedMessage
+from moderation.fetch_messages import DrainBudget, requeue_messages
+from moderation.models.constants import (
+    ACCEPTED_HISTORY_MESSAGE,
+    REJECTED_HISTORY_MESSAGE,
+)
+from moderation.models.exceptions import (
+    AlreadyDecidedError,
+    MQMessageNotFoundError,
+    MQServerConnectionError,
+)
+from moderation.models.interfaces import (
+    DecisionOutcome,
+    DecisionResult,
+    ModerationDecision,
+)
+from moderation.pending_index import discard_decided_copies, get_pending_index
+from moderation.seen_ids import decision_of, published_decision
+from moderation.sharding import shard_queues, take_messages
 
 logger = get_logger(__name__)
 
 
-async def apply_moderation(message_id: str, status: ModerationEventStatus, history: str = "") -> None:
-    """Apply moderation decision for the message at given ID
+async def apply_moderation(
+    message_id: str, status: ModerationEventStatus, history: str = "", *, route: bool = True
+) -> None:
+    """Apply moderation decision for the message at given ID.
+    Repeating the decision already taken on the message does nothing but drop the copies still held of it.
+    The shards of a sharded queue are all read.
 
     Args:
         message_id (str): the id of the message
         status (ModerationEventStatus): moderation decision
         history (str): sentence to append in message history
+        route (bool): hand the decision over to the coordinated replica holding the message
 
     Raises:
+        AlreadyDecidedError: The message has already been decided the other way
         MQMessageNotFoundError: Message not found for given id
         MQServerConnectionError: Failed to connect to server
         MQQueueNotFoundError: _description_
     """
-    client = await connect_to_rabbitmq()
-    async with client.connection:
-        mq_message_tuple = await get_message(message_id, RabbitMQConfig.MANUAL_MODERATION_QUEUE, client.connection)
+    decided = await decision_of(message_id)
+    if decided is not None and published_decision(message_id) is not None:
+        await discard_decided_copies(message_id)
+    if decided == status:
+        logger.info("Message %s already %s, nothing to do", message_id, status.name.lower())
+        return
+    if decided is not None:
+        message = f"Message {message_id} already {decided.name.lower()}"
+        raise AlreadyDecidedError(message)
+    queue_names = shard_queues(RabbitMQConfig.MANUAL_MODERATION_QUEUE)
+    try:
+        found, unread = pop_pending_messages([message_id], queue_names)
+        if message_id in found:
+            await send_moderation_decision(*found[message_id], status, history)
+            return
+        if route and await route_decision(message_id, status, history):
+            return
+
+        budget = DrainBudget()
+        mq_message_tuple = (await take_messages({message_id}, unread, budget)).get(message_id) if unread else None
         if mq_message_tuple is None:
             message = f"Failed to found message at id: {message_id}"
+            if budget.truncated:
+                message += f" in the first {budget.scanned} messages of the queue"
             raise MQMessageNotFoundError(message)
-        mq_message, incoming_message = mq_message_tuple
-        mq_message.status = status
-        mq_message.history.append(history)
-        await incoming_message.ack()
-        logger.info("apply moderation on message: %s", str(mq_message.to_dict()))
-        await send_mq_message(
-            mq_message, exchange=RabbitMQConfig.MODERATION_EXCHANGE, routing_key=RabbitMQConfig.TO_HANDLING_RKEY
+        await send_moderation_decision(*mq_message_tuple, status, history)
+    finally:
+        for queue_name in queue_names:
+            invalidate_reads(queue_name)
+
+
+def pop_pending_messages(
+    message_ids: list[str], queue_names: list[str]
+) -> tuple[dict[str, tuple[DecodedMessage, AbstractIncomingMessage]], list[str]]:
+    """Take the messages with the given ids out of the pending indexes of the queues
+
+    Returns:
+        tuple[dict[str, tuple[DecodedMessage, AbstractIncomingMessage]], list[str]]: the messages found by id,
+        and the queues to read for the others, the ones whose pending index doesn't hold every message
+    """
+    found: dict[str, tuple[DecodedMessage, AbstractIncomingMessage]] = {}
+    unread: list[str] = []
+    for queue_name in queue_names:
+        index = get_pending_index(queue_name)
+        if index is None or index.saturated:
+            unread.append(queue_name)
+        for message_id in message_ids if index is not None else []:
+            mq_message_tuple = index.pop(message_id) if message_id not in found else None
+            if mq_message_tuple is not None:
+                found[message_id] = mq_message_tuple
+    return found, unread
+
+
+async def route_decision(message_id: str, status: ModerationEventStatus, history: str) -> bool:
+    """Hand a decision over to the coordinated replica holding the message, False if none holds it
+
+    Raises:
+        AlreadyDecidedError: The message has already been decided the other way
+        MQMessageNotFoundError: The replica no longer holds the message
+        MQServerConnectionError: The replica did not answer
+    """
+    for queue_name in shard_queues(RabbitMQConfig.MANUAL_MODERATION_QUEUE):
+        coordinator = get_coordinator(queue_name)
+        owners = await coordinator.remote_owners([message_id]) if coordinator is not None else {}
+        for replica_id in owners:
+            logger.info("Decision on message %s routed to replica %s", message_id, replica_id)
+            payload = {"message_id": message_id, "status": status.name, "history": history}
+            await coordinator.call(replica_id, "decide", payload)
+            return True
+    return False
+
+
+async def serve_routed_decision(payload: dict) -> None:
+    """Apply a decision routed by another replica"""
+    status = ModerationEventStatus[payload["status"]]
+    await apply_moderation(payload["message_id"], status, payload["history"], route=False)
+
+
+async def route_decisions(decisions: list[ModerationDecision]) -> dict[str, DecisionResult]:
+    """Hand the decisions over to the coordinated replicas holding their messages, one batch per replica
+
+    Returns:
+        dict[str, DecisionResult]: the outcome of the routed decisions, by message id
+    """
+    by_id = {decision.id: decision for decision in decisions}
+    outcomes: dict[str, DecisionResult] = {}
+    for queue_name in shard_queues(RabbitMQConfig.MANUAL_MODERATION_QUEUE):
+        coordinator = get_coordinator(queue_name)
+        unrouted = [message_id for message_id in by_id if message_id not in outcomes]
+        if coordinator is None or not unrouted:
+            continue
+        for replica_id, message_ids in (await coordinator.remote_owners(unrouted)).items():
+            payload = {"decisions": [by_id[message_id].model_dump(mode="json") for message_id in message_ids]}
+            try:
+                results = await coordinator.call(replica_id, "decisions", payload)
+            except MQServerConnectionError as error:
+                for message_id in message_ids:
+                    outcomes[message_id] = DecisionResult(
+                        message_id=message_id, outcome=DecisionOutcome.FAILED, error=str(error)
+                    )
+                continue
+            for result in results:
+                outcomes[result["message_id"]] = DecisionResult.model_validate(result)
+    return outcomes
+
+
+async def serve_routed_decisions(payload: dict) -> list[dict]:
+    """Apply a batch of decisions routed by another replica"""
+    decisions = [ModerationDecision.model_validate(decision) for decision in payload["decisions"]]
+    return [result.model_dump(mode="json") for result in await apply_moderation_batch(decisions, route=False)]
+
+
+async def send_moderation_decision(
+    decoded: DecodedMessage,
+    incoming_message: AbstractIncomingMessage,
+    status: ModerationEventStatus,
+    history: str,
+) -> None:
+    """Forward the decided message to handling, its delivery is acked once the publish is confirmed.
+    With the decision pipeline running, this returns as soon as the decision is buffered.
+
+    Args:
+        decoded (DecodedMessage): the message to decide on
+        incoming_message (AbstractIncomingMessage): its delivery
+        status (ModerationEventStatus): moderation decision
+        history (str): sentence to append in message history
+    """
+    try:
+        mq_message = decoded.mq_message
+    except BaseException:
+        # The delivery was popped from the pending index, give it back before reporting the failure
+        await requeue_messages([incoming_message])
+        raise
+    mq_message.status = status
+    mq_message.history.append(history)
+    logger.info("apply moderation on message: %s", str(mq_message.to_dict()))
+    error = (await dispatch_decisions([(mq_message, incoming_message)], wait=False))[0]
+    if error is not None:
+        raise error
+
+
+async def previous_outcome(decision: ModerationDecision) -> DecisionResult | None:
+    """The outcome of a decision on an event already decided, None if the event is still pending"""
+    decided = await decision_of(decision.id)
+    if decided is None:
+        return None
+    if published_decision(decision.id) is not None:
+        await discard_decided_copies(decision.id)
+    if decided == decision.status:
+        return DecisionResult(message_id=decision.id, outcome=DecisionOutcome.APPLIED)
+    error = f"Already {decided.name.lower()}"
+    return DecisionResult(message_id=decision.id, outcome=DecisionOutcome.FAILED, error=error)
+
+
+async def apply_moderation_batch(decisions: list[ModerationDecision], *, route: bool = True) -> list[DecisionResult]:
+    """Apply many moderation decisions with at most one pass over the queue, or over each of its shards.
+    Decided messages are published to handling together and acked once confirmed,
+    the ones that failed to publish are requeued.
+
+    Args:
+        decisions (list[ModerationDecision]): the decisions, only the first one of an id is applied,
+            one repeating the decision already taken on its id is applied without doing anything
+        route (bool): hand the decisions over to the coordinated replicas holding their messages
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: _description_
+
+    Returns:
+        list[DecisionResult]: the outcome of each decision, in the request order
+    """
+    queue_names = shard_queues(RabbitMQConfig.MANUAL_MODERATION_QUEUE)
+    wanted: dict[str, ModerationDecision] = {}
+    for decision in decisions:
+        wanted.setdefault(decision.id, decision)
+
+    previous = {message_id: await previous_outcome(decision) for message_id, decision in wanted.items()}
+    outcomes = {message_id: outcome for message_id, outcome in previous.items() if outcome is not None}
+    undecided = [message_id for message_id, outcome in previous.items() if outcome is None]
+
+    found, unread = pop_pending_messages(undecided, queue_names)
+    budget = DrainBudget()
+    try:
+        missing = {message_id for message_id in undecided if message_id not in found}
+        outcomes.update(await route_decisions([wanted[message_id] for message_id in missing]) if route else {})
+        missing.difference_update(outcomes)
+        if missing and unread:
+            found.update(await take_messages(missing, unread, budget))
+
+        decided: list[tuple[DespMQMessage, AbstractIncomingMessage]] = []
+        for message_id, (decoded, incoming_message) in found.items():
+            mq_message = decoded.mq_message
+            mq_message.status = wanted[message_id].status
+            mq_message.history.append(wanted[message_id].history)
+            decided.append((mq_message, incoming_message))
+    except BaseException:
+        await requeue_messages(incoming_message for _, incoming_message in found.values())
+        raise
+    # From here the deliveries are owned by the dispatch, acked once confirmed or requeued
+    publish_errors = await dispatch_decisions(decided, wait=True)
+    for queue_name in queue_names:
+        invalidate_reads(queue_name)
+
+    for (mq_message, _), error in zip(decided, publish_errors, strict=True):
+        if error is None:
+            outcomes[mq_message.id] = DecisionResult(message_id=mq_message.id, outcome=DecisionOutcome.APPLIED)
+        else:
+            logger.error("Failed to publish moderation decision for message %s: %s", mq_message.id, error)
+            outcomes[mq_message.id] = DecisionResult(
+                message_id=mq_message.id, outcome=DecisionOutcome.FAILED, error=str(error)
+            )
+    logger.info("apply moderation on %s messages out of %s decisions", len(found), len(decisions))
+
+    not_found = (
+        f"Not in the first {budget.scanned} messages of the queue, the read stopped on its budget"
+        if budget.truncated
+        else None
+    )
+    results: list[DecisionResult] = []
+    for decision in decisions:
+        if wanted[decision.id] is not decision:
+            error = "Duplicate decision, only the first one of an id is applied"
+            results.append(DecisionResult(message_id=decision.id, outcome=DecisionOutcome.FAILED, error=error))
+            continue
+        results.append(
+            outcomes.get(
+                decision.id,
+                DecisionResult(message_id=decision.id, outcome=DecisionOutcome.NOT_FOUND, error=not_found),
+            )
         )
+    return results
 
 
 async def accept_message(message_id: str) -> None:
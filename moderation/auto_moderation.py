@@ -0,0 +1,146 @@
+"""Automatic moderation stage, ahead of the manual moderation queue.
+
+Consumes the incoming events and evaluates the rules on each of them: the accepted and rejected ones are
+published to handling like a manual decision, only the others are forwarded to the manual moderation queue.
+"""
+
+from aio_pika import RobustChannel, RobustQueue
+from aio_pika import exceptions as aio_pika_exceptions
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.desp.rabbitmq.mq_message import ModerationEventStatus
+from msfwk.mqclient import RabbitMQConfig
+from msfwk.utils.logging import get_logger
+
+from moderation.decision_pipeline import dispatch_decisions
+from moderation.decoding import DecodedMessage, decode_message
+from moderation.metrics import AUTO_MODERATION_VERDICTS, RULE_EVALUATION_SECONDS
+from moderation.models.config import ModerationConfig
+from moderation.models.constants import (
+    AUTO_ACCEPTED_HISTORY_MESSAGE,
+    AUTO_REJECTED_HISTORY_MESSAGE,
+)
+from moderation.models.interfaces import MQLoadErrorMessage
+from moderation.mq_pool import MQChannelPool
+from moderation.publishing import forward_message
+from moderation.rules import RuleSet, RuleVerdict
+from moderation.seen_ids import decision_of
+from moderation.sharding import event_queue
+from moderation.utils import ack_message
+
+logger = get_logger(__name__)
+
+DECISIONS = {
+    RuleVerdict.ACCEPT: (ModerationEventStatus.Accepted, AUTO_ACCEPTED_HISTORY_MESSAGE),
+    RuleVerdict.REJECT: (ModerationEventStatus.Rejected, AUTO_REJECTED_HISTORY_MESSAGE),
+}
+
+
+class AutoModerationStage:
+    """Consumer of the incoming queue applying a rule set.
+    A delivery is acked once its decision is confirmed or once it is forwarded to manual moderation,
+    it is requeued when neither could be done.
+    """
+
+    def __init__(self, queue_name: str, manual_queue_name: str, rules: RuleSet, prefetch_count: int) -> None:
+        self.queue_name = queue_name
+        self.manual_queue_name = manual_queue_name
+        self.rules = rules
+        self.prefetch_count = prefetch_count
+        self._channel: RobustChannel | None = None
+        self._queue: RobustQueue | None = None
+        self._consumer_tag: str | None = None
+
+    async def start(self, pool: MQChannelPool) -> None:
+        """Declare the incoming queue on a dedicated channel and start consuming it
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        self._channel = await pool.open_channel(prefetch_count=self.prefetch_count)
+        self._queue = await self._channel.declare_queue(self.queue_name, durable=True)
+        self._consumer_tag = await self._queue.consume(self._on_message, no_ack=False)
+        logger.info("Automatic moderation started on queue %s", self.queue_name)
+
+    async def stop(self) -> None:
+        """Stop consuming, the deliveries not handled yet go back to the queue with the channel"""
+        if self._queue is not None and self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+        if self._channel is not None and not self._channel.is_closed:
+            await self._channel.close()
+        self._channel = self._queue = self._consumer_tag = None
+
+    async def _on_message(self, message: AbstractIncomingMessage) -> None:
+        errors: list[MQLoadErrorMessage] = []
+        decoded = decode_message(message, errors)
+        if decoded is None:
+            # Left to the manual moderation, which quarantines what it can't read
+            await self._forward(message, self.manual_queue_name)
+            return
+        if await decision_of(decoded.id, confirmed=True) is not None:
+            logger.debug("Event %s already decided, dropping its copy", decoded.id)
+            await ack_message(message)
+            return
+
+        try:
+            with RULE_EVALUATION_SECONDS.time():
+                match = self.rules.evaluate(decoded)
+            AUTO_MODERATION_VERDICTS.labels(match.verdict.value, match.rule).inc()
+            logger.debug("Event %s: %r", decoded.id, match)
+            if match.verdict != RuleVerdict.MANUAL:
+                await self._decide(decoded, message, match.verdict)
+                return
+        except Exception as error:  # noqa: BLE001
+            logger.exception("Automatic moderation failed on event %s", decoded.id, exc_info=error)
+        await self._forward(message, event_queue(self.manual_queue_name, decoded))
+
+    async def _decide(self, decoded: DecodedMessage, message: AbstractIncomingMessage, verdict: RuleVerdict) -> None:
+        """Publish the decision to handling, the delivery is acked once confirmed or requeued"""
+        status, history = DECISIONS[verdict]
+        mq_message = decoded.mq_message
+        mq_message.status = status
+        mq_message.history.append(history)
+        logger.info("apply automatic moderation on message: %s", decoded.id)
+        await dispatch_decisions([(mq_message, message)], wait=False)
+
+    async def _forward(self, message: AbstractIncomingMessage, queue_name: str) -> None:
+        """Hand the event over to manual moderation, straight to the shard of its area when sharded"""
+        if self._channel is None:
+            return
+        try:
+            await forward_message(self._channel, message, queue_name)
+        except (aio_pika_exceptions.AMQPError, ConnectionError) as error:
+            logger.exception("Failed to forward message %s to manual moderation", message.message_id, exc_info=error)
+            await message.nack(requeue=True)
+            return
+        await ack_message(message)
+
+
+_stage: AutoModerationStage | None = None
+
+
+async def start_auto_moderation(pool: MQChannelPool) -> AutoModerationStage:
+    """Compile the rules and start the automatic moderation stage
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        pydantic.ValidationError: the rules are malformed
+        re.error: a pattern is not a valid regular expression
+    """
+    global _stage  # noqa: PLW0603
+    rules = RuleSet.from_config(ModerationConfig.AUTO_MODERATION_RULES)
+    _stage = AutoModerationStage(
+        ModerationConfig.AUTO_MODERATION_QUEUE,
+        RabbitMQConfig.MANUAL_MODERATION_QUEUE,
+        rules,
+        ModerationConfig.AUTO_MODERATION_PREFETCH,
+    )
+    await _stage.start(pool)
+    return _stage
+
+
+async def stop_auto_moderation() -> None:
+    """Stop the automatic moderation stage"""
+    global _stage  # noqa: PLW0603
+    if _stage is not None:
+        await _stage.stop()
+        _stage = None
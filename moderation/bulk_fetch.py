@@ -0,0 +1,93 @@
+"""Bulk fetch of the deliveries of a queue with basic.consume, in place of a basic.get per message.
+
+The broker pushes the deliveries ahead into a buffer, up to the QoS prefetch window, so a read pass costs a few
+round trips instead of one per message. A consumer is never told that the queue is empty: the pass ends once it
+received as many messages as were ready when it started, or after `idle` seconds without any delivery when other
+consumers took some of them.
+"""
+
+import asyncio
+
+from aio_pika import IncomingMessage, RobustChannel, RobustQueue
+from aio_pika import exceptions as aio_pika_exceptions
+from msfwk.utils.logging import get_logger
+
+from moderation.metrics import FETCH_SECONDS
+from moderation.models.exceptions import MQServerConnectionError
+
+logger = get_logger(__name__)
+
+
+class BulkFetch:
+    """A consumer on a pooled channel feeding a buffer of deliveries, cancelled when the pass ends.
+    `window_full` is set when the pass stopped because the prefetch window was full of held deliveries.
+    """
+
+    def __init__(self, channel: RobustChannel, queue: RobustQueue, prefetch_count: int, idle: float) -> None:
+        self.channel = channel
+        self.queue = queue
+        self.prefetch_count = prefetch_count
+        self.idle = idle
+        # Messages ready when the pass started, as reported by the queue declaration
+        self.expected = queue.declaration_result.message_count or 0
+        self.delivered = 0
+        self.window_full = False
+        self._buffer: asyncio.Queue[IncomingMessage] = asyncio.Queue()
+        self._consumer_tag: str | None = None
+        self._closed = False
+
+    async def start(self) -> None:
+        """Set the prefetch window and start consuming, nothing to do on an empty queue
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        if self.expected == 0:
+            return
+        try:
+            await self.channel.set_qos(prefetch_count=self.prefetch_count)
+            self._consumer_tag = await self.queue.consume(self._on_delivery, no_ack=False)
+        except ConnectionError as ce:
+            err_message = f"Connection lost while consuming messages: {ce}"
+            logger.exception(err_message, exc_info=ce)
+            raise MQServerConnectionError(err_message) from ce
+
+    async def next_delivery(self, deadline: float | None) -> IncomingMessage | None:
+        """Wait for the next delivery, None once the ready messages are all received,
+        after `idle` seconds without a delivery or at the deadline
+        """
+        if self._buffer.empty() and self.delivered >= self.expected:
+            return None
+        timeout = self.idle
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - asyncio.get_running_loop().time()))
+        try:
+            with FETCH_SECONDS.labels(self.queue.name).time():
+                return await asyncio.wait_for(self._buffer.get(), timeout)
+        except TimeoutError:
+            self.window_full = 0 < self.prefetch_count <= self.delivered
+            return None
+
+    async def stop(self) -> list[IncomingMessage]:
+        """Cancel the consumer, returning the deliveries received but not read"""
+        self._closed = True
+        if self._consumer_tag is not None:
+            try:
+                await self.queue.cancel(self._consumer_tag)
+            except (aio_pika_exceptions.AMQPError, ConnectionError) as error:
+                # The deliveries go back to the queue with the channel
+                logger.warning("Failed to cancel the bulk fetch of %s: %s", self.queue.name, error)
+            self._consumer_tag = None
+        # Let the deliveries sent before the cancel reach the buffer
+        await asyncio.sleep(0)
+        leftovers = []
+        while not self._buffer.empty():
+            leftovers.append(self._buffer.get_nowait())
+        return leftovers
+
+    async def _on_delivery(self, message: IncomingMessage) -> None:
+        if self._closed:
+            await message.nack(requeue=True)
+            return
+        self.delivered += 1
+        self._buffer.put_nowait(message)
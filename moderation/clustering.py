@@ -0,0 +1,232 @@
+"""Near-duplicate clustering of the pending events, on a SimHash fingerprint of their content.
+
+The content is cut into shingles of a few words, the 64 bit SimHash of the shingles stays within a few bits of
+the one of a near identical content. The fingerprints are split in max_distance + 1 bands: two fingerprints within
+max_distance bits share at least one band, so the candidates of an event are found by band lookups, not by a scan.
+"""
+
+import re
+from hashlib import blake2b
+from itertools import pairwise
+
+from msfwk.desp.rabbitmq.mq_message import ModerationEventStatus
+from msfwk.utils.logging import get_logger
+
+from moderation.apply_moderation import apply_moderation_batch
+from moderation.coordination import get_coordinator
+from moderation.decoding import DecodedMessage, content_text
+from moderation.models.config import ModerationConfig
+from moderation.models.exceptions import ClusterNotFoundError
+from moderation.models.interfaces import (
+    DecisionResult,
+    EventCluster,
+    ModerationDecision,
+)
+from moderation.pending_index import PendingEventIndex, get_pending_index
+from moderation.sharding import get_sharded_messages
+
+logger = get_logger(__name__)
+
+FINGERPRINT_BITS = 64
+WORD = re.compile(r"\w+")
+
+
+def fingerprint(text: str, shingle_size: int) -> int | None:
+    """SimHash of the word shingles of a text, None when the text has no word"""
+    words = WORD.findall(text.casefold())
+    if not words:
+        return None
+    shingles = {" ".join(words[i : i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles:
+        digest = int.from_bytes(blake2b(shingle.encode(), digest_size=FINGERPRINT_BITS // 8).digest())
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if digest >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def _bands(max_distance: int) -> list[tuple[int, int]]:
+    """Shift and mask of each band"""
+    count = min(max_distance + 1, FINGERPRINT_BITS)
+    bounds = [FINGERPRINT_BITS * i // count for i in range(count + 1)]
+    return [(low, (1 << (high - low)) - 1) for low, high in pairwise(bounds)]
+
+
+class Cluster:
+    """Events whose content is within max_distance bits of the fingerprint of the event that started the cluster"""
+
+    __slots__ = ("fingerprint", "id", "members")
+
+    def __init__(self, cluster_id: str, fingerprint: int) -> None:
+        self.id = cluster_id
+        self.fingerprint = fingerprint
+        self.members: dict[str, None] = {}
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def to_event_cluster(self) -> EventCluster:
+        """Describe the cluster"""
+        return EventCluster(cluster_id=self.id, size=len(self.members), message_ids=list(self.members))
+
+
+class ContentClusterIndex:
+    """Clusters of near-duplicate events, kept up to date as a pending index listener or fed by hand.
+    A cluster is named after the event that started it, and keeps its fingerprint until its last member leaves.
+    """
+
+    def __init__(self, max_distance: int, shingle_size: int) -> None:
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self._bands = _bands(max_distance)
+        self._clusters: dict[str, Cluster] = {}
+        self._membership: dict[str, str] = {}
+        self._buckets: dict[tuple[int, int], set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    def on_added(self, decoded: DecodedMessage) -> None:
+        value = fingerprint(content_text(decoded.body), self.shingle_size)
+        if value is None:
+            return
+        cluster = self._nearest(value)
+        if cluster is None:
+            cluster = Cluster(decoded.id, value)
+            self._clusters[cluster.id] = cluster
+            for key in self._keys(value):
+                self._buckets.setdefault(key, set()).add(cluster.id)
+        cluster.members[decoded.id] = None
+        self._membership[decoded.id] = cluster.id
+
+    def on_removed(self, decoded: DecodedMessage) -> None:
+        cluster_id = self._membership.pop(decoded.id, None)
+        cluster = self._clusters.get(cluster_id) if cluster_id is not None else None
+        if cluster is None:
+            return
+        cluster.members.pop(decoded.id, None)
+        if not cluster.members:
+            del self._clusters[cluster.id]
+            for key in self._keys(cluster.fingerprint):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(cluster.id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def on_cleared(self) -> None:
+        self._clusters.clear()
+        self._membership.clear()
+        self._buckets.clear()
+
+    def get(self, cluster_id: str) -> Cluster:
+        """Return a cluster
+
+        Raises:
+            ClusterNotFoundError: no pending event is left in this cluster
+        """
+        cluster = self._clusters.get(cluster_id)
+        if cluster is None:
+            message = f"Cluster not found: {cluster_id}"
+            raise ClusterNotFoundError(message)
+        return cluster
+
+    def cluster_of(self, message_id: str) -> Cluster | None:
+        """Return the cluster of an event, None when its content has no word"""
+        cluster_id = self._membership.get(message_id)
+        return self._clusters.get(cluster_id) if cluster_id is not None else None
+
+    def clusters(self, min_size: int = 2) -> list[Cluster]:
+        """The clusters of at least min_size events, largest first"""
+        return sorted(
+            (cluster for cluster in self._clusters.values() if len(cluster) >= min_size), key=len, reverse=True
+        )
+
+    def _keys(self, value: int) -> list[tuple[int, int]]:
+        return [(band, value >> shift & mask) for band, (shift, mask) in enumerate(self._bands)]
+
+    def _nearest(self, value: int) -> Cluster | None:
+        best: Cluster | None = None
+        best_distance = self.max_distance + 1
+        for key in self._keys(value):
+            for cluster_id in self._buckets.get(key, ()):
+                distance = (self._clusters[cluster_id].fingerprint ^ value).bit_count()
+                if distance < best_distance:
+                    best, best_distance = self._clusters[cluster_id], distance
+        return best
+
+
+def new_cluster_index() -> ContentClusterIndex:
+    """A cluster index with the configured distance and shingle size"""
+    return ContentClusterIndex(ModerationConfig.CLUSTER_MAX_DISTANCE, ModerationConfig.CLUSTER_SHINGLE_SIZE)
+
+
+_cluster_indexes: dict[str, ContentClusterIndex] = {}
+
+
+def cluster_pending_index(index: PendingEventIndex) -> ContentClusterIndex:
+    """Cluster the events of a pending index as they arrive"""
+    clusters = new_cluster_index()
+    index.add_listener(clusters)
+    _cluster_indexes[index.queue_name] = clusters
+    return clusters
+
+
+def cluster_messages(messages: list[DecodedMessage]) -> ContentClusterIndex:
+    """Cluster a list of events read from a queue"""
+    clusters = new_cluster_index()
+    for decoded in messages:
+        clusters.on_added(decoded)
+    return clusters
+
+
+def resident_clusters(queue_name: str) -> ContentClusterIndex | None:
+    """The clusters kept by the pending index of the queue, None when that index doesn't hold every event"""
+    index = get_pending_index(queue_name)
+    if index is None or index.saturated or get_coordinator(queue_name) is not None:
+        return None
+    return _cluster_indexes.get(queue_name)
+
+
+async def get_content_clusters(queue_name: str) -> ContentClusterIndex:
+    """The clusters of the pending index of the queue, or of the events read from the queue without one.
+    A cluster starts with its oldest event in queue order, so its id is stable from one read to the next.
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    clusters = resident_clusters(queue_name)
+    if clusters is None:
+        messages, _ = await get_sharded_messages(queue_name)
+        clusters = cluster_messages(messages)
+    return clusters
+
+
+def page_clusters(clusters: ContentClusterIndex, page: list[DecodedMessage]) -> list[EventCluster]:
+    """The clusters of more than one event among the events of a page, with all their members"""
+    found: dict[str, Cluster] = {}
+    for decoded in page:
+        cluster = clusters.cluster_of(decoded.id)
+        if cluster is not None and len(cluster) > 1:
+            found.setdefault(cluster.id, cluster)
+    return [cluster.to_event_cluster() for cluster in found.values()]
+
+
+async def decide_cluster(
+    queue_name: str, cluster_id: str, status: ModerationEventStatus, history: str
+) -> list[DecisionResult]:
+    """Apply the same decision to every event of a cluster, in one batch
+
+    Raises:
+        ClusterNotFoundError: no pending event is left in this cluster
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+
+    Returns:
+        list[DecisionResult]: the outcome for each event of the cluster
+    """
+    cluster = (await get_content_clusters(queue_name)).get(cluster_id)
+    decisions = [ModerationDecision(id=message_id, status=status, history=history) for message_id in cluster.members]
+    logger.info("Decision %s on the %s events of cluster %s", status, len(decisions), cluster_id)
+    return await apply_moderation_batch(decisions)
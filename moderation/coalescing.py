@@ -0,0 +1,92 @@
+"""Single-flight reads of the moderation queues.
+
+Identical reads of a queue issued while one is in flight wait for it and share its result instead of draining the
+queue again, the result is then served for READ_FRESHNESS_SECONDS. Decisions and deletions invalidate the reads of
+their queue: the passes started before them are neither shared nor kept any more.
+"""
+
+import asyncio
+from collections import Counter
+from collections.abc import Awaitable, Callable, Hashable
+from functools import partial
+from typing import Any, TypeVar
+
+from msfwk.utils.logging import get_logger
+
+from moderation.metrics import COALESCED_READS
+from moderation.models.config import ModerationConfig
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+ReadKey = tuple[str, str, Hashable]
+
+
+class ReadCoalescer:
+    """In-flight and recent reads, keyed by queue, operation and arguments"""
+
+    def __init__(self) -> None:
+        self._flights: dict[ReadKey, asyncio.Task[Any]] = {}
+        self._results: dict[ReadKey, tuple[float, Any]] = {}
+        self._generations: Counter[str] = Counter()
+
+    async def read(self, queue_name: str, operation: str, argument: Hashable, reader: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of `reader`, shared with the identical reads in flight or fresh enough
+
+        Args:
+            queue_name (str): RabbitMQ queue name, the scope of the invalidations
+            operation (str): name of the read
+            argument (Hashable): what makes two reads of the same operation identical
+            reader (Callable[[], Awaitable[T]]): the read itself, only called when nothing can be shared
+        """
+        if not ModerationConfig.READ_COALESCING_ENABLED:
+            return await reader()
+
+        key = (queue_name, operation, argument)
+        loop = asyncio.get_running_loop()
+        recent = self._results.get(key)
+        if recent is not None and loop.time() - recent[0] < ModerationConfig.READ_FRESHNESS_SECONDS:
+            COALESCED_READS.labels(operation, "fresh").inc()
+            return recent[1]
+
+        flight = self._flights.get(key)
+        if flight is None:
+            COALESCED_READS.labels(operation, "read").inc()
+            flight = asyncio.create_task(reader(), name=f"read-{operation}-{queue_name}")
+            self._flights[key] = flight
+            flight.add_done_callback(partial(self._landed, key, self._generations[queue_name]))
+        else:
+            COALESCED_READS.labels(operation, "shared").inc()
+        # A caller going away must not cancel the read the others wait for
+        return await asyncio.shield(flight)
+
+    def invalidate(self, queue_name: str) -> None:
+        """Forget the reads of a queue, the next ones read it again"""
+        self._generations[queue_name] += 1
+        for key in [key for key in self._flights if key[0] == queue_name]:
+            del self._flights[key]
+        for key in [key for key in self._results if key[0] == queue_name]:
+            del self._results[key]
+
+    def _landed(self, key: ReadKey, generation: int, flight: asyncio.Task[Any]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.cancelled() or flight.exception() is not None:
+            return
+        # A read overtaken by a decision or a deletion may hold what they removed
+        if self._generations[key[0]] == generation and ModerationConfig.READ_FRESHNESS_SECONDS > 0:
+            self._results[key] = (asyncio.get_running_loop().time(), flight.result())
+
+
+_coalescer = ReadCoalescer()
+
+
+def get_read_coalescer() -> ReadCoalescer:
+    """Return the read coalescer of this replica"""
+    return _coalescer
+
+
+def invalidate_reads(queue_name: str) -> None:
+    """Forget the shared reads of a queue after its messages have been decided or deleted"""
+    _coalescer.invalidate(queue_name)
@@ -0,0 +1,300 @@
+"""Coordination of the replicas of the service, through Redis.
+
+Each replica consumes the moderation queue with its own pending index, so the pending events are spread over the
+replicas and only the replica holding a delivery can ack it. The replicas share:
+
+- the ids and bodies of the events held by each replica, so a listing or a lookup on any replica sees them all,
+- an inbox per replica, where the decisions and deletions of the events it holds are routed and answered.
+
+Each replica writes the events it holds to a hash of its own, so it never overwrites nor withdraws the copies of
+the same ids held by another one. A replica announces itself with a heartbeat key, the events of a replica whose
+heartbeat expired are ignored, and expire with it: the broker gave its deliveries back to the queue.
+Without `redis_url`, the state lives in the in-process stand-in of redis_store, shared by the coordinators of one
+process.
+"""
+
+import asyncio
+import json
+import math
+import socket
+from collections.abc import Awaitable, Callable
+from uuid import uuid4
+
+from msfwk.utils.logging import get_logger
+
+from moderation.decoding import DecodedMessage
+from moderation.models.config import ModerationConfig
+from moderation.models.exceptions import (
+    AlreadyDecidedError,
+    MQMessageNotFoundError,
+    MQQueueNotFoundError,
+    MQServerConnectionError,
+)
+from moderation.pending_index import PendingEventIndex
+from moderation.redis_store import LocalRedis, Redis, RedisError, get_shared_store
+
+logger = get_logger(__name__)
+
+Handler = Callable[[dict], Awaitable[object]]
+
+# Errors raised by a replica serving a request, raised again on the replica that routed it
+ROUTED_ERRORS: dict[str, type[Exception]] = {
+    error.__name__: error for error in (AlreadyDecidedError, MQMessageNotFoundError, MQQueueNotFoundError)
+}
+
+
+class ReplicaCoordinator:
+    """Share the events held by the pending index of this replica and serve the requests routed to it.
+    Registered as a listener of the pending index, the changes are written to the store by a background task.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        store: "Redis | LocalRedis",
+        replica_id: str,
+        queue_name: str,
+        prefix: str,
+        heartbeat: float,
+        request_timeout: float,
+    ) -> None:
+        self.store = store
+        self.replica_id = replica_id
+        self.queue_name = queue_name
+        self.prefix = prefix
+        self.heartbeat = heartbeat
+        self.request_timeout = request_timeout
+        # A replica is alive for three heartbeats, in milliseconds as Redis rejects fractional seconds
+        self._ttl = max(1, round(heartbeat * 3000))
+        self._replicas_key = f"{prefix}replicas:{queue_name}"
+        self._changes: asyncio.Queue[tuple[str, DecodedMessage | None]] = asyncio.Queue()
+        # Bodies of the events shared by this replica, by id
+        self._held: dict[str, str] = {}
+        self._handlers: dict[str, Handler] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def _alive_key(self, replica_id: str) -> str:
+        return f"{self.prefix}replica:{replica_id}"
+
+    def _inbox_key(self, replica_id: str) -> str:
+        return f"{self.prefix}inbox:{replica_id}"
+
+    def _held_key(self, replica_id: str) -> str:
+        return f"{self.prefix}held:{self.queue_name}:{replica_id}"
+
+    def on_added(self, decoded: DecodedMessage) -> None:
+        self._changes.put_nowait(("added", decoded))
+
+    def on_removed(self, decoded: DecodedMessage) -> None:
+        self._changes.put_nowait(("removed", decoded))
+
+    def on_cleared(self) -> None:
+        self._changes.put_nowait(("cleared", None))
+
+    def add_handler(self, action: str, handler: Handler) -> None:
+        """Serve the requests of an action routed to this replica"""
+        self._handlers[action] = handler
+
+    async def start(self) -> None:
+        """Announce the replica, then share its events and serve its inbox in the background"""
+        await self._beat()
+        self._tasks = [
+            asyncio.create_task(self._run_heartbeat(), name="coordination-heartbeat"),
+            asyncio.create_task(self._run_changes(), name="coordination-changes"),
+            asyncio.create_task(self._run_inbox(), name="coordination-inbox"),
+        ]
+        logger.info("Replica %s coordinating queue %s", self.replica_id, self.queue_name)
+
+    async def stop(self) -> None:
+        """Stop the background tasks and withdraw the events of the replica"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.store.delete(self._held_key(self.replica_id), self._alive_key(self.replica_id))
+            await self.store.srem(self._replicas_key, self.replica_id)
+        except (RedisError, ConnectionError) as error:
+            logger.warning("Failed to withdraw replica %s: %s", self.replica_id, error)
+        self._held.clear()
+
+    async def remote_owners(self, message_ids: list[str]) -> dict[str, list[str]]:
+        """The ids held by the other live replicas, grouped by replica"""
+        held: dict[str, list[str]] = {}
+        if not message_ids:
+            return held
+        owned: set[str] = set()
+        for replica_id in await self._others():
+            bodies = await self.store.hmget(self._held_key(replica_id), message_ids)
+            for message_id, body in zip(message_ids, bodies, strict=True):
+                if body is not None and message_id not in owned:
+                    owned.add(message_id)
+                    held.setdefault(replica_id, []).append(message_id)
+        return held
+
+    async def remote_messages(self) -> list[DecodedMessage]:
+        """The events held by the other live replicas"""
+        bodies: dict[str, str] = {}
+        for replica_id in await self._others():
+            for message_id, body in (await self.store.hgetall(self._held_key(replica_id))).items():
+                bodies.setdefault(message_id, body)
+        return [decoded for body in bodies.values() if (decoded := _decode(body)) is not None]
+
+    async def remote_message(self, message_id: str) -> DecodedMessage | None:
+        """The event with the given id if another live replica holds it"""
+        for replica_id in await self.remote_owners([message_id]):
+            body = await self.store.hget(self._held_key(replica_id), message_id)
+            return _decode(body) if body is not None else None
+        return None
+
+    async def call(self, replica_id: str, action: str, payload: dict) -> object:
+        """Route a request to a replica and wait for its answer
+
+        Raises:
+            MQServerConnectionError: the replica did not answer in time or the store is unreachable
+            AlreadyDecidedError, MQMessageNotFoundError, MQQueueNotFoundError: raised by the replica
+        """
+        request_id = uuid4().hex
+        reply_key = f"{self.prefix}reply:{request_id}"
+        request = {"id": request_id, "action": action, "payload": payload, "reply_to": reply_key}
+        try:
+            await self.store.rpush(self._inbox_key(replica_id), json.dumps(request))
+            reply = await self.store.blpop([reply_key], timeout=self.request_timeout)
+        except (RedisError, ConnectionError) as error:
+            message = f"Failed to route {action} to replica {replica_id}: {error}"
+            raise MQServerConnectionError(message) from error
+        if reply is None:
+            message = f"Replica {replica_id} did not answer {action} in {self.request_timeout}s"
+            raise MQServerConnectionError(message)
+        answer = json.loads(reply[1])
+        if "error" in answer:
+            raise ROUTED_ERRORS.get(answer["error"], MQServerConnectionError)(answer["message"])
+        return answer["result"]
+
+    async def _others(self) -> list[str]:
+        """The other live replicas, the ones whose heartbeat expired are forgotten"""
+        replica_ids = sorted(set(await self.store.smembers(self._replicas_key)) - {self.replica_id})
+        if not replica_ids:
+            return []
+        beats = await self.store.mget([self._alive_key(replica_id) for replica_id in replica_ids])
+        dead = [replica_id for replica_id, beat in zip(replica_ids, beats, strict=True) if beat is None]
+        if dead:
+            await self.store.srem(self._replicas_key, *dead)
+        return [replica_id for replica_id, beat in zip(replica_ids, beats, strict=True) if beat is not None]
+
+    async def _beat(self) -> None:
+        """Announce the replica for three heartbeats, its events expire with it"""
+        await self.store.set(self._alive_key(self.replica_id), "1", px=self._ttl)
+        await self.store.sadd(self._replicas_key, self.replica_id)
+        # Shared again when they expired while the replica could not reach the store
+        if not await self.store.pexpire(self._held_key(self.replica_id), self._ttl) and self._held:
+            await self.store.hset(self._held_key(self.replica_id), mapping=self._held)
+            await self.store.pexpire(self._held_key(self.replica_id), self._ttl)
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self._beat()
+            except (RedisError, ConnectionError) as error:
+                logger.warning("Replica %s heartbeat failed: %s", self.replica_id, error)
+
+    async def _run_changes(self) -> None:
+        """Write the changes of the pending index to the store, in batches"""
+        while True:
+            batch = [await self._changes.get()]
+            while not self._changes.empty():
+                batch.append(self._changes.get_nowait())
+            added: dict[str, str] = {}
+            removed: set[str] = set()
+            for change, decoded in batch:
+                if decoded is None:
+                    removed |= self._held.keys() | added.keys()
+                    added.clear()
+                    self._held.clear()
+                elif change == "added":
+                    added[decoded.id] = self._held[decoded.id] = decoded.body.decode(errors="replace")
+                    removed.discard(decoded.id)
+                else:
+                    added.pop(decoded.id, None)
+                    removed.add(decoded.id)
+                    self._held.pop(decoded.id, None)
+            held_key = self._held_key(self.replica_id)
+            try:
+                if removed:
+                    await self.store.hdel(held_key, *removed)
+                if added:
+                    await self.store.hset(held_key, mapping=added)
+                    await self.store.pexpire(held_key, self._ttl)
+            except (RedisError, ConnectionError) as error:
+                logger.warning("Failed to share %s pending index changes: %s", len(batch), error)
+
+    async def _run_inbox(self) -> None:
+        """Serve the requests routed to this replica, each one in its own task"""
+        inbox = self._inbox_key(self.replica_id)
+        pending: set[asyncio.Task] = set()
+        while True:
+            try:
+                item = await self.store.blpop([inbox], timeout=self.heartbeat)
+            except (RedisError, ConnectionError) as error:
+                logger.warning("Replica %s inbox unavailable: %s", self.replica_id, error)
+                await asyncio.sleep(self.heartbeat)
+                continue
+            if item is not None:
+                task = asyncio.create_task(self._answer(json.loads(item[1])))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+    async def _answer(self, request: dict) -> None:
+        handler = self._handlers.get(request["action"])
+        try:
+            if handler is None:
+                message = f"Unknown action {request['action']}"
+                raise MQServerConnectionError(message)
+            answer = {"result": await handler(request["payload"])}
+        except Exception as error:  # noqa: BLE001
+            logger.warning("Routed %s failed: %s", request["action"], error)
+            answer = {"error": type(error).__name__, "message": str(error)}
+        try:
+            await self.store.rpush(request["reply_to"], json.dumps(answer))
+            await self.store.expire(request["reply_to"], math.ceil(self.request_timeout))
+        except (RedisError, ConnectionError) as error:
+            logger.warning("Failed to answer routed %s: %s", request["action"], error)
+
+
+def _decode(body: str) -> DecodedMessage | None:
+    try:
+        return DecodedMessage.from_body(body.encode())
+    except ValueError as error:
+        logger.warning("Invalid event shared by another replica: %s", error)
+        return None
+
+
+_coordinators: dict[str, ReplicaCoordinator] = {}
+
+
+async def start_coordination(index: PendingEventIndex) -> ReplicaCoordinator:
+    """Share the events of a pending index with the other replicas and serve the requests routed to this one"""
+    coordinator = ReplicaCoordinator(
+        get_shared_store(),
+        ModerationConfig.COORDINATION_REPLICA_ID or f"{socket.gethostname()}-{uuid4().hex[:8]}",
+        index.queue_name,
+        ModerationConfig.COORDINATION_PREFIX,
+        ModerationConfig.COORDINATION_HEARTBEAT,
+        ModerationConfig.COORDINATION_REQUEST_TIMEOUT,
+    )
+    index.add_listener(coordinator)
+    await coordinator.start()
+    _coordinators[index.queue_name] = coordinator
+    return coordinator
+
+
+def get_coordinator(queue_name: str) -> ReplicaCoordinator | None:
+    """Return the coordinator of the given queue, None when the replicas of the queue are not coordinated"""
+    return _coordinators.get(queue_name)
+
+
+async def stop_coordination() -> None:
+    """Stop every coordinator, withdrawing the events of this replica"""
+    while _coordinators:
+        _, coordinator = _coordinators.popitem()
+        await coordinator.stop()
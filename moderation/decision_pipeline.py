@@ -0,0 +1,217 @@
+"""Asynchronous publication of the moderation decisions.
+
+Decided messages are buffered and published to handling in batches with publisher confirms.
+The original delivery is acked only once its decision is confirmed, a decision that can't be published
+is retried, then its delivery is requeued so the event comes back to moderation instead of being lost.
+Every decision is recorded in the seen-id index, so the other copies of a decided event are dropped.
+"""
+
+import asyncio
+
+from aio_pika import exceptions as aio_pika_exceptions
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.desp.rabbitmq.mq_message import DespMQMessage
+from msfwk.mqclient import RabbitMQConfig
+from msfwk.utils.logging import get_logger
+
+from moderation.fetch_messages import requeue_messages
+from moderation.metrics import DECISION_BATCH_SIZE, DECISION_BUFFER_SIZE
+from moderation.models.config import ModerationConfig
+from moderation.models.exceptions import MQServerConnectionError
+from moderation.mq_pool import get_mq_pool
+from moderation.publishing import publish_messages
+from moderation.seen_ids import forget_decision, mark_decided, mark_deciding
+from moderation.utils import ack_message
+
+logger = get_logger(__name__)
+
+
+class PendingDecision:
+    """A decided message waiting for its publication, `confirmed` resolves once its delivery is acked"""
+
+    __slots__ = ("confirmed", "incoming_message", "mq_message")
+
+    def __init__(self, mq_message: DespMQMessage, incoming_message: AbstractIncomingMessage) -> None:
+        self.mq_message = mq_message
+        self.incoming_message = incoming_message
+        self.confirmed: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+
+async def publish_decisions(decisions: list[PendingDecision], retries: int, retry_delay: float) -> None:
+    """Publish decisions to handling in one batch, ack the confirmed ones and retry the others.
+    The deliveries of the decisions still failing after the retries are requeued.
+
+    Args:
+        decisions (list[PendingDecision]): decisions to publish
+        retries (int): number of new attempts for the failed publications
+        retry_delay (float): seconds before the first retry, doubled on each attempt
+    """
+    pending = decisions
+    failures: list[BaseException | None] = []
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(retry_delay * 2 ** (attempt - 1))
+        try:
+            async with get_mq_pool().acquire() as channel:
+                failures = await publish_messages(
+                    channel,
+                    [decision.mq_message for decision in pending],
+                    RabbitMQConfig.MODERATION_EXCHANGE,
+                    RabbitMQConfig.TO_HANDLING_RKEY,
+                )
+        except MQServerConnectionError as error:
+            failures = [error] * len(pending)
+
+        retry: list[PendingDecision] = []
+        for decision, error in zip(pending, failures, strict=True):
+            if error is None:
+                await _acknowledge(decision)
+            else:
+                retry.append(decision)
+        failures = [error for error in failures if error is not None]
+        pending = retry
+        if not pending:
+            return
+        logger.warning("%s decisions failed to publish (attempt %s)", len(pending), attempt + 1)
+
+    for decision, error in zip(pending, failures, strict=True):
+        logger.error("Decision on message %s not published, the event goes back to moderation", decision.mq_message.id)
+        forget_decision(decision.mq_message.id)
+        await requeue_messages([decision.incoming_message])
+        if not decision.confirmed.done():
+            decision.confirmed.set_exception(error)
+
+
+async def _acknowledge(decision: PendingDecision) -> None:
+    """Ack the delivery of a published decision"""
+    await mark_decided(decision.mq_message.id, decision.mq_message.status)
+    try:
+        await ack_message(decision.incoming_message)
+    except (aio_pika_exceptions.AMQPError, ConnectionError) as error:
+        # The decision is out, the event will be redelivered and may be decided twice
+        logger.exception("Failed to ack message %s after its decision", decision.mq_message.id, exc_info=error)
+    if not decision.confirmed.done():
+        decision.confirmed.set_result(None)
+
+
+class DecisionPipeline:
+    """Bounded buffer of decisions, flushed by a background task in batches of up to `batch_size`.
+    A batch is sent as soon as it is full or `flush_interval` seconds after its first decision.
+    """
+
+    def __init__(self, buffer_size: int, batch_size: int, flush_interval: float, retries: int) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._buffer: asyncio.Queue[PendingDecision] = asyncio.Queue(maxsize=buffer_size)
+        self._worker: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return self._buffer.qsize()
+
+    @property
+    def running(self) -> bool:
+        """True while the background task publishes the buffered decisions"""
+        return self._worker is not None and not self._worker.done()
+
+    def start(self) -> None:
+        """Start the background task"""
+        self._worker = asyncio.create_task(self._run(), name="decision-pipeline")
+        DECISION_BUFFER_SIZE.set_function(self.__len__)
+
+    async def stop(self) -> None:
+        """Publish the buffered decisions, then stop the background task"""
+        if self.running:
+            await self._buffer.join()
+        if self._worker is not None:
+            self._worker.cancel()
+        self._worker = None
+
+    async def submit(self, decision: PendingDecision) -> None:
+        """Buffer a decision, waiting for room when the buffer is full"""
+        await self._buffer.put(decision)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._buffer.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size and (timeout := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(self._buffer.get(), timeout))
+                except TimeoutError:
+                    break
+            DECISION_BATCH_SIZE.observe(len(batch))
+            try:
+                await publish_decisions(batch, self.retries, ModerationConfig.DECISION_RETRY_DELAY)
+            except Exception as error:  # noqa: BLE001
+                logger.exception("Decision batch failed, the events go back to moderation", exc_info=error)
+                await requeue_messages(decision.incoming_message for decision in batch)
+                for decision in batch:
+                    if not decision.confirmed.done():
+                        forget_decision(decision.mq_message.id)
+                        decision.confirmed.set_exception(error)
+            finally:
+                for _ in batch:
+                    self._buffer.task_done()
+
+
+_pipeline: DecisionPipeline | None = None
+
+
+def start_decision_pipeline() -> DecisionPipeline:
+    """Create and start the service wide decision pipeline"""
+    global _pipeline  # noqa: PLW0603
+    _pipeline = DecisionPipeline(
+        ModerationConfig.DECISION_BUFFER_SIZE,
+        ModerationConfig.DECISION_BATCH_SIZE,
+        ModerationConfig.DECISION_FLUSH_INTERVAL,
+        ModerationConfig.DECISION_PUBLISH_RETRIES,
+    )
+    _pipeline.start()
+    return _pipeline
+
+
+async def stop_decision_pipeline() -> None:
+    """Flush and stop the decision pipeline"""
+    global _pipeline  # noqa: PLW0603
+    if _pipeline is not None:
+        await _pipeline.stop()
+        _pipeline = None
+
+
+def _consume_result(future: asyncio.Future[None]) -> None:
+    """Nobody waits for this decision, failures have already been logged"""
+    if not future.cancelled():
+        future.exception()
+
+
+async def dispatch_decisions(
+    decided: list[tuple[DespMQMessage, AbstractIncomingMessage]], *, wait: bool
+) -> list[BaseException | None]:
+    """Publish decided messages to handling, through the pipeline when it runs, inline otherwise.
+    Each delivery is acked once its decision is confirmed, or requeued if it can't be published.
+
+    Args:
+        decided (list[tuple[DespMQMessage, AbstractIncomingMessage]]): the decided messages and their deliveries
+        wait (bool): wait for the confirms, the pipeline only buffers the decisions otherwise
+
+    Returns:
+        list[BaseException | None]: for each decision, the error that prevented its publication if any,
+        always None for the decisions buffered without waiting
+    """
+    decisions = [PendingDecision(mq_message, incoming_message) for mq_message, incoming_message in decided]
+    for mq_message, _ in decided:
+        mark_deciding(mq_message.id, mq_message.status)
+    if _pipeline is None or not _pipeline.running:
+        await publish_decisions(
+            decisions, ModerationConfig.DECISION_PUBLISH_RETRIES, ModerationConfig.DECISION_RETRY_DELAY
+        )
+    else:
+        for decision in decisions:
+            await _pipeline.submit(decision)
+        if not wait:
+            for decision in decisions:
+                decision.confirmed.add_done_callback(_consume_result)
+            return [None] * len(decisions)
+    return list(await asyncio.gather(*(decision.confirmed for decision in decisions), return_exceptions=True))
@@ -0,0 +1,146 @@
+"""Decoding of the moderation queue payloads"""
+
+import json
+from collections.abc import Iterator
+
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.desp.rabbitmq.mq_message import DespMQMessage
+from msfwk.utils.logging import get_logger
+from pydantic import ValidationError
+
+from moderation.metrics import DECODE_SECONDS
+from moderation.models.interfaces import (
+    Event,
+    EventSummary,
+    EventView,
+    MQLoadErrorMessage,
+)
+from moderation.tracing import span
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover - orjson is optional
+    from json import loads as json_loads
+
+logger = get_logger(__name__)
+
+
+class DecodedMessage:
+    """A message read from a moderation queue.
+
+    Only the header of the event is validated when the message is read, straight from the raw body
+    by the pydantic JSON parser. The full Event with its content is validated on first access and
+    the DespMQMessage is built on first access, `decode_message` builds it upfront so a body msfwk
+    cannot publish again is rejected when the message is read.
+    """
+
+    __slots__ = ("_event", "_mq_message", "body", "summary")
+
+    def __init__(
+        self,
+        body: bytes,
+        summary: EventSummary,
+        event: Event | None = None,
+        mq_message: DespMQMessage | None = None,
+    ) -> None:
+        self.body = body
+        self.summary = summary
+        self._event = event
+        self._mq_message = mq_message
+
+    @property
+    def id(self) -> str:
+        """Id of the moderation event"""
+        return self.summary.id
+
+    @property
+    def event(self) -> Event:
+        """The full event, its content is decoded from the body on first access"""
+        if self._event is None:
+            try:
+                self._event = Event.model_validate_json(self.body)
+            except ValidationError:
+                self._event = Event.from_message(self.mq_message)
+        return self._event
+
+    @property
+    def mq_message(self) -> DespMQMessage:
+        """The msfwk message, decoded from the body on first access"""
+        if self._mq_message is None:
+            self._mq_message = DespMQMessage.from_dict(json_loads(self.body))
+        return self._mq_message
+
+    def view(self, event_view: EventView) -> Event | EventSummary:
+        """The event or only its header, depending on the wanted view"""
+        return self.summary if event_view == EventView.SUMMARY else self.event
+
+    @classmethod
+    def from_body(cls, body: bytes) -> "DecodedMessage":
+        """Decode the header of a message body
+
+        Raises:
+            json.JSONDecodeError: the body is not valid JSON
+            ValueError: the body is not a moderation message
+        """
+        try:
+            return cls(body, EventSummary.model_validate_json(body))
+        except ValidationError:
+            # Not shaped like an Event (or not JSON at all), go through the msfwk model
+            mq_message = DespMQMessage.from_dict(json_loads(body))
+            event = Event.from_message(mq_message)
+            summary = EventSummary.model_construct(
+                **{field: getattr(event, field) for field in EventSummary.model_fields}
+            )
+            return cls(body, summary, event, mq_message)
+
+
+def decode_message(
+    message: AbstractIncomingMessage, errors: list[MQLoadErrorMessage] | None = None
+) -> DecodedMessage | None:
+    """Decode the message carried by a delivery
+
+    Args:
+        message (AbstractIncomingMessage): the delivery
+        errors (list[MQLoadErrorMessage] | None, optional): where to report an invalid payload. Defaults to None.
+
+    Returns:
+        DecodedMessage | None: the message, None if the payload is not valid JSON or not a moderation message
+    """
+    try:
+        with span("moderation.decode", message_id=message.message_id), DECODE_SECONDS.time():
+            decoded = DecodedMessage.from_body(message.body)
+            # The decision is published from the msfwk message, a body it rejects must not reach a moderator
+            decoded.mq_message  # noqa: B018
+            return decoded
+    except json.JSONDecodeError as je:
+        decoded_message = message.body.decode(errors="replace")
+        err_message = f"Invalid message (JSON incorrect): {decoded_message}"
+        logger.exception(err_message, exc_info=je)
+    except (ValueError, KeyError, TypeError) as ve:
+        decoded_message = message.body.decode(errors="replace")
+        err_message = f"Invalid message (not a moderation message: {ve!r}): {decoded_message}"
+        logger.exception(err_message, exc_info=ve)
+    if errors is not None:
+        errors.append(MQLoadErrorMessage(content=decoded_message, error=err_message))
+    return None
+
+
+def _strings(value: object) -> Iterator[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def content_text(body: bytes) -> str:
+    """Every text of the content of a message, one per line"""
+    try:
+        payload = json_loads(body)
+    except ValueError:
+        return ""
+    content = payload.get("content") if isinstance(payload, dict) else None
+    return "\n".join(_strings(content))
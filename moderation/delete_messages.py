@@ -1,11 +1,17 @@
+import asyncio
+from collections import Counter
 from typing import TYPE_CHECKING
 
-from msfwk.mqclient import RabbitMQConfig
 from msfwk.utils.logging import get_logger
 
-from moderation.fetch_messages import get_mq_queue, get_safe_message
+from moderation.coalescing import invalidate_reads
+from moderation.coordination import get_coordinator
+from moderation.fetch_messages import DrainBudget, drain_queue
+from moderation.models.config import ModerationConfig
 from moderation.models.exceptions import MQQueueNotFoundError, MQServerConnectionError
-from moderation.utils import connect_to_rabbitmq
+from moderation.mq_pool import get_mq_pool
+from moderation.pending_index import get_pending_index
+from moderation.utils import ack_message
 
 if TYPE_CHECKING:
     from moderation.moderation.models.interfaces import MQLoadErrorMessage
@@ -13,55 +19,132 @@ if TYPE_CHECKING:
 logger = get_logger(__name__)
 
 
-async def safe_delete_messages_from_queue(queue_name: str, message_id: str) -> bool:
-    """Delete all messages matching id from a RabbitMQ queue.
-    Stores only the body as a dictionary
+async def safe_delete_messages_from_queue(
+    queue_name: str, message_ids: set[str], budget: DrainBudget | None = None
+) -> tuple[dict[str, int], bool]:
+    """Delete all messages matching any of the ids from a RabbitMQ queue, in a single pass.
+    The pending index is used first, the queue is only read past its prefetch window
 
     Args:
         queue_name (str): RabbitMQ queue name
-        message_id (str): id ot the message to remove
+        message_ids (set[str]): ids ot the messages to remove
+        budget (DrainBudget | None): bounds of the pass, tells if messages may be left past it
 
     Return:
-        if the delete has errors or not
+        the number of messages removed per id, and if the delete has errors or not
     """
-    logger.debug("Start deleting messages %s in queue %s", message_id, queue_name)
+    try:
+        return await _delete_messages_from_queue(queue_name, message_ids, budget)
+    finally:
+        invalidate_reads(queue_name)
+
+
+async def _delete_messages_from_queue(
+    queue_name: str, message_ids: set[str], budget: DrainBudget | None
+) -> tuple[dict[str, int], bool]:
+    logger.debug("Start deleting messages %s in queue %s", message_ids, queue_name)
     errors: list[MQLoadErrorMessage] = []
+    removed: Counter[str] = Counter()
+
+    index = get_pending_index(queue_name)
+    if index is not None:
+        removed.update(await delete_held_messages(queue_name, message_ids))
+        routed, success = await route_deletions(queue_name, message_ids - removed.keys())
+        removed.update(routed)
+        if not index.saturated:
+            return dict(removed), success
 
-    client = await connect_to_rabbitmq(RabbitMQConfig)
-    if not client or not client.connection or client.connection.is_closed:
-        message = "No connection for the rabbit_mq client"
-        logger.error(message)
-        return False
     try:
-        async with client.connection:
-            queue = await get_mq_queue(client.connection, queue_name)
-            while mq_message_tuple := await get_safe_message(queue, errors):
-                mq_message, incomming_message = mq_message_tuple
-                if mq_message.id == message_id:
-                    logger.debug("Deleted message %s", mq_message.id)
-                    await incomming_message.ack()
-        return len(errors) == 0
+        async with get_mq_pool().acquire() as channel, drain_queue(channel, queue_name, budget) as drain:
+            while mq_message_tuple := await drain.next_message(errors):
+                decoded, incomming_message = mq_message_tuple
+                if decoded.id in message_ids:
+                    logger.debug("Deleted message %s", decoded.id)
+                    await ack_message(incomming_message)
+                    removed[decoded.id] += 1
+        return dict(removed), len(errors) == 0
     except MQQueueNotFoundError as qnfe:
         message = f"Queue [{queue_name}] not found"
         logger.exception(message, exc_info=qnfe)
-        return False
+        return dict(removed), False
     except MQServerConnectionError as qnfe:
         message = "Could not connect to server"
         logger.exception(message, exc_info=qnfe)
-        return False
+        return dict(removed), False
 
 
-async def delete_messages_from_queues(queue_list: list[str], message_id: str) -> bool:
-    """Delete all message matching id from given queues
+async def delete_held_messages(queue_name: str, message_ids: set[str]) -> Counter[str]:
+    """Delete the messages held by the pending index of the queue
+
+    Returns:
+        Counter[str]: the number of messages removed per id
+    """
+    removed: Counter[str] = Counter()
+    index = get_pending_index(queue_name)
+    if index is None:
+        return removed
+    for message_id in message_ids:
+        mq_message_tuple = index.pop(message_id)
+        if mq_message_tuple is not None:
+            logger.debug("Deleted message %s", message_id)
+            await ack_message(mq_message_tuple[1])
+            removed[message_id] += 1
+    return removed
+
+
+async def route_deletions(queue_name: str, message_ids: set[str]) -> tuple[Counter[str], bool]:
+    """Hand the deletions over to the coordinated replicas holding the messages
+
+    Returns:
+        tuple[Counter[str], bool]: the number of messages removed per id, and if every replica answered
+    """
+    removed: Counter[str] = Counter()
+    coordinator = get_coordinator(queue_name)
+    if coordinator is None or not message_ids:
+        return removed, True
+    success = True
+    for replica_id, held_ids in (await coordinator.remote_owners(sorted(message_ids))).items():
+        try:
+            removed.update(
+                await coordinator.call(replica_id, "delete", {"queue_name": queue_name, "message_ids": held_ids})
+            )
+        except (MQQueueNotFoundError, MQServerConnectionError) as error:
+            logger.exception("Deletion routed to replica %s failed", replica_id, exc_info=error)
+            success = False
+    return removed, success
+
+
+async def serve_routed_deletion(payload: dict) -> dict[str, int]:
+    """Delete the messages held by this replica on behalf of another one"""
+    queue_name = payload["queue_name"]
+    try:
+        return dict(await delete_held_messages(queue_name, set(payload["message_ids"])))
+    finally:
+        invalidate_reads(queue_name)
+
+
+async def delete_messages_from_queues(
+    queue_list: list[str], message_ids: set[str]
+) -> tuple[dict[str, dict[str, int]], bool, list[str]]:
+    """Delete all message matching any of the ids from given queues.
+    The queues are processed concurrently, at most DELETE_MAX_CONCURRENCY at a time
 
     Args:
         queue_list (list[str]): _description_
-        message_id (str): _description_
+        message_ids (set[str]): _description_
 
     Returns:
-        bool: if succeded for all
+        tuple[dict[str, dict[str, int]], bool, list[str]]: the number of messages removed per queue and per id,
+        if succeded for all, and the queues whose pass stopped on its budget
     """
-    success = True
-    for queue in queue_list:
-        success &= await safe_delete_messages_from_queue(queue, message_id)
-    return success
+    semaphore = asyncio.Semaphore(ModerationConfig.DELETE_MAX_CONCURRENCY)
+    budgets = {queue: DrainBudget() for queue in queue_list}
+
+    async def delete_from_queue(queue_name: str) -> tuple[dict[str, int], bool]:
+        async with semaphore:
+            return await safe_delete_messages_from_queue(queue_name, message_ids, budgets[queue_name])
+
+    results = await asyncio.gather(*(delete_from_queue(queue) for queue in queue_list))
+    removed = {queue: counts for queue, (counts, _) in zip(queue_list, results, strict=True)}
+    truncated = [queue for queue, budget in budgets.items() if budget.truncated]
+    return removed, all(success for _, success in results) and not truncated, truncated
@@ -7,9 +7,22 @@ from typing import Any, TypeVar
 from msfwk.models import DespResponse
 from msfwk.utils.logging import get_logger
 
-from moderation.models.constants import MESSAGE_NOT_FOUND, MESSAGE_RETRIEVE_FAILED, MQCONNECTION_FAILED, QUEUE_NOT_FOUND
+from moderation.models.constants import (
+    ALREADY_DECIDED,
+    CLUSTER_NOT_FOUND,
+    INVALID_CURSOR,
+    LEASE_NOT_FOUND,
+    MESSAGE_NOT_FOUND,
+    MESSAGE_RETRIEVE_FAILED,
+    MQCONNECTION_FAILED,
+    QUEUE_NOT_FOUND,
+)
 from moderation.models.exceptions import (
+    AlreadyDecidedError,
+    ClusterNotFoundError,
     GetMessagesError,
+    InvalidCursorError,
+    LeaseNotFoundError,
     MQMessageNotFoundError,
     MQQueueNotFoundError,
     MQServerConnectionError,
@@ -31,7 +44,7 @@ def handle_mq_errors(func: Callable[..., Any]) -> Callable[..., Any]:
     """
 
     @wraps(func)
-    async def wrapper(*args: object, **kwargs: object) -> DespResponse[T]:
+    async def wrapper(*args: object, **kwargs: object) -> DespResponse[T]:  # noqa: PLR0911
         try:
             return await func(*args, **kwargs)
         except MQServerConnectionError as msce:
@@ -50,5 +63,21 @@ def handle_mq_errors(func: Callable[..., Any]) -> Callable[..., Any]:
             message = f"Message not found: {e}"
             logger.exception(message, exc_info=e)
             return DespResponse(error=message, http_status=404, code=MESSAGE_NOT_FOUND)
+        except InvalidCursorError as ice:
+            message = str(ice)
+            logger.warning(message)
+            return DespResponse(error=message, http_status=400, code=INVALID_CURSOR)
+        except LeaseNotFoundError as lnf:
+            message = str(lnf)
+            logger.warning(message)
+            return DespResponse(error=message, http_status=404, code=LEASE_NOT_FOUND)
+        except ClusterNotFoundError as cnf:
+            message = str(cnf)
+            logger.warning(message)
+            return DespResponse(error=message, http_status=404, code=CLUSTER_NOT_FOUND)
+        except AlreadyDecidedError as ade:
+            message = str(ade)
+            logger.warning(message)
+            return DespResponse(error=message, http_status=409, code=ALREADY_DECIDED)
 
     return wrapper
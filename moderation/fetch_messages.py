@@ -1,78 +1,214 @@
-import json
+import asyncio
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from functools import partial
 
-from aio_pika import Connection, IncomingMessage, RobustConnection, RobustQueue
+from aio_pika import IncomingMessage, RobustChannel, RobustQueue
 from aio_pika import exceptions as aio_pika_exceptions
-from msfwk.desp.rabbitmq.mq_message import DespMQMessage
-from msfwk.mqclient import RabbitMQConfig
 from msfwk.utils.logging import get_logger
 
+from moderation.bulk_fetch import BulkFetch
+from moderation.coalescing import get_read_coalescer
+from moderation.coordination import get_coordinator
+from moderation.decoding import DecodedMessage, decode_message
+from moderation.metrics import DRAIN_MESSAGES, DRAIN_SECONDS, FETCH_SECONDS
+from moderation.models.config import MAX_PREFETCH_COUNT, ModerationConfig
 from moderation.models.exceptions import MQQueueNotFoundError, MQServerConnectionError
 from moderation.models.interfaces import MQLoadErrorMessage
-from moderation.utils import connect_to_rabbitmq, time_calculator
+from moderation.mq_pool import get_mq_pool
+from moderation.pending_index import get_pending_index
+from moderation.publishing import quarantine_message
+from moderation.seen_ids import published_decision
+from moderation.tracing import span
+from moderation.utils import ack_message
 
 logger = get_logger(__name__)
 
 
-async def get_messages_from_queue(queue_name: str) -> tuple[list[DespMQMessage], list[MQLoadErrorMessage]]:
+def _bounded(value: int | None, limit: int) -> int | None:
+    """The requested value capped to the configured limit, 0 meaning no limit"""
+    if limit <= 0:
+        return value
+    return limit if value is None else min(value, limit)
+
+
+class DrainBudget:
+    """Upper bounds of a read pass over a queue, in deliveries read and in milliseconds.
+    `truncated` is set when the pass stopped on the budget instead of on an empty queue,
+    only the first `scanned` deliveries of the queue have then been seen.
+    """
+
+    __slots__ = ("deadline", "deadline_ms", "max_messages", "scanned", "truncated")
+
+    def __init__(self, max_messages: int | None = None, deadline_ms: int | None = None) -> None:
+        self.max_messages = _bounded(max_messages, ModerationConfig.DRAIN_MAX_MESSAGES)
+        self.deadline_ms = _bounded(deadline_ms, ModerationConfig.DRAIN_DEADLINE_MS)
+        self.deadline: float | None = None
+        self.scanned = 0
+        self.truncated = False
+
+    @property
+    def bounds(self) -> tuple[int | None, int | None]:
+        """What makes two budgets equivalent"""
+        return self.max_messages, self.deadline_ms
+
+    def start(self) -> None:
+        """Start the clock, on the first pass only"""
+        if self.deadline is None and self.deadline_ms is not None:
+            self.deadline = asyncio.get_running_loop().time() + self.deadline_ms / 1000
+
+    def exhausted(self) -> bool:
+        """Check if the pass must stop, marking it truncated"""
+        if (self.max_messages is not None and self.scanned >= self.max_messages) or (
+            self.deadline is not None and asyncio.get_running_loop().time() >= self.deadline
+        ):
+            self.truncated = True
+        return self.truncated
+
+
+async def get_messages_from_queue(
+    queue_name: str, budget: DrainBudget | None = None
+) -> tuple[list[DecodedMessage], list[MQLoadErrorMessage]]:
     """Retrieves all messages from a RabbitMQ queue without acknowledging them.
-    Will remove the duplicate message (with same id)
+    Served from the pending index when the queue has one, the queue is only read past the prefetch window.
+    With coordinated replicas, the events held by the other replicas are listed after the ones of this replica.
+    Concurrent listings share one pass over the queue.
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget | None): bounds of the read, tells if the list is truncated. Defaults to the config.
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    budget = budget or DrainBudget()
+    index = get_pending_index(queue_name)
+    if index is None:
+        return await read_messages_from_queue(queue_name, budget)
+
+    messages = index.messages()
+    errors = index.errors
+    coordinator = get_coordinator(queue_name)
+    if coordinator is not None:
+        messages += [decoded for decoded in await coordinator.remote_messages() if decoded.id not in index]
+    if index.saturated:
+        tail_messages, tail_errors = await read_messages_from_queue(queue_name, budget)
+        messages += [decoded for decoded in tail_messages if decoded.id not in index]
+        errors += tail_errors
+    return messages, errors
+
+
+async def iter_messages_from_queue(
+    queue_name: str, errors: list[MQLoadErrorMessage], budget: DrainBudget | None = None
+) -> AsyncIterator[DecodedMessage]:
+    """Yield the messages of a RabbitMQ queue as soon as they are decoded, without acknowledging them.
+    Later copies of an already yielded id are skipped, the events held by the other replicas come after the ones
+    of the pending index.
 
     Args:
         queue_name (str): RabbitMQ queue name
+        errors (list[MQLoadErrorMessage]): filled with the load errors while iterating
+        budget (DrainBudget | None): bounds of the read, tells if the iteration is truncated
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    seen: set[str] = set()
+    index = get_pending_index(queue_name)
+    if index is not None:
+        errors.extend(index.errors)
+        for decoded in index.messages():
+            seen.add(decoded.id)
+            yield decoded
+        coordinator = get_coordinator(queue_name)
+        for decoded in await coordinator.remote_messages() if coordinator is not None else []:
+            if decoded.id not in seen:
+                seen.add(decoded.id)
+                yield decoded
+        if not index.saturated:
+            return
+
+    async with get_mq_pool().acquire() as channel, drain_queue(channel, queue_name, budget) as drain:
+        while mq_message_tuple := await drain.next_message(errors):
+            decoded, _ = mq_message_tuple
+            if decoded.id in seen:
+                continue
+            seen.add(decoded.id)
+            yield decoded
+
+
+async def read_messages_from_queue(
+    queue_name: str, budget: DrainBudget
+) -> tuple[list[DecodedMessage], list[MQLoadErrorMessage]]:
+    """drain_messages_from_queue, shared with the identical reads in flight or fresh enough
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget): bounds of the read, gets the outcome of the shared one
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+
+    async def drain() -> tuple[list[DecodedMessage], list[MQLoadErrorMessage], DrainBudget]:
+        shared_budget = DrainBudget(*budget.bounds)
+        messages, errors = await drain_messages_from_queue(queue_name, shared_budget)
+        return messages, errors, shared_budget
+
+    messages, errors, shared_budget = await get_read_coalescer().read(queue_name, "list", budget.bounds, drain)
+    budget.scanned, budget.truncated = shared_budget.scanned, shared_budget.truncated
+    # The lists are shared, each caller gets its own copy
+    return list(messages), list(errors)
+
+
+async def drain_messages_from_queue(
+    queue_name: str, budget: DrainBudget | None = None
+) -> tuple[list[DecodedMessage], list[MQLoadErrorMessage]]:
+    """Read all the messages available in a RabbitMQ queue without acknowledging them, within the budget.
+    Only the latest copy of an id is listed, the older ones are left in the queue for the consumer to drop
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget | None): bounds of the read. Defaults to the config.
 
     Raises:
         MQServerConnectionError: Error appended during connection with server
         MQQueueNotFoundError: queue_name not found in MQ server
     """
-    messages: list[DespMQMessage] = []
     errors: list[MQLoadErrorMessage] = []
 
-    id_message_dict: dict[str, tuple[DespMQMessage, IncomingMessage]] = {}
-
-    client = await connect_to_rabbitmq(RabbitMQConfig)
-    if not client or not client.connection or client.connection.is_closed:
-        message = "No connection for the rabbit_mq client"
-        logger.error(message)
-        raise MQServerConnectionError(message)
-    async with client.connection:
-        queue = await get_mq_queue(client.connection, queue_name)
-        while mq_message_tuple := await get_safe_message(queue, errors):
-            mq_message, incomming_message = mq_message_tuple
-            if id_message_dict.get(mq_message.id) is not None:
-                _, inc = id_message_dict[mq_message.id]
-                await inc.ack()
-            id_message_dict[mq_message.id] = mq_message, incomming_message
+    id_message_dict: dict[str, tuple[DecodedMessage, IncomingMessage]] = {}
+
+    async with get_mq_pool().acquire() as channel, drain_queue(channel, queue_name, budget) as drain:
+        while mq_message_tuple := await drain.next_message(errors):
+            decoded, incomming_message = mq_message_tuple
+            id_message_dict[decoded.id] = decoded, incomming_message
 
     messages = [msg[0] for msg in id_message_dict.values()]
     return messages, errors
 
 
-@time_calculator
-async def get_safe_message(
-    queue: RobustQueue, errors: list[MQLoadErrorMessage] | None = None
-) -> tuple[DespMQMessage, IncomingMessage] | None:
-    """_summary_
+async def get_safe_message(queue: RobustQueue) -> IncomingMessage | None:
+    """Fetch the next delivery of the queue, without acknowledging it
 
     Args:
         queue (RobustQueue): _description_
-        errors (list[MQLoadErrorMessage] | None, optional): _description_. Defaults to None.
 
     Raises:
         MQServerConnectionError: Failed to connect to server
 
     Returns:
-        tuple[DespMQMessage, IncomingMessage] | None: _description_
+        IncomingMessage | None: the delivery, None once the queue is empty
     """
     try:
         #  Set fail=False to prevent the raise of QueueEmpty exception
-        message = await queue.get(no_ack=False, fail=False)
-        if not message:
-            return None
-        # convert in dict and generate the message
-        decoded_message = message.body.decode()
-        return DespMQMessage.from_dict(json.loads(decoded_message)), message
+        with FETCH_SECONDS.labels(queue.name).time():
+            return await queue.get(no_ack=False, fail=False)
 
-    except ConnectionError as ce:  # noqa: PERF203
+    except ConnectionError as ce:
         err_message = f"Connection lost while fetching messages: {ce}"
         logger.exception(err_message, exc_info=ce)
         raise MQServerConnectionError(err_message) from ce
@@ -82,22 +218,18 @@ async def get_safe_message(
         logger.info(err_message, exc_info=qe)
         return None
 
-    except json.JSONDecodeError as je:
-        err_message = f"Invalid message (JSON incorrect): {decoded_message}"
-        logger.exception(err_message, exc_info=je)
-        if errors is not None:
-            errors.append(MQLoadErrorMessage(content=decoded_message, error=err_message))
-
 
 async def get_message(
-    message_id: str, queue_name: str, connection: RobustConnection
-) -> tuple[DespMQMessage, IncomingMessage] | None:
-    """Retrieve the message with given ID, or None if not found
+    message_id: str, queue_name: str, channel: RobustChannel, budget: DrainBudget | None = None
+) -> tuple[DecodedMessage, IncomingMessage] | None:
+    """Retrieve the message with given ID, or None if not found within the budget.
+    The other messages read are requeued, the returned one is left to the caller to ack or requeue
 
     Args:
         message_id (str): _description_
-        connection (RobustConnection): client connection
         queue_name (str): _description_
+        channel (RobustChannel): channel checked out of the pool
+        budget (DrainBudget | None): bounds of the read, tells if it stopped before the end of the queue
 
     Raises:
         MQServerConnectionError: Failed to connect to server
@@ -105,49 +237,246 @@ async def get_message(
 
 
     Returns:
-        tuple[DespMQMessage, IncomingMessage] | None: _description_
+        tuple[DecodedMessage, IncomingMessage] | None: _description_
     """
-    queue = await get_mq_queue(connection, queue_name)
-    while mq_message_tuple := await get_safe_message(queue):
-        mq_message, incomming_message = mq_message_tuple
-        if mq_message.id != message_id:
-            continue
-        return mq_message, incomming_message
-    return None
+    with span("moderation.scan", queue=queue_name, message_id=message_id) as current:
+        async with drain_queue(channel, queue_name, budget) as drain:
+            while mq_message_tuple := await drain.next_message():
+                if mq_message_tuple[0].id == message_id:
+                    drain.detach(mq_message_tuple[1])
+                    break
+        if current is not None:
+            current.set_attributes(
+                {"found": mq_message_tuple is not None, "read": drain.read_count, "truncated": drain.budget.truncated}
+            )
+        return mq_message_tuple
+
+
+async def get_messages_by_id(
+    message_ids: set[str], queue_name: str, channel: RobustChannel, budget: DrainBudget | None = None
+) -> dict[str, tuple[DecodedMessage, IncomingMessage]]:
+    """Retrieve the messages with the given IDs in a single pass over the queue, stopping once all are found.
+    The other messages read are requeued, the returned ones are left to the caller to ack or requeue
+
+    Args:
+        message_ids (set[str]): ids of the wanted messages
+        queue_name (str): _description_
+        channel (RobustChannel): channel checked out of the pool
+        budget (DrainBudget | None): bounds of the read, tells if it stopped before the end of the queue
 
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: _description_
 
-async def retrieve_message(message_id: str, queue_name: str) -> tuple[DespMQMessage, IncomingMessage] | None:
-    """Create a client and retrieve the message with ID
+    Returns:
+        dict[str, tuple[DecodedMessage, IncomingMessage]]: the first copy found of each id
+    """
+    found: dict[str, tuple[DecodedMessage, IncomingMessage]] = {}
+    if not message_ids:
+        return found
+    async with drain_queue(channel, queue_name, budget) as drain:
+        while mq_message_tuple := await drain.next_message():
+            decoded, incomming_message = mq_message_tuple
+            if decoded.id not in message_ids or decoded.id in found:
+                continue
+            drain.detach(incomming_message)
+            found[decoded.id] = mq_message_tuple
+            if len(found) == len(message_ids):
+                break
+        return found
+
+
+async def retrieve_message(
+    message_id: str, queue_name: str, budget: DrainBudget | None = None
+) -> tuple[DecodedMessage, IncomingMessage | None] | None:
+    """Retrieve the message with ID from the pending index, or on a pooled channel, without consuming it.
+    The event may be held by another coordinated replica, it comes without its delivery then.
+    Concurrent lookups of the same ID share one pass over the queue.
 
     Args:
         queue_name (str): _description_
         message_id (_type_, optional): _description_
+        budget (DrainBudget | None): bounds of the read, tells if a message not found may still be in the queue
 
     Raises:
         MQServerConnectionError: _description_
     """
-    client = await connect_to_rabbitmq(RabbitMQConfig)
-    if not client or not client.connection or client.connection.is_closed:
-        message = "No connection for the rabbit_mq client"
-        logger.error(message)
-        raise MQServerConnectionError(message)
-    async with client.connection:
-        return await get_message(message_id, queue_name, client.connection)
+    budget = budget or DrainBudget()
+    index = get_pending_index(queue_name)
+    if index is not None:
+        mq_message_tuple = index.get(message_id)
+        if mq_message_tuple is not None:
+            return mq_message_tuple
+        coordinator = get_coordinator(queue_name)
+        remote = await coordinator.remote_message(message_id) if coordinator is not None else None
+        if remote is not None:
+            return remote, None
+        if not index.saturated:
+            return None
+    mq_message_tuple, shared_budget = await get_read_coalescer().read(
+        queue_name, "get", (message_id, *budget.bounds), partial(lookup_message, message_id, queue_name, budget.bounds)
+    )
+    budget.scanned, budget.truncated = shared_budget.scanned, shared_budget.truncated
+    return mq_message_tuple
+
+
+async def lookup_message(
+    message_id: str, queue_name: str, bounds: tuple[int | None, int | None]
+) -> tuple[tuple[DecodedMessage, IncomingMessage] | None, DrainBudget]:
+    """Find the message with ID in the queue on a pooled channel, its delivery is requeued
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    budget = DrainBudget(*bounds)
+    async with get_mq_pool().acquire() as channel:
+        mq_message_tuple = await get_message(message_id, queue_name, channel, budget)
+        if mq_message_tuple is not None:
+            await requeue_messages([mq_message_tuple[1]])
+        return mq_message_tuple, budget
+
+
+async def requeue_messages(messages: Iterable[IncomingMessage]) -> None:
+    """Give back to their queue the deliveries that have not been acked
+
+    Args:
+        messages (Iterable[IncomingMessage]): deliveries received on a pooled channel
+    """
+    for message in messages:
+        if not message.processed:
+            await message.nack(requeue=True)
+
+
+class QueueDrain:
+    """A read pass over a queue on a pooled channel, stopped by its budget.
+    The deliveries come from a bulk fetch when given, from a basic.get each otherwise.
+    Every delivery read is requeued when the pass ends, unless it has been acked or detached.
+    """
+
+    def __init__(
+        self,
+        channel: RobustChannel,
+        queue: RobustQueue,
+        budget: DrainBudget | None = None,
+        fetch: BulkFetch | None = None,
+    ) -> None:
+        self.channel = channel
+        self.queue = queue
+        self.budget = budget or DrainBudget()
+        self.fetch = fetch
+        self.read_count = 0
+        self._held: dict[int, IncomingMessage] = {}
+
+    async def next_delivery(self) -> IncomingMessage | None:
+        """Read the next delivery of the queue as is, None once the queue is empty or the budget spent
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        if self.budget.exhausted():
+            return None
+        if self.fetch is None:
+            message = await get_safe_message(self.queue)
+        else:
+            message = await self.fetch.next_delivery(self.budget.deadline)
+            if message is None and (self.budget.exhausted() or self.fetch.window_full):
+                self.budget.truncated = True
+        if message is not None:
+            self.read_count += 1
+            self.budget.scanned += 1
+            self._held[message.delivery_tag] = message
+        return message
+
+    async def next_message(
+        self, errors: list[MQLoadErrorMessage] | None = None
+    ) -> tuple[DecodedMessage, IncomingMessage] | None:
+        """Read the next valid message of the queue, None once the queue is empty.
+        The deliveries that can't be decoded are reported in errors and quarantined,
+        or kept until the end of the pass when the quarantine is not possible.
+        The copies of the events already decided are acked and skipped.
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        while (message := await self.next_delivery()) is not None:
+            load_errors: list[MQLoadErrorMessage] = []
+            decoded = decode_message(message, load_errors)
+            if decoded is not None and published_decision(decoded.id) is not None:
+                logger.debug("Message %s already decided, dropping its copy", decoded.id)
+                self.detach(message)
+                await ack_message(message)
+                continue
+            if decoded is not None:
+                return decoded, message
+            if errors is not None:
+                errors.extend(load_errors)
+            if await quarantine_message(self.channel, message, self.queue.name, load_errors[0]):
+                self.detach(message)
+        return None
+
+    def detach(self, message: IncomingMessage) -> None:
+        """Hand a delivery over to the caller, it won't be requeued at the end of the pass"""
+        self._held.pop(message.delivery_tag, None)
+
+    async def release(self) -> None:
+        """Stop the bulk fetch, then requeue the held deliveries that have not been acked"""
+        if self.fetch is not None:
+            await requeue_messages(await self.fetch.stop())
+        await requeue_messages(self._held.values())
+        self._held.clear()
+
+
+@asynccontextmanager
+async def drain_queue(
+    channel: RobustChannel, queue_name: str, budget: DrainBudget | None = None
+) -> AsyncIterator[QueueDrain]:
+    """Open a read pass over a queue, timed and released when the block exits.
+    With `bulk_fetch_enabled` the deliveries are consumed with a prefetch window of the budget size,
+    up to the 65535 deliveries allowed by AMQP.
+
+    Args:
+        channel (RobustChannel): channel checked out of the pool
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget | None): bounds of the pass. Defaults to DRAIN_MAX_MESSAGES and DRAIN_DEADLINE_MS.
+
+    Raises:
+        MQQueueNotFoundError: _description_
+        MQServerConnectionError: Failed to connect to server
+    """
+    bulk = ModerationConfig.BULK_FETCH_ENABLED
+    queue = await get_mq_queue(channel, queue_name, ensure=bulk)
+    drain = QueueDrain(channel, queue, budget)
+    if bulk:
+        prefetch_count = _bounded(drain.budget.max_messages, ModerationConfig.BULK_FETCH_PREFETCH) or 0
+        prefetch_count = min(prefetch_count, MAX_PREFETCH_COUNT)
+        drain.fetch = BulkFetch(channel, queue, prefetch_count, ModerationConfig.BULK_FETCH_IDLE_MS / 1000)
+    drain.budget.start()
+    try:
+        if drain.fetch is not None:
+            await drain.fetch.start()
+        with DRAIN_SECONDS.labels(queue_name).time():
+            yield drain
+    finally:
+        # The channel outlives the request, hand the deliveries back to the queue
+        await drain.release()
+        DRAIN_MESSAGES.labels(queue_name).observe(drain.read_count)
 
 
-async def get_mq_queue(connection: Connection, queue_name: str) -> RobustQueue:
-    """Return the given queue in the given connection
+async def get_mq_queue(channel: RobustChannel, queue_name: str, *, ensure: bool = False) -> RobustQueue:
+    """Return the given queue in the given channel
 
     Args:
-        connection (Connection): _description_
+        channel (RobustChannel): _description_
         queue_name (str): _description_
+        ensure (bool): check that the queue exists, its declaration then tells its message count
 
     Raises:
         MQQueueNotFoundError: _description_
     """
     try:
-        channel = await connection.channel()
-        return await channel.get_queue(queue_name, ensure=False)
+        with span("rabbitmq.get_queue", queue=queue_name, ensure=ensure):
+            return await channel.get_queue(queue_name, ensure=ensure)
 
     except aio_pika_exceptions.ChannelNotFound as cnf:
         err_message = f"Queue '{queue_name}' not found: {cnf}"
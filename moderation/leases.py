@@ -0,0 +1,203 @@
+"""Time bounded leases on pending events, so moderators working in parallel get disjoint batches.
+
+The leases live in the store shared by the replicas, Redis with `redis_url` or its in-process stand-in otherwise,
+so the batches stay disjoint across the coordinated replicas.
+"""
+
+import heapq
+import json
+import uuid
+from collections.abc import Iterable, Iterator
+from datetime import UTC, datetime, timedelta
+
+from msfwk.utils.logging import get_logger
+
+from moderation.decoding import DecodedMessage
+from moderation.fetch_messages import DrainBudget
+from moderation.models.config import ModerationConfig
+from moderation.models.exceptions import LeaseNotFoundError
+from moderation.pagination import event_position
+from moderation.redis_store import LocalRedis, Redis, get_shared_store
+from moderation.seen_ids import decision_of
+from moderation.sharding import get_sharded_messages
+
+logger = get_logger(__name__)
+
+
+class Lease:
+    """Events reserved to one moderator until `expires_at`"""
+
+    __slots__ = ("expires_at", "id", "message_ids")
+
+    def __init__(self, lease_id: str, message_ids: list[str], expires_at: datetime) -> None:
+        self.id = lease_id
+        self.message_ids = message_ids
+        self.expires_at = expires_at
+
+
+class LeaseRegistry:
+    """Leases kept in a store, a lease by lease id and the lease of each leased event by message id.
+    An event key is only set when absent, so two claims never get the same event, whichever replica serves them.
+    The keys expire with their lease, its events can then be claimed again.
+    """
+
+    def __init__(self, store: "Redis | LocalRedis | None" = None, prefix: str | None = None) -> None:
+        self._store = store
+        self._prefix = prefix
+
+    @property
+    def store(self) -> "Redis | LocalRedis":
+        """The given store, or the store shared by the replicas"""
+        return self._store or get_shared_store()
+
+    def _lease_key(self, lease_id: str) -> str:
+        return f"{self._prefix or ModerationConfig.CLAIM_REDIS_PREFIX}{lease_id}"
+
+    def _event_key(self, message_id: str) -> str:
+        return f"{self._prefix or ModerationConfig.CLAIM_REDIS_PREFIX}event:{message_id}"
+
+    async def leased(self, message_ids: list[str]) -> set[str]:
+        """The ids among the given ones that are under a running lease"""
+        if not message_ids:
+            return set()
+        owners = await self.store.mget([self._event_key(message_id) for message_id in message_ids])
+        return {message_id for message_id, owner in zip(message_ids, owners, strict=True) if owner is not None}
+
+    async def grant(self, message_ids: Iterable[str], count: int, duration: float) -> Lease:
+        """Lease the first `count` events not leased yet among the given ones, in their order"""
+        lease = Lease(uuid.uuid4().hex, [], datetime.now(UTC) + timedelta(seconds=duration))
+        ttl = _milliseconds(duration)
+        for message_id in message_ids:
+            if len(lease.message_ids) >= count:
+                break
+            if await self.store.set(self._event_key(message_id), lease.id, px=ttl, nx=True):
+                lease.message_ids.append(message_id)
+        await self._save(lease, ttl)
+        return lease
+
+    async def renew(self, lease_id: str, duration: float, gone: set[str] | None = None) -> Lease:
+        """Push back the expiry of a lease, dropping the events that are no longer pending
+
+        Raises:
+            LeaseNotFoundError: the lease is unknown or has already expired
+        """
+        lease = await self.get(lease_id)
+        lease.message_ids = [message_id for message_id in lease.message_ids if message_id not in (gone or ())]
+        lease.expires_at = datetime.now(UTC) + timedelta(seconds=duration)
+        ttl = _milliseconds(duration)
+        for message_id in await self._owned(lease):
+            await self.store.pexpire(self._event_key(message_id), ttl)
+        await self._save(lease, ttl)
+        return lease
+
+    async def release(self, lease_id: str) -> Lease:
+        """End a lease, its remaining events can be claimed again
+
+        Raises:
+            LeaseNotFoundError: the lease is unknown or has already expired
+        """
+        lease = await self.get(lease_id)
+        owned = await self._owned(lease)
+        await self.store.delete(self._lease_key(lease.id), *(self._event_key(message_id) for message_id in owned))
+        return lease
+
+    async def get(self, lease_id: str) -> Lease:
+        """Return a running lease
+
+        Raises:
+            LeaseNotFoundError: the lease is unknown or has already expired
+        """
+        value = await self.store.get(self._lease_key(lease_id))
+        if value is None:
+            message = f"Lease not found or expired: {lease_id}"
+            raise LeaseNotFoundError(message)
+        saved = json.loads(value)
+        return Lease(lease_id, saved["message_ids"], datetime.fromisoformat(saved["expires_at"]))
+
+    async def _owned(self, lease: Lease) -> list[str]:
+        """The events of a lease still leased by it"""
+        if not lease.message_ids:
+            return []
+        owners = await self.store.mget([self._event_key(message_id) for message_id in lease.message_ids])
+        return [message_id for message_id, owner in zip(lease.message_ids, owners, strict=True) if owner == lease.id]
+
+    async def _save(self, lease: Lease, ttl: int) -> None:
+        saved = {"message_ids": lease.message_ids, "expires_at": lease.expires_at.isoformat()}
+        await self.store.set(self._lease_key(lease.id), json.dumps(saved), px=ttl)
+
+
+def _milliseconds(duration: float) -> int:
+    return max(1, round(duration * 1000))
+
+
+def _oldest_first(messages: list[DecodedMessage]) -> Iterator[DecodedMessage]:
+    """The messages by date, only sorted as far as they are consumed"""
+    heap = [(event_position(message), position, message) for position, message in enumerate(messages)]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+_registry = LeaseRegistry()
+
+
+def get_lease_registry() -> LeaseRegistry:
+    """Return the lease registry of the service"""
+    return _registry
+
+
+async def claim_messages(queue_name: str, count: int) -> tuple[Lease, list[DecodedMessage]]:
+    """Lease the `count` oldest pending events that no one holds a lease on
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        count (int): number of events wanted, capped to CLAIM_MAX_SIZE
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+
+    Returns:
+        tuple[Lease, list[DecodedMessage]]: the lease and its events, oldest first, maybe fewer than asked
+    """
+    messages, _ = await get_sharded_messages(queue_name)
+    leased = await _registry.leased([message.id for message in messages])
+    by_id = {message.id: message for message in messages if message.id not in leased}
+    # An event leased by a concurrent claim meanwhile is skipped by the grant
+    oldest = (message.id for message in _oldest_first(list(by_id.values())))
+    count = min(count, ModerationConfig.CLAIM_MAX_SIZE)
+    lease = await _registry.grant(oldest, count, ModerationConfig.CLAIM_LEASE_SECONDS)
+    logger.info("Lease %s granted on %s events", lease.id, len(lease.message_ids))
+    return lease, [by_id[message_id] for message_id in lease.message_ids]
+
+
+async def renew_lease(queue_name: str, lease_id: str) -> Lease:
+    """Extend a lease by CLAIM_LEASE_SECONDS, the events decided or deleted meanwhile are left out of it.
+    An event missing from a read of the queue stopped by its budget may still be pending, it stays leased.
+
+    Raises:
+        LeaseNotFoundError: the lease is unknown or has already expired
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    lease = await _registry.get(lease_id)
+    budget = DrainBudget()
+    messages, _ = await get_sharded_messages(queue_name, budget)
+    pending = {message.id for message in messages}
+    gone = {
+        message_id
+        for message_id in lease.message_ids
+        if message_id not in pending and (not budget.truncated or await decision_of(message_id) is not None)
+    }
+    return await _registry.renew(lease_id, ModerationConfig.CLAIM_LEASE_SECONDS, gone)
+
+
+async def release_lease(lease_id: str) -> Lease:
+    """End a lease before its expiry
+
+    Raises:
+        LeaseNotFoundError: the lease is unknown or has already expired
+    """
+    lease = await _registry.release(lease_id)
+    logger.info("Lease %s released", lease_id)
+    return lease
@@ -0,0 +1,139 @@
+"""Server-sent events pushing the changes of the pending index to the open dashboards"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator
+
+from msfwk.utils.logging import get_logger
+
+from moderation.decoding import DecodedMessage
+from moderation.models.config import ModerationConfig
+from moderation.models.interfaces import EventView
+from moderation.pending_index import PendingEventIndex
+
+logger = get_logger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+ADDED = "added"
+REMOVED = "removed"
+RESET = "reset"
+
+Change = tuple[str, DecodedMessage | None]
+
+
+class Subscription:
+    """Changes waiting to be sent to one client.
+    A client too slow to keep up gets a reset instead of the changes it missed.
+    """
+
+    def __init__(self, buffer_size: int) -> None:
+        self._changes: asyncio.Queue[Change] = asyncio.Queue(maxsize=buffer_size)
+
+    def push(self, change: Change) -> None:
+        """Queue a change, replacing everything pending by a reset when the buffer is full"""
+        try:
+            self._changes.put_nowait(change)
+        except asyncio.QueueFull:
+            while not self._changes.empty():
+                self._changes.get_nowait()
+            self._changes.put_nowait((RESET, None))
+
+    async def next_change(self, idle: float) -> Change | None:
+        """Wait for the next change, None after `idle` seconds without any"""
+        try:
+            return await asyncio.wait_for(self._changes.get(), idle)
+        except TimeoutError:
+            return None
+
+
+class EventBroadcaster:
+    """Listener of a pending index fanning its changes out to every subscription,
+    however many dashboards are open the queue is only consumed by the index.
+    """
+
+    def __init__(self, index: PendingEventIndex) -> None:
+        self.index = index
+        self._subscriptions: set[Subscription] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def on_added(self, decoded: DecodedMessage) -> None:
+        self._publish((ADDED, decoded))
+
+    def on_removed(self, decoded: DecodedMessage) -> None:
+        self._publish((REMOVED, decoded))
+
+    def on_cleared(self) -> None:
+        self._publish((RESET, None))
+
+    def subscribe(self) -> Subscription:
+        """Start receiving the changes"""
+        subscription = Subscription(ModerationConfig.LIVE_UPDATES_BUFFER_SIZE)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop receiving the changes"""
+        self._subscriptions.discard(subscription)
+
+    def _publish(self, change: Change) -> None:
+        for subscription in self._subscriptions:
+            subscription.push(change)
+
+
+_broadcasters: dict[str, EventBroadcaster] = {}
+
+
+def broadcast_pending_index(index: PendingEventIndex) -> EventBroadcaster:
+    """Push the changes of a pending index to the subscribers of its queue"""
+    broadcaster = EventBroadcaster(index)
+    index.add_listener(broadcaster)
+    _broadcasters[index.queue_name] = broadcaster
+    return broadcaster
+
+
+def get_broadcaster(queue_name: str) -> EventBroadcaster | None:
+    """Return the broadcaster of a queue, None when the queue is not indexed"""
+    return _broadcasters.get(queue_name)
+
+
+async def stream_changes(broadcaster: EventBroadcaster, event_view: EventView = EventView.FULL) -> AsyncIterator[bytes]:
+    """Yield the pending events as `added` server-sent events, then every change as it happens.
+    `added` carries the event (to be upserted by id), `removed` the id of a decided or deleted event,
+    `reset` tells to drop everything, it is followed by the pending events again.
+
+    Args:
+        broadcaster (EventBroadcaster): broadcaster of the queue
+        event_view (EventView): full events or only their header
+    """
+    subscription = broadcaster.subscribe()
+    try:
+        for decoded in broadcaster.index.messages():
+            yield _added(decoded, event_view)
+        while True:
+            change = await subscription.next_change(ModerationConfig.LIVE_UPDATES_HEARTBEAT)
+            if change is None:
+                # Comment line, keeps proxies from closing an idle stream
+                yield b": keep-alive\n\n"
+                continue
+            kind, decoded = change
+            if kind == ADDED:
+                yield _added(decoded, event_view)
+            elif kind == REMOVED:
+                yield _server_event(REMOVED, json.dumps({"id": decoded.id}))
+            else:
+                yield _server_event(RESET, "{}")
+                for pending in broadcaster.index.messages():
+                    yield _added(pending, event_view)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+def _added(decoded: DecodedMessage, event_view: EventView) -> bytes:
+    return _server_event(ADDED, decoded.view(event_view).model_dump_json())
+
+
+def _server_event(kind: str, data: str) -> bytes:
+    return f"event: {kind}\ndata: {data}\n\n".encode()
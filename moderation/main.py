@@ -1,37 +1,164 @@
+from datetime import datetime
+
+from fastapi import Header, Query
+from fastapi.responses import StreamingResponse
 from msfwk.application import app, openapi_extra
 from msfwk.context import register_init
+from msfwk.desp.rabbitmq.mq_message import DespFonctionnalArea, ModerationEventStatus
 from msfwk.exceptions import MQClientConnectionError
 from msfwk.models import BaseDespResponse, DespResponse
 from msfwk.mqclient import RabbitMQConfig, load_default_rabbitmq_config
 from msfwk.utils.logging import get_logger
 
-from moderation.apply_moderation import accept_message, reject_message
-from moderation.delete_messages import delete_messages_from_queues
+from moderation.apply_moderation import (
+    accept_message,
+    apply_moderation_batch,
+    reject_message,
+    serve_routed_decision,
+    serve_routed_decisions,
+)
+from moderation.auto_moderation import start_auto_moderation, stop_auto_moderation
+from moderation.clustering import (
+    cluster_messages,
+    cluster_pending_index,
+    decide_cluster,
+    get_content_clusters,
+    page_clusters,
+    resident_clusters,
+)
+from moderation.coordination import start_coordination, stop_coordination
+from moderation.decision_pipeline import start_decision_pipeline, stop_decision_pipeline
+from moderation.delete_messages import (
+    delete_messages_from_queues,
+    serve_routed_deletion,
+)
 from moderation.error_handlers import handle_mq_errors
-from moderation.fetch_messages import get_messages_from_queue, retrieve_message
-from moderation.models.constants import MESSAGE_NOT_FOUND
+from moderation.fetch_messages import DrainBudget
+from moderation.leases import claim_messages, release_lease, renew_lease
+from moderation.live_updates import (
+    SSE_MEDIA_TYPE,
+    broadcast_pending_index,
+    get_broadcaster,
+    stream_changes,
+)
+from moderation.metrics import expose_metrics
+from moderation.models.config import ModerationConfig, load_moderation_config
+from moderation.models.constants import (
+    DRAIN_TRUNCATED,
+    LIVE_UPDATES_UNAVAILABLE,
+    MESSAGE_NOT_FOUND,
+)
+from moderation.models.exceptions import MQServerConnectionError
 from moderation.models.interfaces import (
+    ClaimResponse,
+    ClusterDecision,
+    DecisionsRequest,
+    DecisionsResponse,
+    DeleteMessagesRequest,
     DeleteMessagesResponse,
     Event,
+    EventFilter,
+    EventView,
+    GetClustersResponse,
     GetEventsResponse,
+    GetQuarantineResponse,
+    LeaseResponse,
+    QuarantineRequest,
+    QuarantineResponse,
+    QueueStatsResponse,
+    SearchEventsResponse,
     ToHandlingResponse,
 )
+from moderation.mq_pool import MQChannelPool, close_mq_pool, init_mq_pool
+from moderation.pagination import paginate_messages
+from moderation.pending_index import (
+    discard_decided_copies,
+    start_pending_index,
+    stop_pending_indexes,
+)
+from moderation.profiling import profile_requests
+from moderation.quarantine import (
+    declare_quarantine_queue,
+    list_quarantined_messages,
+    purge_quarantined_messages,
+    replay_quarantined_messages,
+)
+from moderation.queue_stats import get_queue_stats, track_pending_index
+from moderation.redis_store import close_redis
+from moderation.search import get_search_index, search_pending_index
+from moderation.seen_ids import add_decided_hook, configure_seen_ids
+from moderation.sharding import (
+    area_queue,
+    get_sharded_messages,
+    retrieve_sharded_message,
+    shard_queues,
+    start_shard_router,
+    stop_shard_router,
+)
+from moderation.streaming import NDJSON_MEDIA_TYPE, accepts_ndjson, stream_events
+from moderation.tracing import setup_tracing, shutdown_tracing, trace_requests
 
 logger = get_logger("application")
 
 
-async def init(app_config: dict) -> bool:  # noqa: ARG001
-    """_init rabbitmq_config"""
+async def init(app_config: dict) -> bool:
+    """_init rabbitmq_config and open the shared channel pool"""
     try:
         load_default_rabbitmq_config()
+        load_moderation_config(app_config)
+        configure_seen_ids()
+        setup_tracing()
         # add_reliability_check("rabbitmq", app_config.get("rabbitmq", {}).get("mq_host"))
-    except MQClientConnectionError as mqce:
+        pool = await init_mq_pool()
+        if ModerationConfig.QUARANTINE_ENABLED:
+            await declare_quarantine_queue(pool)
+        if ModerationConfig.SHARDING_ENABLED:
+            await start_shard_router(pool)
+        if ModerationConfig.PENDING_INDEX_ENABLED:
+            add_decided_hook(discard_decided_copies)
+            for queue_name in shard_queues(RabbitMQConfig.MANUAL_MODERATION_QUEUE):
+                await index_moderation_queue(pool, queue_name)
+        if ModerationConfig.DECISION_PIPELINE_ENABLED:
+            start_decision_pipeline()
+        if ModerationConfig.AUTO_MODERATION_ENABLED:
+            await start_auto_moderation(pool)
+    except (MQClientConnectionError, MQServerConnectionError) as mqce:
         message = "Failed to connect to mq"
         logger.exception(message, exc_info=mqce)
         return False
     return True
 
 
+async def index_moderation_queue(pool: MQChannelPool, queue_name: str) -> None:
+    """Start the pending index of the moderation queue, or of one of its shards, and what it keeps up to date"""
+    index = await start_pending_index(pool, queue_name)
+    track_pending_index(index)
+    broadcast_pending_index(index)
+    # The clusters and the search of a sharded queue are computed from the listing of all its shards
+    if ModerationConfig.CLUSTERING_ENABLED and not ModerationConfig.SHARDING_ENABLED:
+        cluster_pending_index(index)
+    if ModerationConfig.SEARCH_ENABLED and not ModerationConfig.SHARDING_ENABLED:
+        search_pending_index(index)
+    if ModerationConfig.COORDINATION_ENABLED:
+        coordinator = await start_coordination(index)
+        coordinator.add_handler("decide", serve_routed_decision)
+        coordinator.add_handler("decisions", serve_routed_decisions)
+        coordinator.add_handler("delete", serve_routed_deletion)
+
+
+async def shutdown() -> None:
+    """Release the RabbitMQ connection held by the service"""
+    # Buffered decisions are acked on the channels of the index and of the pool
+    await stop_decision_pipeline()
+    await stop_auto_moderation()
+    await stop_shard_router()
+    await stop_coordination()
+    await stop_pending_indexes()
+    await close_mq_pool()
+    await close_redis()
+    shutdown_tracing()
+
+
 @app.get(
     "/moderation_content",
     summary="Returns the events in moderation",
@@ -40,14 +167,197 @@ async def init(app_config: dict) -> bool:  # noqa: ARG001
     openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
 )
 @handle_mq_errors
-async def get_moderation_content() -> DespResponse[GetEventsResponse]:
-    """Return the list of moderations events
+async def get_moderation_content(  # noqa: PLR0913
+    limit: int | None = Query(default=None, ge=1),
+    cursor: str | None = None,
+    fonctionnal_area: DespFonctionnalArea | None = None,
+    user_id: str | None = None,
+    status: ModerationEventStatus | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    view: EventView = EventView.FULL,
+    max_messages: int | None = Query(default=None, ge=1),
+    deadline_ms: int | None = Query(default=None, ge=1),
+    clustered: bool = False,
+    accept: str | None = Header(default=None),
+) -> DespResponse[GetEventsResponse] | StreamingResponse:
+    """Return the list of moderations events, oldest first.
+    With `Accept: application/x-ndjson` the events are streamed in queue order as they are read,
+    one JSON line each followed by the load errors, limit and cursor are then ignored.
+    With `view=summary` only the header of the events is returned, their content is never decoded.
+    The read of the queue stops after max_messages messages or deadline_ms milliseconds, the response is then
+    `truncated` and only covers the `scanned` first messages: ask again with larger budgets to see past them.
+    With `clustered=true` the response lists the clusters of near-duplicate events found in the page.
+    When the queue is sharded, fonctionnal_area only reads the shard of the area, the shards are otherwise read
+    concurrently and the budgets apply to each of them.
+
+    Args:
+        limit (int | None): page size, every event is returned if not set
+        cursor (str | None): next_cursor of the previous page
+        fonctionnal_area (DespFonctionnalArea | None): only events of this area
+        user_id (str | None): only events of this user
+        status (ModerationEventStatus | None): only events with this status
+        date_from (datetime | None): only events emitted at or after this date
+        date_to (datetime | None): only events emitted at or before this date
+        view (EventView): full events or only their header
+        max_messages (int | None): most messages read from the queue, capped to `drain_max_messages`
+        deadline_ms (int | None): longest read of the queue in milliseconds, capped to `drain_deadline_ms`
+        clustered (bool): also return the clusters of the events of the page
+        accept (str | None): Accept header of the request
+
+    Returns
+        DespResponse[GetEventsResponse]: the page, event_count holds the number of matching events
+    """
+    event_filter = EventFilter(
+        fonctionnal_area=fonctionnal_area, user_id=user_id, status=status, date_from=date_from, date_to=date_to
+    )
+    budget = DrainBudget(max_messages, deadline_ms)
+    if accepts_ndjson(accept):
+        return StreamingResponse(
+            stream_events(RabbitMQConfig.MANUAL_MODERATION_QUEUE, event_filter, view, budget),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+    messages, errors = await get_sharded_messages(RabbitMQConfig.MANUAL_MODERATION_QUEUE, budget, fonctionnal_area)
+    page, event_count, next_cursor = paginate_messages(messages, event_filter, limit, cursor)
+    response = GetEventsResponse.from_event_list_and_error(
+        [decoded.view(view) for decoded in page],
+        errors,
+        event_count=event_count,
+        next_cursor=next_cursor,
+        truncated=budget.truncated,
+        scanned=budget.scanned,
+    )
+    if clustered:
+        clusters = resident_clusters(RabbitMQConfig.MANUAL_MODERATION_QUEUE) or cluster_messages(messages)
+        response.clusters = page_clusters(clusters, page)
+    return DespResponse(data=response)
+
+
+@app.get(
+    "/moderation_content/clusters",
+    summary="Returns the groups of pending events with near identical content",
+    response_model=BaseDespResponse[GetClustersResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def get_moderation_clusters(min_size: int = Query(default=2, ge=1)) -> DespResponse[GetClustersResponse]:
+    """Return the clusters of near-duplicate events, largest first, so a spam wave can be decided at once.
+    Two events are in the same cluster when the SimHash fingerprints of their content are within
+    `cluster_max_distance` bits.
+
+    Args:
+        min_size (int): only the clusters of at least this many events
+
+    Returns
+        DespResponse[GetClustersResponse]: the clusters and the ids of their events
+    """
+    clusters = await get_content_clusters(RabbitMQConfig.MANUAL_MODERATION_QUEUE)
+    found = [cluster.to_event_cluster() for cluster in clusters.clusters(min_size)]
+    return DespResponse(data=GetClustersResponse(cluster_count=len(found), clusters=found))
+
+
+@app.get(
+    "/moderation_content/search",
+    summary="Returns the pending events matching a full-text search, best ranked first",
+    response_model=BaseDespResponse[SearchEventsResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def search_moderation_content(
+    q: str = Query(min_length=1),
+    limit: int = Query(default=50, ge=1, le=1000),
+    view: EventView = EventView.FULL,
+    max_messages: int | None = Query(default=None, ge=1),
+    deadline_ms: int | None = Query(default=None, ge=1),
+) -> DespResponse[SearchEventsResponse]:
+    """Return the pending events holding every word of the query in their content, user id or url.
+    The events are ranked by BM25, served from an index kept up to date by the pending index.
+    Without it, or when the queue holds more events than the pending index, the queue is read within the budget.
+
+    Args:
+        q (str): the words searched, whatever their case
+        limit (int): most events returned
+        view (EventView): full events or only their header
+        max_messages (int | None): most messages read from the queue, capped to `drain_max_messages`
+        deadline_ms (int | None): longest read of the queue in milliseconds, capped to `drain_deadline_ms`
+
+    Returns
+        DespResponse[SearchEventsResponse]: the ranked ids with their score and the events of the first `limit`,
+        hit_count holds the number of matching events
+    """
+    budget = DrainBudget(max_messages, deadline_ms)
+    search_index = await get_search_index(RabbitMQConfig.MANUAL_MODERATION_QUEUE, budget)
+    matches = search_index.search(q)
+    hits = matches[:limit]
+    events = [decoded.view(view) for hit in hits if (decoded := search_index.get(hit.message_id)) is not None]
+    return DespResponse(
+        data=SearchEventsResponse(
+            hit_count=len(matches), hits=hits, events=events, truncated=budget.truncated, scanned=budget.scanned
+        )
+    )
+
+
+@app.get(
+    "/moderation_content/stats",
+    summary="Returns the size and the age of the moderation backlog",
+    response_model=BaseDespResponse[QueueStatsResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def get_moderation_stats(
+    fonctionnal_area: DespFonctionnalArea | None = None,
+) -> DespResponse[QueueStatsResponse]:
+    """Return the depth of the moderation queue, the age percentiles of its events and their count per area.
+    Nothing is read from the queue: the depth comes from a passive declare and the rest from a summary
+    kept up to date by the pending index, cheap enough to be polled every few seconds.
+
+    Args:
+        fonctionnal_area (DespFonctionnalArea | None): when the queue is sharded, the statistics of the shard of
+            this area, of the events not routed yet without it
 
     Returns
-        DespResponse[GetEventsResponse]: _description_
+        DespResponse[QueueStatsResponse]: `complete` is false when the summary doesn't cover every message
+    """
+    return DespResponse(
+        data=await get_queue_stats(area_queue(RabbitMQConfig.MANUAL_MODERATION_QUEUE, fonctionnal_area))
+    )
+
+
+@app.get(
+    "/moderation_content/events",
+    summary="Pushes the moderation events as they arrive and leave, as server-sent events",
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def get_moderation_content_updates(
+    view: EventView = EventView.FULL, fonctionnal_area: DespFonctionnalArea | None = None
+) -> StreamingResponse | DespResponse:
+    """Stream the pending events then their changes, so a dashboard stays current without polling.
+    Every `added` event carries an event to upsert by id, `removed` the id of an event decided or deleted,
+    `reset` tells to drop everything before the pending events are sent again.
+    The changes come from the pending index, the queue is not read again whatever the number of clients.
+
+    Args:
+        view (EventView): full events or only their header
+        fonctionnal_area (DespFonctionnalArea | None): the shard followed, required when the queue is sharded
+
+    Returns:
+        StreamingResponse: the text/event-stream
     """
-    messages, errors = await get_messages_from_queue(RabbitMQConfig.MANUAL_MODERATION_QUEUE)
-    return DespResponse(data=GetEventsResponse.from_message_list_and_error(messages, errors))
+    broadcaster = get_broadcaster(area_queue(RabbitMQConfig.MANUAL_MODERATION_QUEUE, fonctionnal_area))
+    if broadcaster is None:
+        message = "Live updates need the pending index, and the functional area when the queue is sharded"
+        logger.error(message)
+        return DespResponse(error=message, code=LIVE_UPDATES_UNAVAILABLE, http_status=503)
+    return StreamingResponse(
+        stream_changes(broadcaster, view),
+        media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get(
@@ -58,19 +368,97 @@ async def get_moderation_content() -> DespResponse[GetEventsResponse]:
     openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
 )
 @handle_mq_errors
-async def get_moderation_content_from_id(event_id: str) -> DespResponse[Event]:
-    """Return the list of moderations events
+async def get_moderation_content_from_id(
+    event_id: str,
+    max_messages: int | None = Query(default=None, ge=1),
+    deadline_ms: int | None = Query(default=None, ge=1),
+) -> DespResponse[Event]:
+    """Return the event in moderation with the given id, from the pending index or the shards of the queue
+    The lookup stops after max_messages messages or deadline_ms milliseconds, an event not found before
+    is reported with the DRAIN_TRUNCATED code: it may be further in the queue.
 
     Returns
-        DespResponse[GetEventsResponse]: _description_
+        DespResponse[Event]: the full event, a 404 with DRAIN_TRUNCATED if the lookup stopped on its budget
+        or MESSAGE_NOT_FOUND if the whole queue was read without finding it
     """
-    messages = await retrieve_message(event_id, RabbitMQConfig.MANUAL_MODERATION_QUEUE)
+    budget = DrainBudget(max_messages, deadline_ms)
+    messages = await retrieve_sharded_message(event_id, RabbitMQConfig.MANUAL_MODERATION_QUEUE, budget)
+    if messages is None and budget.truncated:
+        message = f"Event not found in the first {budget.scanned} messages of the queue"
+        logger.error(message)
+        return DespResponse(error=message, code=DRAIN_TRUNCATED, http_status=404)
     if messages is None:
         message = "Event not found"
         logger.error(message)
         return DespResponse(error=message, code=MESSAGE_NOT_FOUND, http_status=404)
-    mq_message, _ = messages
-    return DespResponse(data=Event.from_message(mq_message))
+    decoded, _ = messages
+    return DespResponse(data=decoded.event)
+
+
+@app.post(
+    "/moderation_content/claim",
+    summary="Reserve the oldest events that no other moderator holds",
+    response_model=BaseDespResponse[ClaimResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def claim_moderation_content(
+    n: int = Query(default=1, ge=1), view: EventView = EventView.FULL
+) -> DespResponse[ClaimResponse]:
+    """Hand out the n oldest events not leased yet, under a lease of `claim_lease_seconds`.
+    The events are not handed out again until the lease is released or expires.
+
+    Args:
+        n (int): number of events wanted, capped to `claim_max_size`
+        view (EventView): full events or only their header
+
+    Returns
+        DespResponse[ClaimResponse]: the lease and its events, oldest first, maybe fewer than asked
+    """
+    lease, claimed = await claim_messages(RabbitMQConfig.MANUAL_MODERATION_QUEUE, n)
+    events = [decoded.view(view) for decoded in claimed]
+    return DespResponse(data=ClaimResponse(lease_id=lease.id, expires_at=lease.expires_at, events=events))
+
+
+@app.post(
+    "/moderation_content/claim/{lease_id}/renew",
+    summary="Extend a lease",
+    response_model=BaseDespResponse[LeaseResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def renew_moderation_lease(lease_id: str) -> DespResponse[LeaseResponse]:
+    """Extend a lease by `claim_lease_seconds` from now, the events decided meanwhile are left out of it
+
+    Returns
+        DespResponse[LeaseResponse]: the lease and its remaining events
+    """
+    lease = await renew_lease(RabbitMQConfig.MANUAL_MODERATION_QUEUE, lease_id)
+    return DespResponse(
+        data=LeaseResponse(lease_id=lease.id, expires_at=lease.expires_at, message_ids=lease.message_ids)
+    )
+
+
+@app.delete(
+    "/moderation_content/claim/{lease_id}",
+    summary="Release a lease",
+    response_model=BaseDespResponse[LeaseResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def release_moderation_lease(lease_id: str) -> DespResponse[LeaseResponse]:
+    """End a lease, its undecided events can be claimed again right away
+
+    Returns
+        DespResponse[LeaseResponse]: the released lease
+    """
+    lease = await release_lease(lease_id)
+    return DespResponse(
+        data=LeaseResponse(lease_id=lease.id, expires_at=lease.expires_at, message_ids=lease.message_ids)
+    )
 
 
 @app.post(
@@ -105,6 +493,34 @@ async def handle_reject_message(message_id: str) -> DespResponse[ToHandlingRespo
     )
 
 
+@app.post(
+    "/moderation_content/clusters/{cluster_id}/decision",
+    summary="Accept or reject every event of a cluster",
+    response_model=BaseDespResponse[DecisionsResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def handle_cluster_decision(cluster_id: str, request: ClusterDecision) -> DespResponse[DecisionsResponse]:
+    """API route to apply one decision to every event of a cluster, in a single batch"""
+    results = await decide_cluster(RabbitMQConfig.MANUAL_MODERATION_QUEUE, cluster_id, request.status, request.history)
+    return DespResponse(data=DecisionsResponse(results=results))
+
+
+@app.post(
+    "/decisions",
+    summary="Accept or reject many events at once",
+    response_model=BaseDespResponse[DecisionsResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def handle_decisions(request: DecisionsRequest) -> DespResponse[DecisionsResponse]:
+    """API route to apply a batch of decisions, with a result for each of them"""
+    results = await apply_moderation_batch(request.decisions)
+    return DespResponse(data=DecisionsResponse(results=results))
+
+
 @app.delete(
     "/messages/{message_id}",
     summary="delete all events with given id from queues ",
@@ -120,15 +536,102 @@ async def delete_messages(message_id: str) -> DespResponse[DeleteMessagesRespons
     Returns:
         BaseDespResponse[ToHandlingResponse]: _description_
     """
+    return await delete_messages_with_ids({message_id}, f"id {message_id}")
+
+
+@app.delete(
+    "/messages",
+    summary="delete all events with any of the given ids from queues ",
+    response_model=BaseDespResponse[DeleteMessagesResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"], internal=True),
+)
+@handle_mq_errors
+async def delete_many_messages(request: DeleteMessagesRequest) -> DespResponse[DeleteMessagesResponse]:
+    """Delete all messages with any of the ids from all the queues, each queue being read once
+    Args:
+        request (DeleteMessagesRequest): the ids to remove
+    Returns:
+        BaseDespResponse[DeleteMessagesResponse]: the number of messages removed per queue and per id
+    """
+    return await delete_messages_with_ids(set(request.ids), f"ids {', '.join(request.ids)}")
+
+
+@app.get(
+    "/quarantine",
+    summary="Returns the messages moved to quarantine because they could not be decoded",
+    response_model=BaseDespResponse[GetQuarantineResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def get_quarantine(limit: int | None = Query(default=None, ge=1)) -> DespResponse[GetQuarantineResponse]:
+    """Return the quarantined messages, oldest first, with the error that sent them there
+    Args:
+        limit (int | None): maximum number of messages returned, every message if not set
+    Returns:
+        BaseDespResponse[GetQuarantineResponse]: the quarantined messages
+    """
+    messages = await list_quarantined_messages(limit)
+    return DespResponse(data=GetQuarantineResponse(message_count=len(messages), messages=messages))
+
+
+@app.post(
+    "/quarantine/replay",
+    summary="Send quarantined messages back to their queue",
+    response_model=BaseDespResponse[QuarantineResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def replay_quarantine(request: QuarantineRequest) -> DespResponse[QuarantineResponse]:
+    """Replay the quarantined messages with the given ids, or all of them when no ids are given,
+    once the producer or the service has been fixed. A message still invalid is quarantined again.
+    Args:
+        request (QuarantineRequest): the ids to replay
+    Returns:
+        BaseDespResponse[QuarantineResponse]: the ids of the replayed messages
+    """
+    replayed = await replay_quarantined_messages(None if request.ids is None else set(request.ids))
+    message = f"Replayed {len(replayed)} quarantined messages"
+    return DespResponse(data=QuarantineResponse(message=message, count=len(replayed), ids=replayed))
+
+
+@app.delete(
+    "/quarantine",
+    summary="Drop quarantined messages for good",
+    response_model=BaseDespResponse[QuarantineResponse],
+    tags=["moderation"],
+    openapi_extra=openapi_extra(secured=True, roles=["moderator", "admin"]),
+)
+@handle_mq_errors
+async def purge_quarantine(request: QuarantineRequest) -> DespResponse[QuarantineResponse]:
+    """Drop the quarantined messages with the given ids, or the whole quarantine when no ids are given
+    Args:
+        request (QuarantineRequest): the ids to drop
+    Returns:
+        BaseDespResponse[QuarantineResponse]: the number of messages dropped
+    """
+    count, purged = await purge_quarantined_messages(None if request.ids is None else set(request.ids))
+    message = f"Purged {count} quarantined messages"
+    return DespResponse(data=QuarantineResponse(message=message, count=count, ids=purged))
+
+
+async def delete_messages_with_ids(message_ids: set[str], description: str) -> DespResponse[DeleteMessagesResponse]:
+    """Remove the messages from all the queues and build the response"""
     queues = [
         RabbitMQConfig.MANUAL_MODERATION_QUEUE,
     ]
-    success = await delete_messages_from_queues(queues, message_id)
-    if success:
-        return DespResponse(
-            data=DeleteMessagesResponse(message=f"Successfully removed all messages with id {message_id}")
-        )
-    return DespResponse(data=DeleteMessagesResponse(message=f"Partially removed all messages with id {message_id}"))
+    # The events of a sharded queue not routed yet, then every shard, all deleted concurrently
+    queues += [queue for queue in shard_queues(RabbitMQConfig.MANUAL_MODERATION_QUEUE) if queue not in queues]
+    removed, success, truncated = await delete_messages_from_queues(queues, message_ids)
+    message = f"{'Successfully' if success else 'Partially'} removed all messages with {description}"
+    return DespResponse(data=DeleteMessagesResponse(message=message, removed=removed, truncated=truncated))
 
 
 register_init(init)
+expose_metrics(app)
+profile_requests(app)
+# Added last, the outermost middleware: the request span covers a profiled request too
+trace_requests(app)
+app.add_event_handler("shutdown", shutdown)
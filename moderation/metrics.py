@@ -0,0 +1,72 @@
+"""Prometheus instrumentation of the RabbitMQ hot path"""
+
+from fastapi import FastAPI, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+METRICS_PATH = "/metrics"
+
+# Histogram.time() is used as a context manager around the awaits, never as a decorator:
+# decorating a coroutine function would only time the creation of the coroutine.
+FETCH_SECONDS = Histogram(
+    "moderation_mq_fetch_seconds",
+    "Wait for the next delivery of a read pass, a basic.get or the bulk fetch buffer",
+    ["queue"],
+)
+DECODE_SECONDS = Histogram(
+    "moderation_mq_decode_seconds",
+    "Time spent decoding a message body",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+DRAIN_SECONDS = Histogram("moderation_mq_drain_seconds", "Duration of a read pass over a queue", ["queue"])
+DRAIN_MESSAGES = Histogram(
+    "moderation_mq_drain_messages",
+    "Number of messages read by a pass over a queue",
+    ["queue"],
+    buckets=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000),
+)
+ACK_SECONDS = Histogram("moderation_mq_ack_seconds", "Latency of a message ack")
+PUBLISH_SECONDS = Histogram("moderation_mq_publish_seconds", "Latency of a confirmed publish", ["exchange"])
+DECISION_BATCH_SIZE = Histogram(
+    "moderation_decision_batch_size",
+    "Number of decisions published together by the decision pipeline",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+DECISION_BUFFER_SIZE = Gauge("moderation_decision_buffer_size", "Decisions waiting in the decision pipeline")
+RULE_EVALUATION_SECONDS = Histogram(
+    "moderation_rule_evaluation_seconds",
+    "Time spent evaluating the automatic moderation rules on an event",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+AUTO_MODERATION_VERDICTS = Counter(
+    "moderation_auto_moderation_verdicts",
+    "Events decided by the automatic moderation, by verdict and by rule",
+    ["verdict", "rule"],
+)
+COALESCED_READS = Counter(
+    "moderation_coalesced_reads",
+    "Queue reads by outcome: read from the queue, shared with one in flight or served fresh from a recent one",
+    ["operation", "outcome"],
+)
+SEEN_IDS_LOOKUPS = Counter("moderation_seen_ids_lookups", "Lookups of the decided ids index, by outcome", ["outcome"])
+SEEN_IDS_SIZE = Gauge("moderation_seen_ids_size", "Decided ids remembered by the index")
+
+
+def expose_metrics(application: FastAPI) -> None:
+    """Serve the default prometheus registry on /metrics, unless a route already does
+
+    Args:
+        application (FastAPI): the service application
+    """
+    if any(getattr(route, "path", None) == METRICS_PATH for route in application.routes):
+        return
+
+    @application.get(METRICS_PATH, include_in_schema=False)
+    async def metrics() -> Response:
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,132 @@
+"""Moderation service settings"""
+
+from msfwk.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Largest QoS prefetch window, the prefetch_count of basic.qos is an unsigned 16-bit field
+MAX_PREFETCH_COUNT = 65535
+
+
+class ModerationConfig:
+    """Tunables of the moderation service, loaded from the `moderation` section of the app config"""
+
+    # Number of long-lived channels kept open on the shared RabbitMQ connection
+    CHANNEL_POOL_SIZE: int = 4
+    # Maximum time (in seconds) a request waits for a free channel
+    CHANNEL_ACQUIRE_TIMEOUT: float = 10.0
+    # Keep a resident consumer indexing the manual moderation queue by message id
+    PENDING_INDEX_ENABLED: bool = True
+    # Maximum number of unacked deliveries held by the resident consumer
+    PENDING_INDEX_PREFETCH: int = 1000
+    # Maximum number of queues read at the same time by a deletion
+    DELETE_MAX_CONCURRENCY: int = 4
+    # Move the messages that can't be decoded to the quarantine queue instead of leaving them in place
+    QUARANTINE_ENABLED: bool = True
+    # Durable queue holding the quarantined messages, declared at startup
+    QUARANTINE_QUEUE: str = "moderation.quarantine"
+    # Duration (in seconds) of a claim lease, unless renewed the events are handed out again after it
+    CLAIM_LEASE_SECONDS: float = 300.0
+    # Maximum number of events handed out by a single claim
+    CLAIM_MAX_SIZE: int = 100
+    # Prefix of the Redis keys of the leases, when redis_url is set
+    CLAIM_REDIS_PREFIX: str = "moderation:lease:"
+    # Publish the decisions in the background, the responses don't wait for the publish confirms
+    DECISION_PIPELINE_ENABLED: bool = True
+    # Maximum number of decisions waiting to be published, the decisions wait for room past it
+    DECISION_BUFFER_SIZE: int = 1000
+    # Maximum number of decisions published together
+    DECISION_BATCH_SIZE: int = 100
+    # Maximum time (in seconds) a decision waits for others to fill its batch
+    DECISION_FLUSH_INTERVAL: float = 0.05
+    # New attempts for a decision that failed to publish, before its event goes back to moderation
+    DECISION_PUBLISH_RETRIES: int = 3
+    # Seconds before the first retry, doubled on each attempt
+    DECISION_RETRY_DELAY: float = 0.5
+    # Seconds without change after which a keep-alive is sent on the live updates streams
+    LIVE_UPDATES_HEARTBEAT: float = 15.0
+    # Maximum number of changes waiting for a live updates client, a slower client gets a reset instead
+    LIVE_UPDATES_BUFFER_SIZE: int = 1000
+    # Share one pass over a queue between the concurrent identical listings and lookups
+    READ_COALESCING_ENABLED: bool = True
+    # Seconds during which the result of a shared read is served again, 0 only shares the reads in flight
+    READ_FRESHNESS_SECONDS: float = 1.0
+    # Maximum number of messages read by a pass over a queue, and default of the max_messages parameters, 0 for none
+    DRAIN_MAX_MESSAGES: int = 10000
+    # Maximum duration of a pass over a queue, and default of the deadline_ms parameters, 0 for none
+    DRAIN_DEADLINE_MS: int = 5000
+    # Consume the incoming events and decide on the clear-cut ones before the manual moderation
+    AUTO_MODERATION_ENABLED: bool = False
+    # Queue of the incoming events, the undecided ones are forwarded to the manual moderation queue
+    AUTO_MODERATION_QUEUE: str = "moderation.incoming"
+    # Number of incoming events evaluated at the same time
+    AUTO_MODERATION_PREFETCH: int = 100
+    # Keywords, patterns, user lists and area policies of the automatic moderation
+    AUTO_MODERATION_RULES: dict | None = None
+    # Cluster the near-duplicate events held by the pending index as they arrive
+    CLUSTERING_ENABLED: bool = True
+    # Maximum number of differing bits between the content fingerprints of two events of a cluster, out of 64
+    CLUSTER_MAX_DISTANCE: int = 6
+    # Number of words of the shingles the content fingerprints are computed on
+    CLUSTER_SHINGLE_SIZE: int = 3
+    # Keep the pending events held by the pending index in a full-text search index
+    SEARCH_ENABLED: bool = True
+    # Read the queues with a consumer and a prefetch window instead of one basic.get per message
+    BULK_FETCH_ENABLED: bool = True
+    # QoS prefetch window of a read pass, 0 for the max_messages of the pass, at most 65535.
+    # Deliveries are held until the pass ends, a smaller window stops the pass, truncated, once it is full
+    BULK_FETCH_PREFETCH: int = 0
+    # Milliseconds without a delivery after which a read pass ends, when other consumers took some of the messages
+    BULK_FETCH_IDLE_MS: int = 100
+    # Redis server shared by the replicas, e.g. redis://redis:6379/0, the features relying on it are local without it
+    REDIS_URL: str | None = None
+    # Maximum number of decided ids remembered, the least recently used ones are forgotten first
+    SEEN_IDS_MAX_SIZE: int = 100000
+    # Seconds during which a decided id is remembered
+    SEEN_IDS_TTL_SECONDS: float = 86400.0
+    # Prefix of the Redis keys of the decided ids, when redis_url is set
+    SEEN_IDS_REDIS_PREFIX: str = "moderation:seen:"
+    # Share the events held by the pending index with the other replicas and route the decisions to their holder
+    COORDINATION_ENABLED: bool = False
+    # Name of this replica among the others, the host name and a random suffix if not set
+    COORDINATION_REPLICA_ID: str | None = None
+    # Prefix of the Redis keys of the coordination
+    COORDINATION_PREFIX: str = "moderation:"
+    # Seconds between two heartbeats of a replica, its events are ignored after three missed ones
+    COORDINATION_HEARTBEAT: float = 5.0
+    # Seconds a replica waits for the answer to a request routed to another one
+    COORDINATION_REQUEST_TIMEOUT: float = 5.0
+    # Move the events of the manual moderation queue to one queue per functional area
+    SHARDING_ENABLED: bool = False
+    # Number of events routed to their shard at the same time
+    SHARD_ROUTER_PREFETCH: int = 100
+    # Record OpenTelemetry spans around the RabbitMQ stages of the requests, needs the opentelemetry-sdk package
+    TRACING_ENABLED: bool = False
+    # Where the spans go: console, memory (kept in the process, for tests) or otlp
+    TRACING_EXPORTER: str = "console"
+    # service.name of the spans
+    TRACING_SERVICE_NAME: str = "moderation"
+    # Token of the X-Moderation-Profile header answering a request with its sampling profile, no profiling if not set
+    PROFILING_TOKEN: str | None = None
+    # Milliseconds between two samples of a profiled request
+    PROFILING_INTERVAL_MS: float = 5.0
+    # Longest profile in seconds, the profiled request is cut past it
+    PROFILING_MAX_SECONDS: float = 30.0
+
+
+def load_moderation_config(app_config: dict) -> None:
+    """Override the ModerationConfig defaults with the values of the `moderation` section
+
+    Args:
+        app_config (dict): the application configuration
+    """
+    section = app_config.get("moderation") or {}
+    for key, value in section.items():
+        attribute = key.upper()
+        if not hasattr(ModerationConfig, attribute):
+            logger.warning("Unknown moderation setting ignored: %s", key)
+            continue
+        if attribute.endswith("_PREFETCH") and value > MAX_PREFETCH_COUNT:
+            logger.warning("Moderation setting %s capped to %s: %s", key, MAX_PREFETCH_COUNT, value)
+            value = MAX_PREFETCH_COUNT  # noqa: PLW2901
+        setattr(ModerationConfig, attribute, value)
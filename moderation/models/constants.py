@@ -2,5 +2,13 @@ MQCONNECTION_FAILED = 20001
 MESSAGE_RETRIEVE_FAILED = 20002
 QUEUE_NOT_FOUND = 20003
 MESSAGE_NOT_FOUND = 20004
+INVALID_CURSOR = 20005
+LEASE_NOT_FOUND = 20006
+LIVE_UPDATES_UNAVAILABLE = 20007
+DRAIN_TRUNCATED = 20008
+CLUSTER_NOT_FOUND = 20009
+ALREADY_DECIDED = 20010
 ACCEPTED_HISTORY_MESSAGE = "Accepted during Manual Moderation"
 REJECTED_HISTORY_MESSAGE = "Rejected during Manual Moderation"
+AUTO_ACCEPTED_HISTORY_MESSAGE = "Accepted during Automatic Moderation"
+AUTO_REJECTED_HISTORY_MESSAGE = "Rejected during Automatic Moderation"
@@ -12,3 +12,19 @@ class GetMessagesError(Exception):
 
 class MQMessageNotFoundError(Exception):
     """Wanted message not found"""
+
+
+class InvalidCursorError(ValueError):
+    """Pagination cursor could not be decoded"""
+
+
+class LeaseNotFoundError(Exception):
+    """Lease unknown or already expired"""
+
+
+class ClusterNotFoundError(Exception):
+    """No pending event left in the cluster"""
+
+
+class AlreadyDecidedError(Exception):
+    """The event has already been decided the other way"""
@@ -1,4 +1,5 @@
-from datetime import datetime
+from datetime import UTC, datetime
+from enum import StrEnum
 
 from msfwk.desp.rabbitmq.mq_message import (
     DespFonctionnalArea,
@@ -6,11 +7,11 @@ from msfwk.desp.rabbitmq.mq_message import (
     ModerationEventStatus,
     MQContentByTypeModel,
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
-class Event(BaseModel):
-    """Holds an event response"""
+class EventSummary(BaseModel):
+    """Holds the header of an event, everything but its content"""
 
     id: str
     routing_key: str
@@ -21,9 +22,14 @@ class Event(BaseModel):
     url: str | None
     fonctionnal_area: DespFonctionnalArea
     content_id: int | str | None
-    content: MQContentByTypeModel
     history: list[str]
 
+
+class Event(EventSummary):
+    """Holds an event response"""
+
+    content: MQContentByTypeModel
+
     @classmethod
     def from_message(cls, message: DespMQMessage) -> "Event":
         """Build an Event
@@ -46,6 +52,46 @@ class Event(BaseModel):
         )
 
 
+def as_utc(date: datetime) -> datetime:
+    """Make a date comparable whatever its awareness, naive dates are considered UTC"""
+    if date.tzinfo is None:
+        return date.replace(tzinfo=UTC)
+    return date
+
+
+class EventView(StrEnum):
+    """How much of each event the listing returns"""
+
+    FULL = "full"
+    SUMMARY = "summary"
+
+
+class EventFilter(BaseModel):
+    """Server side filters of the moderation listing"""
+
+    fonctionnal_area: DespFonctionnalArea | None = None
+    user_id: str | None = None
+    status: ModerationEventStatus | None = None
+    date_from: datetime | None = None
+    date_to: datetime | None = None
+
+    def matches(self, event: EventSummary) -> bool:
+        """Check the event against every filter set
+
+        Args:
+            event (EventSummary): __desc__
+        """
+        if self.fonctionnal_area is not None and event.fonctionnal_area != self.fonctionnal_area:
+            return False
+        if self.user_id is not None and event.user_id != self.user_id:
+            return False
+        if self.status is not None and event.status != self.status:
+            return False
+        if self.date_from is not None and as_utc(event.date) < as_utc(self.date_from):
+            return False
+        return not (self.date_to is not None and as_utc(event.date) > as_utc(self.date_to))
+
+
 class MQLoadErrorMessage(BaseModel):
     """Model for message that failed to load during parsing or decode()"""
 
@@ -63,26 +109,55 @@ class GetEventsResponse(BaseModel):
     """Hold the content of GetEvents"""
 
     event_count: int
-    events: list[Event]
+    events: list[Event | EventSummary]
     errors: list[MQLoadErrorMessage]
+    next_cursor: str | None = None
+    # The queue was read up to its budget, only its first `scanned` messages are listed
+    truncated: bool = False
+    scanned: int = 0
+    # With clustered=true, the near-duplicate clusters of the events of the page
+    clusters: list["EventCluster"] = Field(default_factory=list)
 
     @classmethod
-    def from_message_list_and_error(
-        cls, message_list: list[DespMQMessage], errors: list[MQLoadErrorMessage]
+    def from_event_list_and_error(  # noqa: PLR0913
+        cls,
+        event_list: list[Event | EventSummary],
+        errors: list[MQLoadErrorMessage],
+        event_count: int | None = None,
+        next_cursor: str | None = None,
+        truncated: bool = False,
+        scanned: int = 0,
     ) -> "GetEventsResponse":
         """Generate this model
 
         Args:
-            message_list (list[DespMQMessage]): list of message
+            event_list (list[Event | EventSummary]): list of events, summaries when the content is not wanted
             errors (list[MQLoadErrorMessage]): list of errors
+            event_count (int | None): total number of events when event_list is a page. Defaults to its length.
+            next_cursor (str | None): cursor of the next page, None on the last one
+            truncated (bool): the read of the queue stopped on its budget
+            scanned (int): number of messages read from the queue, besides the pending index
         """
         return GetEventsResponse(
-            event_count=len(message_list),
-            events=[Event.from_message(message) for message in message_list],
+            event_count=len(event_list) if event_count is None else event_count,
+            events=event_list,
             errors=errors,
+            next_cursor=next_cursor,
+            truncated=truncated,
+            scanned=scanned,
         )
 
 
+class EventStreamLine(BaseModel):
+    """One line of the NDJSON listing, holds either an event or a load error"""
+
+    event: Event | EventSummary | None = None
+    error: MQLoadErrorMessage | None = None
+    # Last line when the read of the queue stopped on its budget
+    truncated: bool | None = None
+    scanned: int | None = None
+
+
 class ToHandlingResponse(BaseModel):
     """Response for accept and reject"""
 
@@ -90,7 +165,171 @@ class ToHandlingResponse(BaseModel):
     message_id: str
 
 
+class DeleteMessagesRequest(BaseModel):
+    """Body of DELETE messages"""
+
+    ids: list[str] = Field(min_length=1)
+
+
 class DeleteMessagesResponse(BaseModel):
     """Response for DELETE messages"""
 
     message: str = "success"
+    removed: dict[str, dict[str, int]] = Field(default_factory=dict)
+    # Queues whose read stopped on its budget, the messages past it are left in place
+    truncated: list[str] = Field(default_factory=list)
+
+
+class ModerationDecision(BaseModel):
+    """A moderation decision on a single event"""
+
+    id: str
+    status: ModerationEventStatus
+    history: str = ""
+
+
+class DecisionsRequest(BaseModel):
+    """Body of POST decisions"""
+
+    decisions: list[ModerationDecision] = Field(min_length=1)
+
+
+class DecisionOutcome(StrEnum):
+    """What happened to a decision of a batch"""
+
+    APPLIED = "applied"
+    NOT_FOUND = "not_found"
+    FAILED = "failed"
+
+
+class DecisionResult(BaseModel):
+    """Result of a single decision of a batch"""
+
+    message_id: str
+    outcome: DecisionOutcome
+    error: str | None = None
+
+
+class EventCluster(BaseModel):
+    """Pending events with near identical content"""
+
+    cluster_id: str
+    size: int
+    message_ids: list[str]
+
+
+class GetClustersResponse(BaseModel):
+    """Hold the content of GetClusters"""
+
+    cluster_count: int
+    clusters: list[EventCluster]
+
+
+class SearchHit(BaseModel):
+    """A pending event matching a search and its BM25 score"""
+
+    message_id: str
+    score: float
+
+
+class SearchEventsResponse(BaseModel):
+    """Hold the content of SearchEvents"""
+
+    hit_count: int
+    hits: list[SearchHit]
+    # The matching events in rank order
+    events: list[Event | EventSummary]
+    # The queue was read up to its budget, only its first `scanned` messages were searched
+    truncated: bool = False
+    scanned: int = 0
+
+
+class ClusterDecision(BaseModel):
+    """Body of POST cluster decision, applied to every event of the cluster"""
+
+    status: ModerationEventStatus
+    history: str = ""
+
+
+class DecisionsResponse(BaseModel):
+    """Response for POST decisions"""
+
+    results: list[DecisionResult]
+
+
+class QuarantinedMessage(BaseModel):
+    """A message moved to the quarantine queue because it could not be decoded"""
+
+    id: str
+    source_queue: str | None
+    error: str | None
+    quarantined_at: datetime | None
+    content: str
+
+
+class GetQuarantineResponse(BaseModel):
+    """Response for GET quarantine"""
+
+    message_count: int
+    messages: list[QuarantinedMessage]
+
+
+class QuarantineRequest(BaseModel):
+    """Body of the quarantine replay and purge, every quarantined message when ids is not set"""
+
+    ids: list[str] | None = Field(default=None, min_length=1)
+
+
+class QuarantineResponse(BaseModel):
+    """Response for the quarantine replay and purge"""
+
+    message: str = "success"
+    count: int = 0
+    ids: list[str] = Field(default_factory=list)
+
+
+class ClaimResponse(BaseModel):
+    """Response for POST claim, the events are reserved to the caller until the lease expires"""
+
+    lease_id: str
+    expires_at: datetime
+    events: list[Event | EventSummary]
+
+
+class LeaseResponse(BaseModel):
+    """Response for the lease renew and release"""
+
+    lease_id: str
+    expires_at: datetime
+    message_ids: list[str]
+
+
+class AgePercentiles(BaseModel):
+    """Age of the pending events in seconds"""
+
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+class SeenIdStats(BaseModel):
+    """Size and lookups of the decided ids index"""
+
+    size: int
+    hits: int
+    misses: int
+
+
+class QueueStatsResponse(BaseModel):
+    """Response for GET stats"""
+
+    queue: str
+    depth: int
+    ready: int
+    consumers: int
+    summarized: int
+    complete: bool
+    age_seconds: AgePercentiles | None = None
+    fonctionnal_areas: dict[str, int] = Field(default_factory=dict)
+    seen_ids: SeenIdStats | None = None
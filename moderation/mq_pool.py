@@ -0,0 +1,177 @@
+"""Shared RabbitMQ connection and channel pool"""
+
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from aio_pika import RobustChannel, RobustConnection
+from aio_pika import exceptions as aio_pika_exceptions
+from msfwk.mqclient import MQClient, RabbitMQConfig
+from msfwk.utils.logging import get_logger
+
+from moderation.models.config import ModerationConfig
+from moderation.models.exceptions import MQServerConnectionError
+from moderation.tracing import span
+from moderation.utils import connect_to_rabbitmq
+
+logger = get_logger(__name__)
+
+
+class MQChannelPool:
+    """Keep one RabbitMQ connection and a fixed number of channels open for the whole service.
+
+    Channels are handed out with `acquire()` and given back when the block exits.
+    A channel (or the connection) found closed is reopened on the next checkout.
+    """
+
+    def __init__(self, size: int, acquire_timeout: float) -> None:
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._client: MQClient | None = None
+        self._connect_lock = asyncio.Lock()
+        # A slot holds an open channel, or None when it has to be (re)opened
+        self._slots: asyncio.Queue[RobustChannel | None] = asyncio.Queue()
+        self._closed = False
+        for _ in range(size):
+            self._slots.put_nowait(None)
+
+    @property
+    def client(self) -> MQClient | None:
+        """The underlying client, None until the pool is opened"""
+        return self._client
+
+    async def open(self) -> None:
+        """Connect to the server and open every channel of the pool
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        await self._ensure_connection()
+        for _ in range(self.size):
+            slot = self._slots.get_nowait()
+            try:
+                slot = await self._open_slot(slot)
+            finally:
+                self._slots.put_nowait(slot)
+        logger.info("RabbitMQ channel pool opened with %s channels", self.size)
+
+    async def close(self) -> None:
+        """Close all the idle channels and the connection, checked out channels are closed on release"""
+        self._closed = True
+        while not self._slots.empty():
+            channel = self._slots.get_nowait()
+            if channel is not None and not channel.is_closed:
+                await channel.close()
+        if self._client is not None and self._client.connection and not self._client.connection.is_closed:
+            await self._client.connection.close()
+        self._client = None
+        logger.info("RabbitMQ channel pool closed")
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[RobustChannel]:
+        """Check a healthy channel out of the pool for the duration of the block
+
+        Raises:
+            MQServerConnectionError: No channel available in time or failed to connect to server
+        """
+        if self._closed:
+            message = "The RabbitMQ channel pool is closed"
+            raise MQServerConnectionError(message)
+        try:
+            with span("rabbitmq.acquire_channel"):
+                slot = await asyncio.wait_for(self._slots.get(), timeout=self.acquire_timeout)
+        except TimeoutError as te:
+            message = f"No RabbitMQ channel available after {self.acquire_timeout}s"
+            raise MQServerConnectionError(message) from te
+
+        channel: RobustChannel | None = None
+        try:
+            channel = await self._open_slot(slot)
+            yield channel
+        finally:
+            await self._release(channel)
+
+    async def open_channel(self, prefetch_count: int | None = None) -> RobustChannel:
+        """Open a dedicated channel on the shared connection, outside of the pool rotation.
+        Used by long running consumers, the caller owns and closes it.
+
+        Args:
+            prefetch_count (int | None): QoS prefetch window to set on the channel
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        channel = await self._open_slot(None)
+        if prefetch_count is not None:
+            await channel.set_qos(prefetch_count=prefetch_count)
+        return channel
+
+    async def _open_slot(self, slot: RobustChannel | None) -> RobustChannel:
+        """Return the channel of the slot if healthy, else open a new one"""
+        if slot is not None and not slot.is_closed:
+            return slot
+        connection = await self._ensure_connection()
+        try:
+            with span("rabbitmq.open_channel"):
+                return await connection.channel()
+        except (aio_pika_exceptions.AMQPError, ConnectionError) as error:
+            message = f"Failed to open a RabbitMQ channel: {error}"
+            logger.exception(message, exc_info=error)
+            raise MQServerConnectionError(message) from error
+
+    async def _release(self, channel: RobustChannel | None) -> None:
+        """Give the slot back to the pool, dropping the channel if it is no longer usable"""
+        if self._closed:
+            if channel is not None and not channel.is_closed:
+                await channel.close()
+            return
+        if channel is not None and channel.is_closed:
+            logger.warning("Dropping closed RabbitMQ channel from the pool")
+            channel = None
+        self._slots.put_nowait(channel)
+
+    async def _ensure_connection(self) -> RobustConnection:
+        """Return the shared connection, reconnecting if it has been lost"""
+        async with self._connect_lock:
+            if self._client is None or not self._client.connection or self._client.connection.is_closed:
+                if self._client is not None:
+                    logger.warning("RabbitMQ connection lost, reconnecting")
+                self._client = await connect_to_rabbitmq(RabbitMQConfig)
+            return self._client.connection
+
+
+_pool: MQChannelPool | None = None
+
+
+async def init_mq_pool() -> MQChannelPool:
+    """Create and open the service wide channel pool
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+    """
+    global _pool  # noqa: PLW0603
+    if _pool is not None:
+        await _pool.close()
+    _pool = MQChannelPool(ModerationConfig.CHANNEL_POOL_SIZE, ModerationConfig.CHANNEL_ACQUIRE_TIMEOUT)
+    await _pool.open()
+    return _pool
+
+
+def get_mq_pool() -> MQChannelPool:
+    """Return the service wide channel pool
+
+    Raises:
+        MQServerConnectionError: The pool has not been initialised
+    """
+    if _pool is None:
+        message = "The RabbitMQ channel pool is not initialised"
+        raise MQServerConnectionError(message)
+    return _pool
+
+
+async def close_mq_pool() -> None:
+    """Close the service wide channel pool"""
+    global _pool  # noqa: PLW0603
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,62 @@
+"""Cursor pagination of the moderation listing"""
+
+import base64
+import binascii
+import json
+from bisect import bisect_right
+from datetime import datetime
+
+from moderation.decoding import DecodedMessage
+from moderation.models.exceptions import InvalidCursorError
+from moderation.models.interfaces import EventFilter, as_utc
+
+
+def event_position(message: DecodedMessage) -> tuple[datetime, str]:
+    return as_utc(message.summary.date), message.id
+
+
+def encode_cursor(message: DecodedMessage) -> str:
+    """Build the opaque cursor pointing right after the given message"""
+    date, message_id = event_position(message)
+    position = json.dumps([date.isoformat(), message_id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Return the (date, id) position held by a cursor
+
+    Raises:
+        InvalidCursorError: the cursor was not produced by encode_cursor
+    """
+    try:
+        date, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return as_utc(datetime.fromisoformat(date)), str(message_id)
+    except (binascii.Error, ValueError, TypeError) as error:
+        message = f"Invalid cursor: {cursor}"
+        raise InvalidCursorError(message) from error
+
+
+def paginate_messages(
+    messages: list[DecodedMessage], event_filter: EventFilter, limit: int | None = None, cursor: str | None = None
+) -> tuple[list[DecodedMessage], int, str | None]:
+    """Filter the messages on their header and cut the page following the cursor, oldest first
+
+    Args:
+        messages (list[DecodedMessage]): the pending messages
+        event_filter (EventFilter): filters to apply
+        limit (int | None): page size, no limit if None
+        cursor (str | None): cursor returned with the previous page
+
+    Raises:
+        InvalidCursorError: the cursor was not produced by this service
+
+    Returns:
+        tuple[list[DecodedMessage], int, str | None]: the page, the number of matching messages and the next cursor
+    """
+    matching = sorted((message for message in messages if event_filter.matches(message.summary)), key=event_position)
+    start = 0 if cursor is None else bisect_right(matching, decode_cursor(cursor), key=event_position)
+    if limit is None:
+        return matching[start:], len(matching), None
+    page = matching[start : start + limit]
+    next_cursor = encode_cursor(page[-1]) if page and start + limit < len(matching) else None
+    return page, len(matching), next_cursor
@@ -0,0 +1,202 @@
+"""Resident consumer keeping the pending moderation events indexed by id"""
+
+from typing import Protocol
+
+from aio_pika import RobustChannel, RobustQueue
+from aio_pika import exceptions as aio_pika_exceptions
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.utils.logging import get_logger
+
+from moderation.decoding import DecodedMessage, decode_message
+from moderation.models.config import ModerationConfig
+from moderation.models.interfaces import MQLoadErrorMessage
+from moderation.mq_pool import MQChannelPool
+from moderation.publishing import quarantine_message
+from moderation.seen_ids import decision_of
+from moderation.utils import ack_message
+
+logger = get_logger(__name__)
+
+
+class PendingIndexListener(Protocol):
+    """Notified of every change of a pending index, from the event loop, must not block"""
+
+    def on_added(self, decoded: DecodedMessage) -> None:
+        """A message entered the index"""
+
+    def on_removed(self, decoded: DecodedMessage) -> None:
+        """A message left the index: decided, deleted or replaced by a newer copy"""
+
+    def on_cleared(self) -> None:
+        """Every message left the index with its channel"""
+
+
+class PendingEventIndex:
+    """Consume a moderation queue with a bounded prefetch and keep the unacked deliveries
+    in a dict keyed by message id, so lookups and decisions don't have to scan the queue.
+
+    Only the first `prefetch_count` messages of the queue are held by the consumer,
+    when the index is `saturated` the remaining ones still have to be read from the queue.
+    """
+
+    def __init__(self, queue_name: str, prefetch_count: int) -> None:
+        self.queue_name = queue_name
+        self.prefetch_count = prefetch_count
+        self._entries: dict[str, tuple[DecodedMessage, AbstractIncomingMessage]] = {}
+        # Deliveries that could not be decoded nor quarantined, they still occupy a prefetch slot
+        self._invalid: dict[int, tuple[MQLoadErrorMessage, AbstractIncomingMessage]] = {}
+        self._channel: RobustChannel | None = None
+        self._queue: RobustQueue | None = None
+        self._consumer_tag: str | None = None
+        self._listeners: list[PendingIndexListener] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._entries
+
+    @property
+    def saturated(self) -> bool:
+        """True when the prefetch window is full and the queue may hold more messages"""
+        return len(self._entries) + len(self._invalid) >= self.prefetch_count
+
+    @property
+    def errors(self) -> list[MQLoadErrorMessage]:
+        """The load errors of the held deliveries"""
+        return [error for error, _ in self._invalid.values()]
+
+    def messages(self) -> list[DecodedMessage]:
+        """The pending messages, in delivery order"""
+        return [decoded for decoded, _ in self._entries.values()]
+
+    def get(self, message_id: str) -> tuple[DecodedMessage, AbstractIncomingMessage] | None:
+        """Return the pending message with the given id, None if not held by the index"""
+        return self._entries.get(message_id)
+
+    def pop(self, message_id: str) -> tuple[DecodedMessage, AbstractIncomingMessage] | None:
+        """Remove the message with the given id from the index, the caller has to ack or requeue it"""
+        mq_message_tuple = self._entries.pop(message_id, None)
+        if mq_message_tuple is not None:
+            self._notify("on_removed", mq_message_tuple[0])
+        return mq_message_tuple
+
+    async def discard(self, message_id: str) -> bool:
+        """Drop the held copy of a decided message, acked so it leaves the queue. False if not held"""
+        mq_message_tuple = self.pop(message_id)
+        if mq_message_tuple is None:
+            return False
+        try:
+            await ack_message(mq_message_tuple[1])
+        except (aio_pika_exceptions.AMQPError, ConnectionError) as error:
+            # Redelivered once the channel is restored, then dropped as decided
+            logger.warning("Failed to ack the held copy of message %s: %s", message_id, error)
+        return True
+
+    def add_listener(self, listener: PendingIndexListener) -> None:
+        """Get notified of the changes of the index, the messages already held are replayed as additions"""
+        self._listeners.append(listener)
+        for decoded, _ in self._entries.values():
+            listener.on_added(decoded)
+
+    def remove_listener(self, listener: PendingIndexListener) -> None:
+        """Stop notifying a listener"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def start(self, pool: MQChannelPool) -> None:
+        """Open a dedicated channel and start consuming the queue
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        self._channel = await pool.open_channel(prefetch_count=self.prefetch_count)
+        # Deliveries die with the channel, the broker redelivers them once the robust channel is restored
+        self._channel.close_callbacks.add(self._on_channel_closed)
+        self._queue = await self._channel.get_queue(self.queue_name, ensure=False)
+        self._consumer_tag = await self._queue.consume(self._on_message, no_ack=False)
+        logger.info("Pending index started on queue %s (prefetch %s)", self.queue_name, self.prefetch_count)
+
+    async def stop(self) -> None:
+        """Stop consuming, every held delivery goes back to the queue with the channel"""
+        if self._queue is not None and self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+        if self._channel is not None and not self._channel.is_closed:
+            await self._channel.close()
+        self._clear()
+        self._channel = self._queue = self._consumer_tag = None
+
+    async def _on_message(self, message: AbstractIncomingMessage) -> None:
+        """Index a new delivery, keeping only the latest copy of an id and dropping the decided ones"""
+        errors: list[MQLoadErrorMessage] = []
+        decoded = decode_message(message, errors)
+        if decoded is None:
+            if self._channel is None or not await quarantine_message(
+                self._channel, message, self.queue_name, errors[0]
+            ):
+                self._invalid[message.delivery_tag] = errors[0], message
+            return
+        if await decision_of(decoded.id, confirmed=True) is not None:
+            logger.debug("Message %s already decided, dropping its copy", decoded.id)
+            await ack_message(message)
+            return
+        previous = self._entries.pop(decoded.id, None)
+        if previous is not None:
+            logger.debug("Duplicate of message %s received, dropping the older copy", decoded.id)
+            self._notify("on_removed", previous[0])
+            await ack_message(previous[1])
+        if message.redelivered:
+            logger.debug("Message %s redelivered", decoded.id)
+        self._entries[decoded.id] = decoded, message
+        self._notify("on_added", decoded)
+
+    def _on_channel_closed(self, *_: object) -> None:
+        """Forget the deliveries of a closed channel"""
+        logger.warning("Pending index channel closed, %s deliveries released", len(self._entries))
+        self._clear()
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._invalid.clear()
+        self._notify("on_cleared")
+
+    def _notify(self, event: str, *args: DecodedMessage) -> None:
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(*args)
+            except Exception as error:  # noqa: BLE001
+                logger.exception("Pending index listener %r failed on %s", listener, event, exc_info=error)
+
+
+_indexes: dict[str, PendingEventIndex] = {}
+
+
+async def start_pending_index(pool: MQChannelPool, queue_name: str) -> PendingEventIndex:
+    """Create and start the pending index of the given queue
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+    """
+    index = PendingEventIndex(queue_name, ModerationConfig.PENDING_INDEX_PREFETCH)
+    await index.start(pool)
+    _indexes[queue_name] = index
+    return index
+
+
+def get_pending_index(queue_name: str) -> PendingEventIndex | None:
+    """Return the pending index of the given queue, None if the queue is not indexed"""
+    return _indexes.get(queue_name)
+
+
+async def discard_decided_copies(message_id: str) -> None:
+    """Drop the copies of a decided message held by the pending indexes"""
+    for index in list(_indexes.values()):
+        if await index.discard(message_id):
+            logger.info("Message %s already decided, dropping its copy held by the index", message_id)
+
+
+async def stop_pending_indexes() -> None:
+    """Stop every running pending index"""
+    while _indexes:
+        _, index = _indexes.popitem()
+        await index.stop()
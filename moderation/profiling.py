@@ -0,0 +1,116 @@
+"""Sampling profile of a single request, to find where a slow request spends its time in production.
+
+A request carrying the `X-Moderation-Profile` header set to `profiling_token` is served as usual while the thread
+of the event loop is sampled every `profiling_interval_ms`, then answered with the sampled stacks in place of its
+response. The stacks are in the folded format of flamegraph.pl and speedscope, most sampled first: the time spent
+awaiting the broker shows as the selector of the loop. The other requests served meanwhile by the loop show up in
+the samples too. Profiling is off while `profiling_token` is not set.
+"""
+
+import asyncio
+import hmac
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from types import FrameType
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
+from msfwk.utils.logging import get_logger
+
+from moderation.models.config import ModerationConfig
+
+logger = get_logger(__name__)
+
+PROFILE_HEADER = "X-Moderation-Profile"
+PROFILED_STATUS_HEADER = "X-Profiled-Status"
+PROFILE_SAMPLES_HEADER = "X-Profile-Samples"
+
+
+class SamplingProfiler:
+    """Background thread counting the stacks of another thread, sampled at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float, max_seconds: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="moderation-profiler", daemon=True)
+
+    def start(self) -> None:
+        """Start sampling"""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the last sample"""
+        self._stopped.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        """The sampled stacks, one `root;...;leaf count` line per stack, most sampled first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def _run(self) -> None:
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stopped.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)  # noqa: SLF001
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+
+def _stack(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _profiling_asked(request: Request) -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    if token is None or not ModerationConfig.PROFILING_TOKEN:
+        return False
+    if not hmac.compare_digest(token.encode(), ModerationConfig.PROFILING_TOKEN.encode()):
+        logger.warning("Profiling of %s %s refused, wrong token", request.method, request.url.path)
+        return False
+    return True
+
+
+def profile_requests(application: FastAPI) -> None:
+    """Answer the requests asking for it with their sampling profile
+
+    Args:
+        application (FastAPI): the service application
+    """
+
+    @application.middleware("http")
+    async def profile_request(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        if not _profiling_asked(request):
+            return await call_next(request)
+        profiler = SamplingProfiler(
+            threading.get_ident(),
+            ModerationConfig.PROFILING_INTERVAL_MS / 1000,
+            ModerationConfig.PROFILING_MAX_SECONDS,
+        )
+        status = "timeout"
+        profiler.start()
+        try:
+            # A streamed response is profiled until its end, or until profiling_max_seconds for the endless ones
+            async with asyncio.timeout(ModerationConfig.PROFILING_MAX_SECONDS):
+                response = await call_next(request)
+                status = str(response.status_code)
+                async for _ in response.body_iterator:
+                    pass
+        except TimeoutError:
+            logger.warning("Profiling of %s %s stopped after its maximum duration", request.method, request.url.path)
+        finally:
+            profiler.stop()
+        logger.info("Profiled %s %s: %s samples", request.method, request.url.path, profiler.samples.total())
+        return PlainTextResponse(
+            profiler.folded(),
+            headers={PROFILED_STATUS_HEADER: status, PROFILE_SAMPLES_HEADER: str(profiler.samples.total())},
+        )
@@ -0,0 +1,171 @@
+"""Publication of moderation messages on pooled channels"""
+
+import asyncio
+import json
+import uuid
+from datetime import UTC, datetime
+from enum import Enum
+
+from aio_pika import DeliveryMode, Message, RobustChannel
+from aio_pika import exceptions as aio_pika_exceptions
+from aio_pika.abc import AbstractExchange, AbstractIncomingMessage
+from msfwk.desp.rabbitmq.mq_message import DespMQMessage
+from msfwk.utils.logging import get_logger
+
+from moderation.metrics import PUBLISH_SECONDS
+from moderation.models.config import ModerationConfig
+from moderation.models.interfaces import MQLoadErrorMessage
+from moderation.tracing import span
+from moderation.utils import ack_message
+
+logger = get_logger(__name__)
+
+QUARANTINE_ERROR_HEADER = "x-quarantine-error"
+QUARANTINE_SOURCE_HEADER = "x-quarantine-source-queue"
+QUARANTINE_DATE_HEADER = "x-quarantine-date"
+ORIGINAL_MESSAGE_ID_HEADER = "x-original-message-id"
+QUARANTINE_HEADERS = (
+    QUARANTINE_ERROR_HEADER,
+    QUARANTINE_SOURCE_HEADER,
+    QUARANTINE_DATE_HEADER,
+    ORIGINAL_MESSAGE_ID_HEADER,
+)
+# The error repeats the payload, keep the header well below the frame size
+MAX_ERROR_HEADER_LENGTH = 1024
+
+
+def _json_default(value: object) -> object:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+def encode_message(mq_message: DespMQMessage) -> bytes:
+    """Serialize a message the way it is read by decode_message"""
+    return json.dumps(mq_message.to_dict(), default=_json_default).encode()
+
+
+async def publish_messages(
+    channel: RobustChannel, mq_messages: list[DespMQMessage], exchange_name: str, routing_key: str
+) -> list[BaseException | None]:
+    """Publish the messages concurrently, each publish waiting for its broker confirm
+
+    Args:
+        channel (RobustChannel): channel checked out of the pool
+        mq_messages (list[DespMQMessage]): messages to publish
+        exchange_name (str): destination exchange
+        routing_key (str): routing key of every message
+
+    Returns:
+        list[BaseException | None]: for each message, the error that prevented its publication if any
+    """
+    exchange = await channel.get_exchange(exchange_name, ensure=False)
+    results = await asyncio.gather(
+        *(_publish(exchange, mq_message, routing_key) for mq_message in mq_messages),
+        return_exceptions=True,
+    )
+    return [result if isinstance(result, BaseException) else None for result in results]
+
+
+async def _publish(exchange: AbstractExchange, mq_message: DespMQMessage, routing_key: str) -> None:
+    message = Message(
+        body=encode_message(mq_message),
+        content_type="application/json",
+        delivery_mode=DeliveryMode.PERSISTENT,
+        message_id=mq_message.id,
+    )
+    with (
+        span("rabbitmq.publish", exchange=exchange.name, routing_key=routing_key, message_id=mq_message.id),
+        PUBLISH_SECONDS.labels(exchange.name).time(),
+    ):
+        await exchange.publish(message, routing_key=routing_key)
+
+
+async def quarantine_message(
+    channel: RobustChannel, message: AbstractIncomingMessage, source_queue: str, error: MQLoadErrorMessage
+) -> bool:
+    """Move a delivery that can't be decoded to the quarantine queue.
+    The body is published unchanged with the error in its headers, the delivery is acked once the publish is confirmed.
+
+    Args:
+        channel (RobustChannel): channel the delivery was received on
+        message (AbstractIncomingMessage): the delivery
+        source_queue (str): queue the delivery was read from, where a replay sends it back
+        error (MQLoadErrorMessage): why it could not be decoded
+
+    Returns:
+        bool: False when the quarantine is disabled or the publish failed, the delivery is then left to the caller
+    """
+    if not ModerationConfig.QUARANTINE_ENABLED:
+        return False
+    headers = dict(message.headers or {})
+    headers.update(
+        {
+            QUARANTINE_ERROR_HEADER: error.error[:MAX_ERROR_HEADER_LENGTH],
+            QUARANTINE_SOURCE_HEADER: source_queue,
+            QUARANTINE_DATE_HEADER: datetime.now(UTC).isoformat(),
+        }
+    )
+    if message.message_id:
+        headers[ORIGINAL_MESSAGE_ID_HEADER] = message.message_id
+    quarantined = Message(
+        body=message.body,
+        content_type=message.content_type,
+        headers=headers,
+        delivery_mode=DeliveryMode.PERSISTENT,
+        message_id=uuid.uuid4().hex,
+    )
+    try:
+        with PUBLISH_SECONDS.labels(channel.default_exchange.name).time():
+            await channel.default_exchange.publish(quarantined, routing_key=ModerationConfig.QUARANTINE_QUEUE)
+    except (aio_pika_exceptions.AMQPError, ConnectionError) as publish_error:
+        logger.exception("Failed to quarantine a message of queue %s", source_queue, exc_info=publish_error)
+        return False
+    await ack_message(message)
+    logger.warning("Message of queue %s quarantined as %s: %s", source_queue, quarantined.message_id, error.error)
+    return True
+
+
+async def forward_message(channel: RobustChannel, message: AbstractIncomingMessage, queue_name: str) -> None:
+    """Publish a delivery unchanged to the given queue, waiting for the broker confirm
+
+    Args:
+        channel (RobustChannel): channel the delivery was received on
+        message (AbstractIncomingMessage): the delivery, left to the caller to ack
+        queue_name (str): destination queue
+    """
+    forwarded = Message(
+        body=message.body,
+        content_type=message.content_type,
+        headers=dict(message.headers or {}),
+        delivery_mode=DeliveryMode.PERSISTENT,
+        message_id=message.message_id,
+    )
+    with (
+        span("rabbitmq.publish", routing_key=queue_name, message_id=message.message_id),
+        PUBLISH_SECONDS.labels(channel.default_exchange.name).time(),
+    ):
+        await channel.default_exchange.publish(forwarded, routing_key=queue_name)
+
+
+async def replay_message(channel: RobustChannel, message: AbstractIncomingMessage, queue_name: str) -> None:
+    """Publish a quarantined message back to the given queue, as it was before its quarantine
+
+    Args:
+        channel (RobustChannel): channel checked out of the pool
+        message (AbstractIncomingMessage): the quarantined delivery, left to the caller to ack
+        queue_name (str): destination queue
+    """
+    headers = {key: value for key, value in (message.headers or {}).items() if key not in QUARANTINE_HEADERS}
+    original_id = (message.headers or {}).get(ORIGINAL_MESSAGE_ID_HEADER)
+    replayed = Message(
+        body=message.body,
+        content_type=message.content_type,
+        headers=headers,
+        delivery_mode=DeliveryMode.PERSISTENT,
+        message_id=str(original_id) if original_id else None,
+    )
+    with PUBLISH_SECONDS.labels(channel.default_exchange.name).time():
+        await channel.default_exchange.publish(replayed, routing_key=queue_name)
@@ -0,0 +1,138 @@
+"""Listing, replay and purge of the quarantined messages"""
+
+from datetime import UTC, datetime
+
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.utils.logging import get_logger
+
+from moderation.fetch_messages import drain_queue, get_mq_queue
+from moderation.models.config import ModerationConfig
+from moderation.models.interfaces import QuarantinedMessage
+from moderation.mq_pool import MQChannelPool, get_mq_pool
+from moderation.publishing import (
+    QUARANTINE_DATE_HEADER,
+    QUARANTINE_ERROR_HEADER,
+    QUARANTINE_SOURCE_HEADER,
+    replay_message,
+)
+from moderation.utils import ack_message
+
+logger = get_logger(__name__)
+
+
+async def declare_quarantine_queue(pool: MQChannelPool) -> None:
+    """Declare the durable quarantine queue
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+    """
+    async with pool.acquire() as channel:
+        await channel.declare_queue(ModerationConfig.QUARANTINE_QUEUE, durable=True)
+
+
+def _quarantined_at(message: AbstractIncomingMessage) -> datetime | None:
+    value = (message.headers or {}).get(QUARANTINE_DATE_HEADER)
+    try:
+        return datetime.fromisoformat(str(value)) if value else None
+    except ValueError:
+        return None
+
+
+def to_quarantined_message(message: AbstractIncomingMessage) -> QuarantinedMessage:
+    """Describe a delivery of the quarantine queue"""
+    headers = message.headers or {}
+    source_queue = headers.get(QUARANTINE_SOURCE_HEADER)
+    error = headers.get(QUARANTINE_ERROR_HEADER)
+    return QuarantinedMessage(
+        id=message.message_id or "",
+        source_queue=str(source_queue) if source_queue else None,
+        error=str(error) if error else None,
+        quarantined_at=_quarantined_at(message),
+        content=message.body.decode(errors="replace"),
+    )
+
+
+async def list_quarantined_messages(limit: int | None = None) -> list[QuarantinedMessage]:
+    """Return the quarantined messages, oldest first, without removing them
+
+    Args:
+        limit (int | None): maximum number of messages returned, every message if not set
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: the quarantine queue does not exist
+    """
+    messages: list[QuarantinedMessage] = []
+    async with get_mq_pool().acquire() as channel, drain_queue(channel, ModerationConfig.QUARANTINE_QUEUE) as drain:
+        while (limit is None or len(messages) < limit) and (message := await drain.next_delivery()) is not None:
+            messages.append(to_quarantined_message(message))
+    return messages
+
+
+async def replay_quarantined_messages(message_ids: set[str] | None = None) -> list[str]:
+    """Send quarantined messages back to the queue they were read from.
+    Messages quarantined again while replaying are left in the quarantine.
+
+    Args:
+        message_ids (set[str] | None): quarantine ids of the messages, every message if not set
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: the quarantine queue does not exist
+
+    Returns:
+        list[str]: the ids of the replayed messages
+    """
+    replayed: list[str] = []
+    started = datetime.now(UTC)
+    async with get_mq_pool().acquire() as channel, drain_queue(channel, ModerationConfig.QUARANTINE_QUEUE) as drain:
+        while (message := await drain.next_delivery()) is not None:
+            quarantined = to_quarantined_message(message)
+            if quarantined.quarantined_at is not None and quarantined.quarantined_at >= started:
+                # Quarantined again by this replay, the rest of the queue is too
+                break
+            if message_ids is not None and quarantined.id not in message_ids:
+                continue
+            if quarantined.source_queue is None:
+                logger.warning("Quarantined message %s has no source queue, not replayed", quarantined.id)
+                continue
+            await replay_message(channel, message, quarantined.source_queue)
+            await ack_message(message)
+            replayed.append(quarantined.id)
+            if message_ids is not None and len(replayed) == len(message_ids):
+                break
+    logger.info("%s quarantined messages replayed", len(replayed))
+    return replayed
+
+
+async def purge_quarantined_messages(message_ids: set[str] | None = None) -> tuple[int, list[str]]:
+    """Drop quarantined messages for good
+
+    Args:
+        message_ids (set[str] | None): quarantine ids of the messages, the whole queue is purged if not set
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: the quarantine queue does not exist
+
+    Returns:
+        tuple[int, list[str]]: the number of messages dropped and their ids, not listed when purging the whole queue
+    """
+    async with get_mq_pool().acquire() as channel:
+        if message_ids is None:
+            queue = await get_mq_queue(channel, ModerationConfig.QUARANTINE_QUEUE)
+            purge_ok = await queue.purge()
+            logger.info("Quarantine purged, %s messages dropped", purge_ok.message_count)
+            return purge_ok.message_count or 0, []
+
+        purged: list[str] = []
+        async with drain_queue(channel, ModerationConfig.QUARANTINE_QUEUE) as drain:
+            while (message := await drain.next_delivery()) is not None:
+                if message.message_id not in message_ids:
+                    continue
+                await ack_message(message)
+                purged.append(message.message_id)
+                if len(purged) == len(message_ids):
+                    break
+        logger.info("%s quarantined messages purged", len(purged))
+        return len(purged), purged
@@ -0,0 +1,129 @@
+"""Statistics of a moderation queue that never read its messages"""
+
+import math
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import UTC, datetime
+
+from aio_pika import exceptions as aio_pika_exceptions
+from msfwk.utils.logging import get_logger
+
+from moderation.decoding import DecodedMessage
+from moderation.models.exceptions import MQQueueNotFoundError
+from moderation.models.interfaces import AgePercentiles, QueueStatsResponse, as_utc
+from moderation.mq_pool import get_mq_pool
+from moderation.pending_index import PendingEventIndex, get_pending_index
+from moderation.seen_ids import get_seen_ids
+
+logger = get_logger(__name__)
+
+
+class PendingEventStats:
+    """Summary of the events held by a pending index, kept up to date on every change of the index:
+    the dates sorted for the age percentiles and the number of events per functional area.
+    """
+
+    def __init__(self) -> None:
+        self._timestamps: list[float] = []
+        self._areas: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def on_added(self, decoded: DecodedMessage) -> None:
+        insort(self._timestamps, as_utc(decoded.summary.date).timestamp())
+        self._areas[decoded.summary.fonctionnal_area.value] += 1
+
+    def on_removed(self, decoded: DecodedMessage) -> None:
+        position = bisect_left(self._timestamps, as_utc(decoded.summary.date).timestamp())
+        if position < len(self._timestamps):
+            del self._timestamps[position]
+        area = decoded.summary.fonctionnal_area.value
+        self._areas[area] -= 1
+        if self._areas[area] <= 0:
+            del self._areas[area]
+
+    def on_cleared(self) -> None:
+        self._timestamps.clear()
+        self._areas.clear()
+
+    @property
+    def fonctionnal_areas(self) -> dict[str, int]:
+        """Number of events per functional area"""
+        return dict(self._areas)
+
+    def age_percentiles(self, now: datetime | None = None) -> AgePercentiles | None:
+        """Nearest-rank percentiles of the age of the events in seconds, None without events"""
+        if not self._timestamps:
+            return None
+        now_timestamp = (now or datetime.now(UTC)).timestamp()
+        return AgePercentiles(
+            p50=now_timestamp - self._timestamp_at(0.50),
+            p90=now_timestamp - self._timestamp_at(0.90),
+            p99=now_timestamp - self._timestamp_at(0.99),
+            max=now_timestamp - self._timestamps[0],
+        )
+
+    def _timestamp_at(self, rank: float) -> float:
+        # The oldest dates are the largest ages
+        count = len(self._timestamps)
+        return self._timestamps[min(count - 1, max(0, count - math.ceil(rank * count)))]
+
+
+_stats: dict[str, PendingEventStats] = {}
+
+
+def track_pending_index(index: PendingEventIndex) -> PendingEventStats:
+    """Maintain the statistics of the queue of a pending index"""
+    stats = PendingEventStats()
+    index.add_listener(stats)
+    _stats[index.queue_name] = stats
+    return stats
+
+
+async def get_queue_stats(queue_name: str) -> QueueStatsResponse:
+    """Depth of the queue from a passive declare, ages and areas from the summary of its pending index.
+    The summary covers the whole queue when no message is left waiting past the prefetch window of the index.
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    async with get_mq_pool().acquire() as channel:
+        try:
+            queue = await channel.declare_queue(queue_name, passive=True)
+        except aio_pika_exceptions.ChannelNotFound as cnf:
+            err_message = f"Queue '{queue_name}' not found: {cnf}"
+            logger.exception(err_message, exc_info=cnf)
+            raise MQQueueNotFoundError(err_message) from cnf
+    ready = queue.declaration_result.message_count or 0
+    consumers = queue.declaration_result.consumer_count or 0
+
+    index = get_pending_index(queue_name)
+    stats = _stats.get(queue_name)
+    held = 0 if index is None else len(index) + len(index.errors)
+    seen_ids = get_seen_ids().stats()
+    if index is None or stats is None:
+        return QueueStatsResponse(
+            queue=queue_name,
+            depth=ready,
+            ready=ready,
+            consumers=consumers,
+            summarized=0,
+            complete=False,
+            seen_ids=seen_ids,
+        )
+    return QueueStatsResponse(
+        queue=queue_name,
+        depth=ready + held,
+        ready=ready,
+        consumers=consumers,
+        summarized=len(stats),
+        complete=ready == 0,
+        age_seconds=stats.age_percentiles(),
+        fonctionnal_areas=stats.fonctionnal_areas,
+        seen_ids=seen_ids,
+    )
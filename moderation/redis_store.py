@@ -0,0 +1,188 @@
+"""Shared Redis connection, used when `redis_url` is set, and its in-process stand-in"""
+
+import asyncio
+from collections import deque
+
+from msfwk.utils.logging import get_logger
+
+from moderation.models.config import ModerationConfig
+
+try:
+    from redis.asyncio import Redis
+    from redis.exceptions import RedisError
+except ImportError:  # pragma: no cover - redis comes with msfwk, the features relying on it are off without it
+    Redis = None
+    RedisError = OSError
+
+logger = get_logger(__name__)
+
+_redis: "Redis | None" = None
+
+
+def get_redis() -> "Redis | None":
+    """Return the Redis client of the service, None when no `redis_url` is configured"""
+    global _redis  # noqa: PLW0603
+    if _redis is None and ModerationConfig.REDIS_URL and Redis is not None:
+        _redis = Redis.from_url(ModerationConfig.REDIS_URL, decode_responses=True)
+        logger.info("Redis client created")
+    return _redis
+
+
+async def close_redis() -> None:
+    """Close the Redis client"""
+    global _redis  # noqa: PLW0603
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+
+class LocalRedis:
+    """In-process stand-in for the few Redis commands used by the service, with the redis-py asyncio signatures
+    and decoded responses. Shared by everything in the process, so several coordinators can run side by side.
+    """
+
+    def __init__(self) -> None:
+        self._values: dict[str, str] = {}
+        self._hashes: dict[str, dict[str, str]] = {}
+        self._lists: dict[str, deque[str]] = {}
+        self._sets: dict[str, set[str]] = {}
+        self._expires: dict[str, float] = {}
+        self._waiters: dict[str, list[asyncio.Future[None]]] = {}
+
+    def _expire_key(self, name: str) -> None:
+        expires_at = self._expires.get(name)
+        if expires_at is not None and expires_at <= asyncio.get_running_loop().time():
+            self._drop(name)
+
+    def _drop(self, name: str) -> bool:
+        self._expires.pop(name, None)
+        dropped = [store.pop(name, None) is not None for store in (self._values, self._hashes, self._lists, self._sets)]
+        return any(dropped)
+
+    async def set(
+        self, name: str, value: str, ex: float | None = None, px: int | None = None, nx: bool = False
+    ) -> bool | None:
+        self._expire_key(name)
+        if nx and name in self._values:
+            return None
+        self._drop(name)
+        self._values[name] = value
+        if ex is not None or px is not None:
+            self._expires[name] = asyncio.get_running_loop().time() + (ex if ex is not None else px / 1000)
+        return True
+
+    async def get(self, name: str) -> str | None:
+        self._expire_key(name)
+        return self._values.get(name)
+
+    async def mget(self, names: list[str]) -> list[str | None]:
+        return [await self.get(name) for name in names]
+
+    async def delete(self, *names: str) -> int:
+        return sum(self._drop(name) for name in names)
+
+    async def expire(self, name: str, time: float) -> bool:
+        self._expire_key(name)
+        if not any(name in store for store in (self._values, self._hashes, self._lists, self._sets)):
+            return False
+        self._expires[name] = asyncio.get_running_loop().time() + time
+        return True
+
+    async def pexpire(self, name: str, time: int) -> bool:
+        return await self.expire(name, time / 1000)
+
+    async def hset(
+        self, name: str, key: str | None = None, value: str | None = None, mapping: dict | None = None
+    ) -> int:
+        self._expire_key(name)
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        values = self._hashes.setdefault(name, {})
+        added = len(fields.keys() - values.keys())
+        values.update(fields)
+        return added
+
+    async def hget(self, name: str, key: str) -> str | None:
+        self._expire_key(name)
+        return self._hashes.get(name, {}).get(key)
+
+    async def hmget(self, name: str, keys: list[str]) -> list[str | None]:
+        self._expire_key(name)
+        values = self._hashes.get(name, {})
+        return [values.get(key) for key in keys]
+
+    async def hgetall(self, name: str) -> dict[str, str]:
+        self._expire_key(name)
+        return dict(self._hashes.get(name, {}))
+
+    async def hdel(self, name: str, *keys: str) -> int:
+        values = self._hashes.get(name, {})
+        removed = sum(values.pop(key, None) is not None for key in keys)
+        if not values:
+            self._hashes.pop(name, None)
+        return removed
+
+    async def sadd(self, name: str, *values: str) -> int:
+        self._expire_key(name)
+        members = self._sets.setdefault(name, set())
+        added = len(set(values) - members)
+        members.update(values)
+        return added
+
+    async def srem(self, name: str, *values: str) -> int:
+        self._expire_key(name)
+        members = self._sets.get(name, set())
+        removed = len(members & set(values))
+        members.difference_update(values)
+        if not members:
+            self._sets.pop(name, None)
+        return removed
+
+    async def smembers(self, name: str) -> "set[str]":
+        self._expire_key(name)
+        return set(self._sets.get(name, ()))
+
+    async def rpush(self, name: str, *values: str) -> int:
+        self._expire_key(name)
+        items = self._lists.setdefault(name, deque())
+        items.extend(values)
+        for waiter in self._waiters.pop(name, []):
+            if not waiter.done():
+                waiter.set_result(None)
+        return len(items)
+
+    async def blpop(self, keys: list[str], timeout: float = 0) -> tuple[str, str] | None:  # noqa: ASYNC109
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        while True:
+            for key in keys:
+                self._expire_key(key)
+                items = self._lists.get(key)
+                if items:
+                    value = items.popleft()
+                    if not items:
+                        self._drop(key)
+                    return key, value
+            waiter = loop.create_future()
+            for key in keys:
+                self._waiters.setdefault(key, []).append(waiter)
+            try:
+                await asyncio.wait_for(waiter, None if deadline is None else max(0.0, deadline - loop.time()))
+            except TimeoutError:
+                return None
+            finally:
+                for key in keys:
+                    if waiter in self._waiters.get(key, ()):
+                        self._waiters[key].remove(waiter)
+
+    async def aclose(self) -> None:
+        """Nothing to release, the state lives as long as the process"""
+
+
+_local_redis = LocalRedis()
+
+
+def get_shared_store() -> "Redis | LocalRedis":
+    """Return the Redis client, or the in-process stand-in when no `redis_url` is configured"""
+    return get_redis() or _local_redis
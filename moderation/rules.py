@@ -0,0 +1,191 @@
+"""Rules of the automatic moderation, evaluated in a single pass over the content of an event"""
+
+import re
+from collections import deque
+from collections.abc import Iterator
+from enum import StrEnum
+
+from msfwk.utils.logging import get_logger
+from pydantic import BaseModel, Field
+
+from moderation.decoding import DecodedMessage, content_text
+
+logger = get_logger(__name__)
+
+
+class RuleVerdict(StrEnum):
+    """What the automatic moderation does with an event"""
+
+    ACCEPT = "accept"
+    REJECT = "reject"
+    MANUAL = "manual"
+
+
+class AreaPolicy(StrEnum):
+    """How the events of a functional area are moderated"""
+
+    ACCEPT = "accept"
+    REJECT = "reject"
+    MANUAL = "manual"
+    RULES = "rules"
+
+
+class AutoModerationRules(BaseModel):
+    """The `auto_moderation_rules` setting.
+    Keywords match whole words whatever their case, patterns are regular expressions searched in the content.
+    """
+
+    deny_keywords: list[str] = Field(default_factory=list)
+    review_keywords: list[str] = Field(default_factory=list)
+    deny_patterns: list[str] = Field(default_factory=list)
+    review_patterns: list[str] = Field(default_factory=list)
+    allowed_users: list[str] = Field(default_factory=list)
+    denied_users: list[str] = Field(default_factory=list)
+    # Policy per functional area, the areas not listed follow the rules
+    areas: dict[str, AreaPolicy] = Field(default_factory=dict)
+    # Verdict of the events no rule decided on
+    default: RuleVerdict = RuleVerdict.MANUAL
+
+
+class RuleMatch:
+    """The verdict on an event and the rule that gave it"""
+
+    __slots__ = ("detail", "rule", "verdict")
+
+    def __init__(self, verdict: RuleVerdict, rule: str, detail: str | None = None) -> None:
+        self.verdict = verdict
+        self.rule = rule
+        self.detail = detail
+
+    def __repr__(self) -> str:
+        return f"RuleMatch({self.verdict}, {self.rule}, {self.detail!r})"
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton finding every keyword of a list in one pass over a text.
+    Matching ignores the case and only reports whole words.
+    """
+
+    def __init__(self, keywords: dict[str, RuleVerdict]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[tuple[int, str, RuleVerdict]]] = [[]]
+        for keyword, verdict in keywords.items():
+            self._add(keyword.casefold(), verdict)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def _add(self, keyword: str, verdict: RuleVerdict) -> None:
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append((len(keyword), keyword, verdict))
+
+    def _link(self) -> None:
+        """Breadth first, the failure link of a state is the longest proper suffix that is also a prefix"""
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def matches(self, text: str) -> Iterator[tuple[str, RuleVerdict]]:
+        """Yield the keywords found in the text, in the order they end"""
+        text = text.casefold()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, keyword, verdict in output[state]:
+                start = end - length + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (
+                    end + 1 == len(text) or not text[end + 1].isalnum()
+                ):
+                    yield keyword, verdict
+
+
+def _combine(patterns: list[str]) -> str:
+    return "|".join(f"(?:{pattern})" for pattern in patterns)
+
+
+class RuleSet:
+    """Compiled rules: the denied and allowed users, the policy of each area,
+    every keyword in one automaton and the deny and review patterns in one regular expression.
+
+    An event is decided by the first rule that applies:
+    denied user, area policy, deny keyword or pattern, review keyword or pattern, allowed user, then the default.
+    """
+
+    def __init__(self, rules: AutoModerationRules) -> None:
+        self.default = rules.default
+        self.areas = rules.areas
+        self.allowed_users = frozenset(rules.allowed_users)
+        self.denied_users = frozenset(rules.denied_users)
+        keywords = dict.fromkeys(rules.review_keywords, RuleVerdict.MANUAL)
+        keywords.update(dict.fromkeys(rules.deny_keywords, RuleVerdict.REJECT))
+        self.automaton = KeywordAutomaton(keywords)
+        alternatives = []
+        if rules.deny_patterns:
+            alternatives.append(f"(?P<deny>{_combine(rules.deny_patterns)})")
+        if rules.review_patterns:
+            alternatives.append(f"(?P<review>{_combine(rules.review_patterns)})")
+        self.patterns = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+
+    @classmethod
+    def from_config(cls, setting: dict | None) -> "RuleSet":
+        """Compile the `auto_moderation_rules` setting
+
+        Raises:
+            pydantic.ValidationError: the setting is malformed
+            re.error: a pattern is not a valid regular expression
+        """
+        return cls(AutoModerationRules.model_validate(setting or {}))
+
+    def evaluate(self, decoded: DecodedMessage) -> RuleMatch:
+        """Decide on an event, the content is only read when the user and the area left it open"""
+        summary = decoded.summary
+        if summary.user_id in self.denied_users:
+            return RuleMatch(RuleVerdict.REJECT, "denied_user", summary.user_id)
+        area = summary.fonctionnal_area.value
+        policy = self.areas.get(area, AreaPolicy.RULES)
+        if policy != AreaPolicy.RULES:
+            return RuleMatch(RuleVerdict(policy.value), "area", area)
+
+        match = self.match_text(content_text(decoded.body))
+        if match is not None:
+            return match
+        if summary.user_id in self.allowed_users:
+            return RuleMatch(RuleVerdict.ACCEPT, "allowed_user", summary.user_id)
+        return RuleMatch(self.default, "default")
+
+    def match_text(self, text: str) -> RuleMatch | None:
+        """The verdict of the keywords and patterns on a text, a deny wins over a review"""
+        review: RuleMatch | None = None
+        for keyword, verdict in self.automaton.matches(text):
+            if verdict == RuleVerdict.REJECT:
+                return RuleMatch(RuleVerdict.REJECT, "deny_keyword", keyword)
+            review = review or RuleMatch(RuleVerdict.MANUAL, "review_keyword", keyword)
+        if self.patterns is not None:
+            for found in self.patterns.finditer(text):
+                if found.lastgroup == "deny":
+                    return RuleMatch(RuleVerdict.REJECT, "deny_pattern", found.group())
+                review = review or RuleMatch(RuleVerdict.MANUAL, "review_pattern", found.group())
+        return review
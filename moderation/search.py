@@ -0,0 +1,151 @@
+"""Full-text search over the pending events.
+
+An inverted index maps every word of the content, the user id and the url of an event to the events holding it,
+with the number of occurrences. A query returns the events holding all of its words, ranked by BM25: the rarer a
+word is among the pending events and the more often it appears in a short event, the higher the event ranks.
+"""
+
+import math
+import re
+from collections import Counter
+
+from msfwk.utils.logging import get_logger
+
+from moderation.coordination import get_coordinator
+from moderation.decoding import DecodedMessage, content_text
+from moderation.fetch_messages import DrainBudget
+from moderation.models.interfaces import SearchHit
+from moderation.pending_index import PendingEventIndex, get_pending_index
+from moderation.sharding import get_sharded_messages
+
+logger = get_logger(__name__)
+
+WORD = re.compile(r"\w+")
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    """The words of a text, case folded"""
+    return WORD.findall(text.casefold())
+
+
+def document_words(decoded: DecodedMessage) -> list[str]:
+    """The searchable words of an event: its content, user id and url"""
+    summary = decoded.summary
+    return tokenize(f"{content_text(decoded.body)}\n{summary.user_id}\n{summary.url or ''}")
+
+
+class SearchIndex:
+    """Inverted index of the pending events, kept up to date as a pending index listener or fed by hand"""
+
+    def __init__(self) -> None:
+        self._postings: dict[str, dict[str, int]] = {}
+        # Event, number of words and distinct words of each indexed event
+        self._documents: dict[str, tuple[DecodedMessage, int, tuple[str, ...]]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._documents
+
+    def get(self, message_id: str) -> DecodedMessage | None:
+        """The indexed event with the given id"""
+        document = self._documents.get(message_id)
+        return document[0] if document is not None else None
+
+    def on_added(self, decoded: DecodedMessage) -> None:
+        if decoded.id in self._documents:
+            self.on_removed(decoded)
+        words = document_words(decoded)
+        counts = Counter(words)
+        for word, count in counts.items():
+            self._postings.setdefault(word, {})[decoded.id] = count
+        self._documents[decoded.id] = decoded, len(words), tuple(counts)
+        self._total_length += len(words)
+
+    def on_removed(self, decoded: DecodedMessage) -> None:
+        document = self._documents.pop(decoded.id, None)
+        if document is None:
+            return
+        _, length, words = document
+        self._total_length -= length
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is not None:
+                postings.pop(decoded.id, None)
+                if not postings:
+                    del self._postings[word]
+
+    def on_cleared(self) -> None:
+        self._postings.clear()
+        self._documents.clear()
+        self._total_length = 0
+
+    def search(self, query: str, limit: int | None = None) -> list[SearchHit]:
+        """The events holding every word of the query, best ranked first"""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words or not self._documents:
+            return []
+        postings = [self._postings.get(word, {}) for word in words]
+        candidates = set(min(postings, key=len))
+        for posting in postings:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+
+        count = len(self._documents)
+        average_length = self._total_length / count or 1.0
+        idfs = [math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5)) for posting in postings]
+        hits = []
+        for message_id in candidates:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._documents[message_id][1] / average_length)
+            score = 0.0
+            for idf, posting in zip(idfs, postings, strict=True):
+                frequency = posting[message_id]
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            hits.append(SearchHit(message_id=message_id, score=round(score, 4)))
+        hits.sort(key=lambda hit: (-hit.score, hit.message_id))
+        return hits[:limit]
+
+
+_search_indexes: dict[str, SearchIndex] = {}
+
+
+def search_pending_index(index: PendingEventIndex) -> SearchIndex:
+    """Index the events of a pending index for search as they arrive"""
+    search_index = SearchIndex()
+    index.add_listener(search_index)
+    _search_indexes[index.queue_name] = search_index
+    return search_index
+
+
+def index_messages(messages: list[DecodedMessage]) -> SearchIndex:
+    """Index a list of events read from a queue"""
+    search_index = SearchIndex()
+    for decoded in messages:
+        search_index.on_added(decoded)
+    return search_index
+
+
+async def get_search_index(queue_name: str, budget: DrainBudget | None = None) -> SearchIndex:
+    """The search index of the pending index of the queue, or of the events read from the queue without one.
+    Built from a listing when the pending index doesn't hold every event, or when other replicas hold some.
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget | None): bounds of the read when the queue has to be read
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    index = get_pending_index(queue_name)
+    search_index = _search_indexes.get(queue_name)
+    if index is not None and not index.saturated and search_index is not None and get_coordinator(queue_name) is None:
+        return search_index
+    messages, _ = await get_sharded_messages(queue_name, budget)
+    return index_messages(messages)
@@ -0,0 +1,169 @@
+"""Bounded index of the ids already decided, shared by every request of the service.
+
+A decision is recorded as `deciding` when it is submitted and as decided once its publish is confirmed, it is
+forgotten when its event goes back to moderation. The decided ids are dropped wherever they are read again,
+the copies already held are dropped by the hooks called on each published decision, and a decision repeated on an
+id already decided the same way succeeds without doing anything.
+Entries leave the index after `seen_ids_ttl_seconds`, or least recently used first past `seen_ids_max_size`.
+With `redis_url`, the decided ids are mirrored in Redis so they are known to every replica.
+"""
+
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+from msfwk.desp.rabbitmq.mq_message import ModerationEventStatus
+from msfwk.utils.logging import get_logger
+
+from moderation.metrics import SEEN_IDS_LOOKUPS, SEEN_IDS_SIZE
+from moderation.models.config import ModerationConfig
+from moderation.models.interfaces import SeenIdStats
+from moderation.redis_store import RedisError, get_redis
+
+logger = get_logger(__name__)
+
+
+class SeenEntry:
+    """The decision taken on an id, `confirmed` once published"""
+
+    __slots__ = ("confirmed", "expires_at", "status")
+
+    def __init__(self, status: ModerationEventStatus, confirmed: bool, expires_at: float) -> None:
+        self.status = status
+        self.confirmed = confirmed
+        self.expires_at = expires_at
+
+
+class SeenIdIndex:
+    """LRU of the decided ids with a time to live, counting its hits and misses"""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, SeenEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record(self, message_id: str, status: ModerationEventStatus, *, confirmed: bool) -> None:
+        """Remember the decision taken on an id"""
+        self._entries[message_id] = SeenEntry(status, confirmed, time.monotonic() + self.ttl)
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, message_id: str) -> None:
+        """Drop an id, its event is pending again"""
+        self._entries.pop(message_id, None)
+
+    def get(self, message_id: str) -> SeenEntry | None:
+        """The decision on an id, None if unknown or expired"""
+        entry = self._entries.get(message_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[message_id]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            SEEN_IDS_LOOKUPS.labels("miss").inc()
+            return None
+        self.hits += 1
+        SEEN_IDS_LOOKUPS.labels("hit").inc()
+        self._entries.move_to_end(message_id)
+        return entry
+
+    def stats(self) -> SeenIdStats:
+        """Size and lookups of the index"""
+        return SeenIdStats(size=len(self._entries), hits=self.hits, misses=self.misses)
+
+
+_seen_ids = SeenIdIndex(ModerationConfig.SEEN_IDS_MAX_SIZE, ModerationConfig.SEEN_IDS_TTL_SECONDS)
+SEEN_IDS_SIZE.set_function(_seen_ids.__len__)
+
+
+def get_seen_ids() -> SeenIdIndex:
+    """Return the seen-id index of this replica"""
+    return _seen_ids
+
+
+def configure_seen_ids() -> None:
+    """Apply the configured bounds, once the config is loaded"""
+    _seen_ids.max_size = ModerationConfig.SEEN_IDS_MAX_SIZE
+    _seen_ids.ttl = ModerationConfig.SEEN_IDS_TTL_SECONDS
+
+
+# Called with the id of each published decision, of this replica or learnt from another one through Redis
+_decided_hooks: list[Callable[[str], Awaitable[None]]] = []
+
+
+def add_decided_hook(hook: Callable[[str], Awaitable[None]]) -> None:
+    """Get called with the id of each published decision, to drop the copies of its event held elsewhere"""
+    _decided_hooks.append(hook)
+
+
+async def _run_decided_hooks(message_id: str) -> None:
+    for hook in _decided_hooks:
+        try:
+            await hook(message_id)
+        except Exception as error:  # noqa: BLE001
+            logger.exception("Decided hook %r failed on %s", hook, message_id, exc_info=error)
+
+
+def _redis_key(message_id: str) -> str:
+    return f"{ModerationConfig.SEEN_IDS_REDIS_PREFIX}{message_id}"
+
+
+def mark_deciding(message_id: str, status: ModerationEventStatus) -> None:
+    """A decision on the id has been submitted"""
+    _seen_ids.record(message_id, status, confirmed=False)
+
+
+async def mark_decided(message_id: str, status: ModerationEventStatus) -> None:
+    """The decision on the id is published, its other copies can be dropped"""
+    _seen_ids.record(message_id, status, confirmed=True)
+    await _run_decided_hooks(message_id)
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        await redis.set(_redis_key(message_id), status.name, ex=int(ModerationConfig.SEEN_IDS_TTL_SECONDS))
+    except RedisError as error:
+        logger.warning("Failed to mirror the decision on %s in Redis: %s", message_id, error)
+
+
+def forget_decision(message_id: str) -> None:
+    """The decision on the id was not published, its event is back in moderation"""
+    _seen_ids.forget(message_id)
+
+
+def published_decision(message_id: str) -> ModerationEventStatus | None:
+    """The published decision on an id known to this replica, without a round trip to Redis"""
+    entry = _seen_ids.get(message_id)
+    return entry.status if entry is not None and entry.confirmed else None
+
+
+async def decision_of(message_id: str, *, confirmed: bool = False) -> ModerationEventStatus | None:
+    """The decision taken on an id by this replica, or by another one through Redis
+
+    Args:
+        message_id (str): id of the event
+        confirmed (bool): only the decisions already published
+    """
+    entry = _seen_ids.get(message_id)
+    if entry is not None:
+        return entry.status if entry.confirmed or not confirmed else None
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        value = await redis.get(_redis_key(message_id))
+    except RedisError as error:
+        logger.warning("Failed to read the decision on %s from Redis: %s", message_id, error)
+        return None
+    if value is None:
+        return None
+    status = ModerationEventStatus[value]
+    _seen_ids.record(message_id, status, confirmed=True)
+    await _run_decided_hooks(message_id)
+    return status
@@ -0,0 +1,315 @@
+"""Optional sharding of the manual moderation queue by functional area.
+
+With `sharding_enabled`, a router consumes the manual moderation queue and moves every event to the queue of its
+functional area, `<manual moderation queue>.<area>`. A request about one area only reads the shard of that area,
+the other listings read every shard concurrently and merge their events by date. Each shard keeps its own pending
+index, and the bounds of a read budget apply to each shard.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator
+from itertools import chain
+
+from aio_pika import IncomingMessage, RobustChannel, RobustQueue
+from aio_pika import exceptions as aio_pika_exceptions
+from aio_pika.abc import AbstractIncomingMessage
+from msfwk.desp.rabbitmq.mq_message import DespFonctionnalArea
+from msfwk.mqclient import RabbitMQConfig
+from msfwk.utils.logging import get_logger
+
+from moderation.decoding import DecodedMessage, decode_message
+from moderation.fetch_messages import (
+    DrainBudget,
+    get_messages_by_id,
+    get_messages_from_queue,
+    iter_messages_from_queue,
+    requeue_messages,
+    retrieve_message,
+)
+from moderation.models.config import ModerationConfig
+from moderation.models.interfaces import MQLoadErrorMessage
+from moderation.mq_pool import MQChannelPool, get_mq_pool
+from moderation.pagination import event_position
+from moderation.publishing import forward_message, quarantine_message
+from moderation.seen_ids import decision_of
+from moderation.utils import ack_message
+
+logger = get_logger(__name__)
+
+
+def shard_queue(queue_name: str, area: DespFonctionnalArea) -> str:
+    """Name of the shard of a queue holding the events of one area"""
+    return f"{queue_name}.{area.value}"
+
+
+def shard_queues(queue_name: str, area: DespFonctionnalArea | None = None) -> list[str]:
+    """The queues holding the events of a queue, the shard of the area or every shard when the queue is sharded
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        area (DespFonctionnalArea | None): only the shard of this area
+    """
+    if not ModerationConfig.SHARDING_ENABLED or queue_name != RabbitMQConfig.MANUAL_MODERATION_QUEUE:
+        return [queue_name]
+    areas = list(DespFonctionnalArea) if area is None else [area]
+    return [shard_queue(queue_name, shard_area) for shard_area in areas]
+
+
+def area_queue(queue_name: str, area: DespFonctionnalArea | None) -> str:
+    """The queue holding the events of an area, its shard when the queue is sharded, the queue itself otherwise"""
+    return shard_queues(queue_name, area)[0] if area is not None else queue_name
+
+
+def event_queue(queue_name: str, decoded: DecodedMessage) -> str:
+    """The queue an event sent to the given queue belongs to"""
+    return shard_queues(queue_name, decoded.summary.fonctionnal_area)[0]
+
+
+def _shard_budgets(budget: DrainBudget, count: int) -> list[DrainBudget]:
+    return [DrainBudget(*budget.bounds) for _ in range(count)]
+
+
+def _merge_budgets(budget: DrainBudget, shard_budgets: list[DrainBudget]) -> None:
+    budget.scanned = sum(shard_budget.scanned for shard_budget in shard_budgets)
+    budget.truncated = any(shard_budget.truncated for shard_budget in shard_budgets)
+
+
+async def get_sharded_messages(
+    queue_name: str, budget: DrainBudget | None = None, area: DespFonctionnalArea | None = None
+) -> tuple[list[DecodedMessage], list[MQLoadErrorMessage]]:
+    """Retrieves the messages of a queue without acknowledging them, from its shards when it is sharded.
+    The shards are read concurrently and their events merged by date.
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget | None): bounds of the read of each shard, tells if the list is truncated
+        area (DespFonctionnalArea | None): only read the shard of this area
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    budget = budget or DrainBudget()
+    queue_names = shard_queues(queue_name, area)
+    if len(queue_names) == 1:
+        return await get_messages_from_queue(queue_names[0], budget)
+    shard_budgets = _shard_budgets(budget, len(queue_names))
+    results = await asyncio.gather(
+        *(
+            get_messages_from_queue(shard_name, shard_budget)
+            for shard_name, shard_budget in zip(queue_names, shard_budgets, strict=True)
+        )
+    )
+    _merge_budgets(budget, shard_budgets)
+    messages = sorted(chain.from_iterable(messages for messages, _ in results), key=event_position)
+    return messages, list(chain.from_iterable(errors for _, errors in results))
+
+
+async def iter_sharded_messages(
+    queue_name: str,
+    errors: list[MQLoadErrorMessage],
+    budget: DrainBudget | None = None,
+    area: DespFonctionnalArea | None = None,
+) -> AsyncIterator[DecodedMessage]:
+    """Yield the messages of a queue as soon as they are decoded, from its shards when it is sharded.
+    The shards are read concurrently, their events are yielded in the order they arrive.
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        errors (list[MQLoadErrorMessage]): filled with the load errors while iterating
+        budget (DrainBudget | None): bounds of the read of each shard, tells if the iteration is truncated
+        area (DespFonctionnalArea | None): only read the shard of this area
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    budget = budget or DrainBudget()
+    queue_names = shard_queues(queue_name, area)
+    if len(queue_names) == 1:
+        async for decoded in iter_messages_from_queue(queue_names[0], errors, budget):
+            yield decoded
+        return
+
+    shard_budgets = _shard_budgets(budget, len(queue_names))
+    # None once a shard is done
+    merged: asyncio.Queue[DecodedMessage | None] = asyncio.Queue()
+
+    async def read_shard(shard_name: str, shard_budget: DrainBudget) -> None:
+        try:
+            async for decoded in iter_messages_from_queue(shard_name, errors, shard_budget):
+                merged.put_nowait(decoded)
+        finally:
+            merged.put_nowait(None)
+
+    tasks = [
+        asyncio.create_task(read_shard(shard_name, shard_budget))
+        for shard_name, shard_budget in zip(queue_names, shard_budgets, strict=True)
+    ]
+    try:
+        running = len(tasks)
+        while running:
+            decoded = await merged.get()
+            if decoded is None:
+                running -= 1
+                continue
+            yield decoded
+        # Raise the failure of a shard
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _merge_budgets(budget, shard_budgets)
+
+
+async def retrieve_sharded_message(
+    message_id: str, queue_name: str, budget: DrainBudget | None = None
+) -> tuple[DecodedMessage, IncomingMessage | None] | None:
+    """Retrieve the message with ID without consuming it, looking into every shard concurrently when sharded
+
+    Args:
+        message_id (str): id of the message
+        queue_name (str): RabbitMQ queue name
+        budget (DrainBudget | None): bounds of the read of each shard, tells if a message not found may still be there
+
+    Raises:
+        MQServerConnectionError: Error appended during connection with server
+        MQQueueNotFoundError: queue_name not found in MQ server
+    """
+    budget = budget or DrainBudget()
+    queue_names = shard_queues(queue_name)
+    if len(queue_names) == 1:
+        return await retrieve_message(message_id, queue_names[0], budget)
+    shard_budgets = _shard_budgets(budget, len(queue_names))
+    found = await asyncio.gather(
+        *(
+            retrieve_message(message_id, shard_name, shard_budget)
+            for shard_name, shard_budget in zip(queue_names, shard_budgets, strict=True)
+        )
+    )
+    _merge_budgets(budget, shard_budgets)
+    return next((mq_message_tuple for mq_message_tuple in found if mq_message_tuple is not None), None)
+
+
+async def take_messages(
+    message_ids: set[str], queue_names: list[str], budget: DrainBudget
+) -> dict[str, tuple[DecodedMessage, IncomingMessage]]:
+    """Retrieve the messages with the given IDs from several queues read concurrently, each on a pooled channel.
+    The returned deliveries are left to the caller to ack or requeue, the other copies of an id are requeued.
+
+    Args:
+        message_ids (set[str]): ids of the wanted messages
+        queue_names (list[str]): the queues to read
+        budget (DrainBudget): bounds of the read of each queue, tells if a queue was not read to its end
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+        MQQueueNotFoundError: a queue not found in MQ server
+    """
+    shard_budgets = _shard_budgets(budget, len(queue_names))
+
+    async def take_from_queue(shard_name: str, shard_budget: DrainBudget) -> dict:
+        async with get_mq_pool().acquire() as channel:
+            return await get_messages_by_id(message_ids, shard_name, channel, shard_budget)
+
+    results = await asyncio.gather(
+        *(
+            take_from_queue(shard_name, shard_budget)
+            for shard_name, shard_budget in zip(queue_names, shard_budgets, strict=True)
+        ),
+        return_exceptions=True,
+    )
+    _merge_budgets(budget, shard_budgets)
+    found: dict[str, tuple[DecodedMessage, IncomingMessage]] = {}
+    copies: list[IncomingMessage] = []
+    for result in results:
+        for message_id, mq_message_tuple in {} if isinstance(result, BaseException) else result.items():
+            if message_id in found:
+                copies.append(mq_message_tuple[1])
+            else:
+                found[message_id] = mq_message_tuple
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        await requeue_messages([*copies, *(incoming_message for _, incoming_message in found.values())])
+        raise failures[0]
+    await requeue_messages(copies)
+    return found
+
+
+class ShardRouter:
+    """Consumer of a queue moving each event to the shard of its area.
+    A delivery is acked once forwarded, it is requeued when the forward failed.
+    """
+
+    def __init__(self, queue_name: str, prefetch_count: int) -> None:
+        self.queue_name = queue_name
+        self.prefetch_count = prefetch_count
+        self._channel: RobustChannel | None = None
+        self._queue: RobustQueue | None = None
+        self._consumer_tag: str | None = None
+
+    async def start(self, pool: MQChannelPool) -> None:
+        """Declare the shards and start consuming the queue on a dedicated channel
+
+        Raises:
+            MQServerConnectionError: Failed to connect to server
+        """
+        self._channel = await pool.open_channel(prefetch_count=self.prefetch_count)
+        for shard_name in shard_queues(self.queue_name):
+            await self._channel.declare_queue(shard_name, durable=True)
+        self._queue = await self._channel.get_queue(self.queue_name, ensure=False)
+        self._consumer_tag = await self._queue.consume(self._on_message, no_ack=False)
+        logger.info("Queue %s sharded by functional area", self.queue_name)
+
+    async def stop(self) -> None:
+        """Stop consuming, the deliveries not forwarded yet go back to the queue with the channel"""
+        if self._queue is not None and self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+        if self._channel is not None and not self._channel.is_closed:
+            await self._channel.close()
+        self._channel = self._queue = self._consumer_tag = None
+
+    async def _on_message(self, message: AbstractIncomingMessage) -> None:
+        if self._channel is None:
+            return
+        errors: list[MQLoadErrorMessage] = []
+        decoded = decode_message(message, errors)
+        if decoded is None:
+            # Held until the channel closes when it can't be quarantined, so it isn't routed over and over
+            await quarantine_message(self._channel, message, self.queue_name, errors[0])
+            return
+        if await decision_of(decoded.id, confirmed=True) is not None:
+            logger.debug("Message %s already decided, dropping its copy", decoded.id)
+            await ack_message(message)
+            return
+        try:
+            await forward_message(self._channel, message, event_queue(self.queue_name, decoded))
+        except (aio_pika_exceptions.AMQPError, ConnectionError) as error:
+            logger.exception("Failed to route message %s to its shard", decoded.id, exc_info=error)
+            await message.nack(requeue=True)
+            return
+        await ack_message(message)
+
+
+_router: ShardRouter | None = None
+
+
+async def start_shard_router(pool: MQChannelPool) -> ShardRouter:
+    """Declare the shards of the manual moderation queue and start routing its events to them
+
+    Raises:
+        MQServerConnectionError: Failed to connect to server
+    """
+    global _router  # noqa: PLW0603
+    _router = ShardRouter(RabbitMQConfig.MANUAL_MODERATION_QUEUE, ModerationConfig.SHARD_ROUTER_PREFETCH)
+    await _router.start(pool)
+    return _router
+
+
+async def stop_shard_router() -> None:
+    """Stop routing the events to the shards"""
+    global _router  # noqa: PLW0603
+    if _router is not None:
+        await _router.stop()
+        _router = None
@@ -0,0 +1,60 @@
+"""NDJSON streaming of the moderation listing"""
+
+from collections.abc import AsyncIterator
+
+from msfwk.utils.logging import get_logger
+
+from moderation.fetch_messages import DrainBudget
+from moderation.models.exceptions import MQQueueNotFoundError, MQServerConnectionError
+from moderation.models.interfaces import (
+    EventFilter,
+    EventStreamLine,
+    EventView,
+    MQLoadErrorMessage,
+)
+from moderation.sharding import iter_sharded_messages
+
+logger = get_logger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def accepts_ndjson(accept_header: str | None) -> bool:
+    """Check if the client asked for the streamed listing"""
+    return accept_header is not None and NDJSON_MEDIA_TYPE in accept_header
+
+
+async def stream_events(
+    queue_name: str,
+    event_filter: EventFilter,
+    event_view: EventView = EventView.FULL,
+    budget: DrainBudget | None = None,
+) -> AsyncIterator[bytes]:
+    """Yield one NDJSON line per event as soon as it is decoded, then one line per load error,
+    then a `truncated` line when the read of the queue stopped on its budget.
+    Headers are already sent when the queue is read, so a failure is reported as a last error line.
+
+    Args:
+        queue_name (str): RabbitMQ queue name
+        event_filter (EventFilter): filters to apply
+        event_view (EventView): full events or only their header
+        budget (DrainBudget | None): bounds of the read of the queue
+    """
+    budget = budget or DrainBudget()
+    errors: list[MQLoadErrorMessage] = []
+    try:
+        async for decoded in iter_sharded_messages(queue_name, errors, budget, event_filter.fonctionnal_area):
+            if event_filter.matches(decoded.summary):
+                yield _line(EventStreamLine(event=decoded.view(event_view)))
+    except (MQServerConnectionError, MQQueueNotFoundError) as error:
+        message = f"Streaming of the moderation events interrupted: {error}"
+        logger.exception(message, exc_info=error)
+        errors.append(MQLoadErrorMessage(content=None, error=message))
+    for error in errors:
+        yield _line(EventStreamLine(error=error))
+    if budget.truncated:
+        yield _line(EventStreamLine(truncated=True, scanned=budget.scanned))
+
+
+def _line(line: EventStreamLine) -> bytes:
+    return line.model_dump_json().encode() + b"\n"
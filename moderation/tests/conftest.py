@@ -0,0 +1,12 @@
+"""Fixtures shared by the unit tests"""
+
+import pytest
+
+from benchmarks.payloads import make_payloads
+from moderation.decoding import DecodedMessage
+
+
+@pytest.fixture
+def events() -> list[DecodedMessage]:
+    """Ten distinct pending events, one second apart, the oldest first"""
+    return [DecodedMessage.from_body(body) for body in make_payloads(10)]
@@ -0,0 +1,104 @@
+"""Near-duplicate clustering on the SimHash fingerprints of the contents"""
+
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from moderation.clustering import (
+    FINGERPRINT_BITS,
+    ContentClusterIndex,
+    _bands,
+    fingerprint,
+)
+
+TEXT = (
+    "Our new satellite imagery of the northern glaciers shows the retreat of the ice front over the last decade, "
+    "with the melt season starting two weeks earlier than in the reference period"
+)
+
+
+def event(message_id: str, text: str) -> SimpleNamespace:
+    """The part of a decoded message read by the cluster index"""
+    return SimpleNamespace(
+        id=message_id, body=json.dumps({"id": message_id, "content": {"description": text}}).encode()
+    )
+
+
+def flip(value: int, count: int, rng: random.Random) -> int:
+    """The value with `count` distinct random bits flipped"""
+    for bit in rng.sample(range(FINGERPRINT_BITS), count):
+        value ^= 1 << bit
+    return value
+
+
+@pytest.mark.unit
+def test_fingerprint_ignores_the_case_and_punctuation() -> None:
+    assert fingerprint(TEXT, 3) == fingerprint(TEXT.upper().replace(",", " ;"), 3)
+    assert fingerprint(" .,; ", 3) is None
+    assert fingerprint("one", 3) is not None
+
+
+@pytest.mark.unit
+def test_near_identical_texts_have_close_fingerprints() -> None:
+    edited = TEXT.replace("two weeks", "three weeks")
+    assert (fingerprint(TEXT, 3) ^ fingerprint(edited, 3)).bit_count() < (
+        fingerprint(TEXT, 3) ^ fingerprint("A completely unrelated post about a football match", 3)
+    ).bit_count()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("max_distance", [0, 1, 3, 6, 10, 63, 80])
+def test_bands_cover_the_fingerprint(max_distance: int) -> None:
+    bands = _bands(max_distance)
+    assert len(bands) == min(max_distance + 1, FINGERPRINT_BITS)
+    covered = sum(mask << shift for shift, mask in bands)
+    assert covered == (1 << FINGERPRINT_BITS) - 1
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("max_distance", [0, 1, 3, 6, 10])
+def test_fingerprints_within_max_distance_share_a_band(max_distance: int) -> None:
+    rng = random.Random(max_distance)
+    bands = _bands(max_distance)
+    for _ in range(200):
+        value = rng.getrandbits(FINGERPRINT_BITS)
+        other = flip(value, rng.randint(0, max_distance), rng)
+        assert any(value >> shift & mask == other >> shift & mask for shift, mask in bands)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("max_distance", [1, 3, 6])
+def test_every_fingerprint_within_max_distance_finds_the_cluster(max_distance: int) -> None:
+    clusters = ContentClusterIndex(max_distance, shingle_size=3)
+    clusters.on_added(event("first", TEXT))
+    cluster = clusters.get("first")
+    rng = random.Random(max_distance)
+    for distance in range(max_distance + 1):
+        for _ in range(50):
+            assert clusters._nearest(flip(cluster.fingerprint, distance, rng)) is cluster
+    assert clusters._nearest(~cluster.fingerprint & (1 << FINGERPRINT_BITS) - 1) is None
+
+
+@pytest.mark.unit
+def test_near_duplicates_are_clustered_with_the_event_that_started_the_cluster() -> None:
+    clusters = ContentClusterIndex(max_distance=12, shingle_size=1)
+    clusters.on_added(event("first", TEXT))
+    clusters.on_added(event("copy", TEXT.replace("decade", "decade!")))
+    clusters.on_added(event("edited", TEXT.replace("two weeks", "three weeks")))
+    clusters.on_added(event("other", "A completely unrelated post about a football match on sunday afternoon"))
+    clusters.on_added(event("empty", "..."))
+
+    assert [(cluster.id, list(cluster.members)) for cluster in clusters.clusters()] == [
+        ("first", ["first", "copy", "edited"])
+    ]
+    assert clusters.cluster_of("other").id == "other"
+    assert clusters.cluster_of("empty") is None
+
+    clusters.on_removed(event("first", TEXT))
+    assert clusters.get("first").fingerprint == fingerprint(TEXT, 1)
+    clusters.on_removed(event("copy", TEXT))
+    clusters.on_removed(event("edited", TEXT))
+    assert len(clusters) == 1
+    assert clusters._buckets.keys() == set(clusters._keys(clusters.get("other").fingerprint))
@@ -0,0 +1,135 @@
+"""Two coordinated replicas sharing the in-process stand-in of Redis"""
+
+import asyncio
+from collections.abc import AsyncIterator
+
+import pytest
+
+from moderation.coordination import ReplicaCoordinator
+from moderation.decoding import DecodedMessage
+from moderation.models.exceptions import MQMessageNotFoundError
+from moderation.redis_store import LocalRedis
+
+QUEUE = "manual_moderation"
+HEARTBEAT = 0.02
+
+
+def make_coordinator(store: LocalRedis, replica_id: str) -> ReplicaCoordinator:
+    return ReplicaCoordinator(store, replica_id, QUEUE, "test:", HEARTBEAT, request_timeout=1.0)
+
+
+async def flush(*coordinators: ReplicaCoordinator) -> None:
+    """Wait until the coordinators wrote the changes of their pending index to the store"""
+    while any(not coordinator._changes.empty() for coordinator in coordinators):  # noqa: ASYNC110, SLF001
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def replicas() -> AsyncIterator[tuple[ReplicaCoordinator, ReplicaCoordinator]]:
+    store = LocalRedis()
+    first, second = make_coordinator(store, "replica-a"), make_coordinator(store, "replica-b")
+    await first.start()
+    await second.start()
+    yield first, second
+    await first.stop()
+    await second.stop()
+
+
+@pytest.mark.unit
+async def test_each_replica_lists_the_events_of_the_other(
+    replicas: tuple[ReplicaCoordinator, ReplicaCoordinator], events: list[DecodedMessage]
+) -> None:
+    first, second = replicas
+    first.on_added(events[0])
+    second.on_added(events[1])
+    second.on_added(events[2])
+    await flush(first, second)
+
+    assert [decoded.id for decoded in await first.remote_messages()] == [events[1].id, events[2].id]
+    assert [decoded.id for decoded in await second.remote_messages()] == [events[0].id]
+    assert await first.remote_owners([events[0].id, events[1].id]) == {"replica-b": [events[1].id]}
+    assert (await first.remote_message(events[2].id)).body == events[2].body
+
+    second.on_removed(events[1])
+    await flush(second)
+    assert [decoded.id for decoded in await first.remote_messages()] == [events[2].id]
+
+
+@pytest.mark.unit
+async def test_decisions_and_deletions_are_routed_to_the_holder(
+    replicas: tuple[ReplicaCoordinator, ReplicaCoordinator], events: list[DecodedMessage]
+) -> None:
+    first, second = replicas
+    served: list[tuple[str, dict]] = []
+
+    async def decide(payload: dict) -> None:
+        served.append(("decide", payload))
+
+    async def delete(payload: dict) -> dict:
+        served.append(("delete", payload))
+        if payload["message_id"] != events[0].id:
+            message = f"Failed to found message at id: {payload['message_id']}"
+            raise MQMessageNotFoundError(message)
+        return {"deleted": 1}
+
+    second.add_handler("decide", decide)
+    second.add_handler("delete", delete)
+    second.on_added(events[0])
+    await flush(second)
+
+    for replica_id, message_ids in (await first.remote_owners([events[0].id])).items():
+        assert await first.call(replica_id, "decide", {"message_id": message_ids[0], "status": "Accepted"}) is None
+        assert await first.call(replica_id, "delete", {"message_id": message_ids[0]}) == {"deleted": 1}
+    with pytest.raises(MQMessageNotFoundError):
+        await first.call("replica-b", "delete", {"message_id": events[1].id})
+    assert served == [
+        ("decide", {"message_id": events[0].id, "status": "Accepted"}),
+        ("delete", {"message_id": events[0].id}),
+        ("delete", {"message_id": events[1].id}),
+    ]
+
+
+@pytest.mark.unit
+async def test_events_of_a_replica_are_ignored_once_its_heartbeat_expired(events: list[DecodedMessage]) -> None:
+    store = LocalRedis()
+    first, second = make_coordinator(store, "replica-a"), make_coordinator(store, "replica-b")
+    await first.start()
+    await second.start()
+    second.on_added(events[0])
+    await flush(second)
+    assert await first.remote_owners([events[0].id]) == {"replica-b": [events[0].id]}
+
+    # The replica dies without withdrawing its events
+    for task in second._tasks:  # noqa: SLF001
+        task.cancel()
+    await asyncio.sleep(HEARTBEAT * 4)
+
+    assert await first.remote_owners([events[0].id]) == {}
+    assert await first.remote_messages() == []
+    assert await store.smembers("test:replicas:" + QUEUE) == {"replica-a"}
+    await first.stop()
+
+
+@pytest.mark.unit
+async def test_withdrawing_an_event_keeps_the_copy_held_by_another_replica(
+    replicas: tuple[ReplicaCoordinator, ReplicaCoordinator], events: list[DecodedMessage]
+) -> None:
+    first, second = replicas
+    third = make_coordinator(first.store, "replica-c")
+    await third.start()
+    first.on_added(events[0])
+    second.on_added(events[0])
+    await flush(first, second)
+
+    first.on_removed(events[0])
+    first.on_cleared()
+    await flush(first)
+
+    assert await third.remote_owners([events[0].id]) == {"replica-b": [events[0].id]}
+    assert (await third.remote_message(events[0].id)).body == events[0].body
+    await first.stop()
+    assert [decoded.id for decoded in await third.remote_messages()] == [events[0].id]
+    await second.stop()
+    assert await third.remote_messages() == []
+    await third.stop()
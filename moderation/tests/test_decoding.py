@@ -0,0 +1,37 @@
+"""Payloads accepted and rejected when a delivery is decoded"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.payloads import make_payloads
+from moderation.decoding import decode_message
+from moderation.models.interfaces import MQLoadErrorMessage
+
+
+def delivery(body: bytes) -> SimpleNamespace:
+    """The attributes of an incoming message read by decode_message"""
+    return SimpleNamespace(body=body, message_id=None)
+
+
+@pytest.mark.unit
+def test_a_message_published_by_msfwk_is_decoded() -> None:
+    errors: list[MQLoadErrorMessage] = []
+    decoded = decode_message(delivery(make_payloads(1)[0]), errors)
+
+    assert decoded is not None
+    assert decoded.id == "bench-00000000"
+    assert decoded.mq_message.id == decoded.id
+    assert errors == []
+
+
+@pytest.mark.unit
+def test_an_event_msfwk_cannot_load_again_is_reported() -> None:
+    payload = json.loads(make_payloads(1)[0])
+    del payload["accept_callbacks"]
+    errors: list[MQLoadErrorMessage] = []
+
+    assert decode_message(delivery(json.dumps(payload).encode()), errors) is None
+    assert len(errors) == 1
+    assert "accept_callbacks" in errors[0].error
@@ -0,0 +1,101 @@
+"""Claim leases kept in the in-process stand-in of Redis"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from msfwk.desp.rabbitmq.mq_message import ModerationEventStatus
+
+from moderation import leases
+from moderation.fetch_messages import DrainBudget
+from moderation.leases import LeaseRegistry
+from moderation.models.exceptions import LeaseNotFoundError
+from moderation.redis_store import LocalRedis
+
+MESSAGE_IDS = [f"event-{i}" for i in range(10)]
+
+
+@pytest.fixture
+def registry() -> LeaseRegistry:
+    return LeaseRegistry(LocalRedis(), "test:lease:")
+
+
+@pytest.mark.unit
+async def test_claims_get_disjoint_events_in_order(registry: LeaseRegistry) -> None:
+    first = await registry.grant(MESSAGE_IDS, 3, 60)
+    second = await registry.grant(MESSAGE_IDS, 3, 60)
+    # Another replica sharing the store
+    third = await LeaseRegistry(registry.store, "test:lease:").grant(MESSAGE_IDS, 10, 60)
+
+    assert first.message_ids == MESSAGE_IDS[:3]
+    assert second.message_ids == MESSAGE_IDS[3:6]
+    assert third.message_ids == MESSAGE_IDS[6:]
+    assert await registry.leased(MESSAGE_IDS) == set(MESSAGE_IDS)
+    assert (await registry.get(first.id)).message_ids == first.message_ids
+
+
+@pytest.mark.unit
+async def test_concurrent_claims_never_share_an_event(registry: LeaseRegistry) -> None:
+    granted = await asyncio.gather(*(registry.grant(MESSAGE_IDS, 4, 60) for _ in range(5)))
+
+    claimed = [message_id for lease in granted for message_id in lease.message_ids]
+    assert sorted(claimed) == sorted(MESSAGE_IDS)
+    assert len(claimed) == len(set(claimed))
+
+
+@pytest.mark.unit
+async def test_expired_leases_free_their_events(registry: LeaseRegistry) -> None:
+    lease = await registry.grant(MESSAGE_IDS, 2, 0.05)
+    await asyncio.sleep(0.1)
+
+    with pytest.raises(LeaseNotFoundError):
+        await registry.get(lease.id)
+    assert await registry.leased(MESSAGE_IDS) == set()
+    assert (await registry.grant(MESSAGE_IDS, 2, 60)).message_ids == MESSAGE_IDS[:2]
+
+
+@pytest.mark.unit
+async def test_renewing_extends_the_lease_without_its_gone_events(registry: LeaseRegistry) -> None:
+    lease = await registry.grant(MESSAGE_IDS, 3, 0.05)
+    renewed = await registry.renew(lease.id, 60, gone={MESSAGE_IDS[1]})
+    await asyncio.sleep(0.1)
+
+    assert renewed.expires_at > lease.expires_at
+    assert (await registry.get(lease.id)).message_ids == [MESSAGE_IDS[0], MESSAGE_IDS[2]]
+    assert await registry.leased(MESSAGE_IDS[:3]) == {MESSAGE_IDS[0], MESSAGE_IDS[2]}
+
+
+@pytest.mark.unit
+async def test_released_events_can_be_claimed_again(registry: LeaseRegistry) -> None:
+    lease = await registry.grant(MESSAGE_IDS, 2, 60)
+    await registry.release(lease.id)
+
+    with pytest.raises(LeaseNotFoundError):
+        await registry.release(lease.id)
+    assert (await registry.grant(MESSAGE_IDS, 2, 60)).message_ids == MESSAGE_IDS[:2]
+
+
+@pytest.mark.unit
+async def test_a_truncated_read_only_drops_the_decided_events(
+    registry: LeaseRegistry, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    listed = {"truncated": False, "message_ids": MESSAGE_IDS}
+
+    async def get_sharded_messages(queue_name: str, budget: DrainBudget) -> tuple[list, list]:  # noqa: ARG001
+        budget.truncated = listed["truncated"]
+        return [SimpleNamespace(id=message_id) for message_id in listed["message_ids"]], []
+
+    async def decision_of(message_id: str) -> ModerationEventStatus | None:
+        return ModerationEventStatus.Accepted if message_id == MESSAGE_IDS[0] else None
+
+    monkeypatch.setattr(leases, "_registry", registry)
+    monkeypatch.setattr(leases, "get_sharded_messages", get_sharded_messages)
+    monkeypatch.setattr(leases, "decision_of", decision_of)
+    lease = await registry.grant(MESSAGE_IDS, 4, 60)
+
+    # Past the budget: the decided event leaves the lease, the others may still be pending
+    listed.update(truncated=True, message_ids=[])
+    assert (await leases.renew_lease("queue", lease.id)).message_ids == MESSAGE_IDS[1:4]
+    # Read to its end: an event missing from the queue was decided or deleted
+    listed.update(truncated=False, message_ids=MESSAGE_IDS[2:])
+    assert (await leases.renew_lease("queue", lease.id)).message_ids == MESSAGE_IDS[2:4]
@@ -0,0 +1,48 @@
+"""Keyword matching of the automatic moderation rules"""
+
+import pytest
+
+from moderation.rules import KeywordAutomaton, RuleVerdict
+
+KEYWORDS = {
+    "he": RuleVerdict.MANUAL,
+    "she": RuleVerdict.MANUAL,
+    "his": RuleVerdict.MANUAL,
+    "hers": RuleVerdict.REJECT,
+    "spam": RuleVerdict.REJECT,
+    "spam offer": RuleVerdict.REJECT,
+}
+
+
+def found(text: str) -> list[str]:
+    return [keyword for keyword, _ in KeywordAutomaton(KEYWORDS).matches(text)]
+
+
+@pytest.mark.unit
+def test_overlapping_keywords_are_all_found_in_the_order_they_end() -> None:
+    assert found("ushers") == []
+    assert found("she he hers his") == ["she", "he", "hers", "his"]
+    assert found("spam offer") == ["spam", "spam offer"]
+
+
+@pytest.mark.unit
+def test_only_whole_words_match() -> None:
+    assert found("spammer antispam spam-filter") == ["spam"]
+    assert found("hershey") == []
+    assert found("(hers)") == ["hers"]
+    assert found("spam2 spam_") == ["spam"]
+
+
+@pytest.mark.unit
+def test_matching_ignores_the_case() -> None:
+    assert found("SPAM Offer") == ["spam", "spam offer"]
+    assert [keyword for keyword, _ in KeywordAutomaton({"STRASSE": RuleVerdict.MANUAL}).matches("Straße")] == [
+        "strasse"
+    ]
+
+
+@pytest.mark.unit
+def test_matches_keep_the_verdict_of_their_keyword() -> None:
+    verdicts = dict(KeywordAutomaton(KEYWORDS).matches("his spam"))
+    assert verdicts == {"his": RuleVerdict.MANUAL, "spam": RuleVerdict.REJECT}
+    assert list(KeywordAutomaton({"": RuleVerdict.REJECT}).matches("anything")) == []
@@ -0,0 +1,81 @@
+"""BM25 ranking of the full-text search"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from moderation.search import SearchIndex
+
+FILLER = "lorem ipsum dolor sit amet"
+
+
+def event(message_id: str, text: str, user_id: str = "someone", url: str | None = None) -> SimpleNamespace:
+    """The part of a decoded message read by the search index"""
+    body = json.dumps({"id": message_id, "content": {"description": text}}).encode()
+    return SimpleNamespace(id=message_id, body=body, summary=SimpleNamespace(user_id=user_id, url=url))
+
+
+def ranking(search_index: SearchIndex, query: str) -> list[str]:
+    return [hit.message_id for hit in search_index.search(query)]
+
+
+@pytest.mark.unit
+def test_events_repeating_a_word_rank_first() -> None:
+    search_index = SearchIndex()
+    search_index.on_added(event("once", f"glacier {FILLER} {FILLER}"))
+    search_index.on_added(event("thrice", f"glacier glacier glacier {FILLER} {FILLER}"))
+    search_index.on_added(event("twice", f"glacier glacier {FILLER} {FILLER}"))
+    search_index.on_added(event("none", f"{FILLER} {FILLER}"))
+
+    assert ranking(search_index, "Glacier") == ["thrice", "twice", "once"]
+
+
+@pytest.mark.unit
+def test_rare_words_weigh_more_than_common_ones() -> None:
+    search_index = SearchIndex()
+    search_index.on_added(event("rare", "glacier glacier melt"))
+    search_index.on_added(event("common", "glacier melt melt"))
+    for i in range(5):
+        search_index.on_added(event(f"filler-{i}", f"melt {FILLER}"))
+
+    assert ranking(search_index, "melt glacier") == ["rare", "common"]
+
+
+@pytest.mark.unit
+def test_shorter_events_rank_first_at_equal_frequency() -> None:
+    search_index = SearchIndex()
+    search_index.on_added(event("long", f"glacier {FILLER} {FILLER} {FILLER}"))
+    search_index.on_added(event("short", "glacier"))
+    search_index.on_added(event("medium", f"glacier {FILLER}"))
+
+    assert ranking(search_index, "glacier") == ["short", "medium", "long"]
+
+
+@pytest.mark.unit
+def test_only_events_holding_every_word_match() -> None:
+    search_index = SearchIndex()
+    search_index.on_added(event("both", "glacier melt"))
+    search_index.on_added(event("glacier", "glacier"))
+    search_index.on_added(event("user", "melt", user_id="glacier-watch", url="https://example.org/posts/42"))
+
+    assert ranking(search_index, "glacier melt") == ["both", "user"]
+    assert ranking(search_index, "example 42") == ["user"]
+    assert ranking(search_index, "glacier unknown") == []
+    assert ranking(search_index, " ,;") == []
+    assert len(search_index.search("glacier", limit=1)) == 1
+
+
+@pytest.mark.unit
+def test_removed_and_replaced_events_leave_the_index() -> None:
+    search_index = SearchIndex()
+    search_index.on_added(event("a", "glacier"))
+    search_index.on_added(event("b", "glacier melt"))
+    search_index.on_added(event("a", "melt"))
+    search_index.on_removed(event("b", ""))
+
+    assert ranking(search_index, "glacier") == []
+    assert ranking(search_index, "melt") == ["a"]
+    assert search_index._postings.keys() == {"melt", "someone"}
+    search_index.on_cleared()
+    assert len(search_index) == 0
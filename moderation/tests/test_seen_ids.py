@@ -0,0 +1,90 @@
+"""Bounds of the index of the decided ids"""
+
+import pytest
+from msfwk.desp.rabbitmq.mq_message import ModerationEventStatus
+
+from moderation import seen_ids
+from moderation.seen_ids import SeenIdIndex
+
+
+class Clock:
+    """Stand-in for time.monotonic, moved by hand"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(seen_ids.time, "monotonic", clock)
+    return clock
+
+
+@pytest.mark.unit
+def test_the_least_recently_used_ids_are_evicted_first() -> None:
+    index = SeenIdIndex(max_size=3, ttl=60)
+    for message_id in ("a", "b", "c"):
+        index.record(message_id, ModerationEventStatus.Accepted, confirmed=True)
+    assert index.get("a") is not None
+    index.record("d", ModerationEventStatus.Rejected, confirmed=False)
+
+    assert len(index) == index.max_size
+    assert index.get("b") is None
+    assert [message_id for message_id in "acd" if index.get(message_id) is not None] == ["a", "c", "d"]
+    assert index.get("d").confirmed is False
+
+
+@pytest.mark.unit
+def test_ids_expire_after_the_ttl(clock: Clock) -> None:
+    index = SeenIdIndex(max_size=10, ttl=60)
+    index.record("a", ModerationEventStatus.Accepted, confirmed=True)
+    clock.now += 30
+    index.record("b", ModerationEventStatus.Rejected, confirmed=True)
+    clock.now += 30
+
+    assert index.get("a") is None
+    assert index.get("b").status == ModerationEventStatus.Rejected
+    assert len(index) == 1
+    stats = index.stats()
+    assert (stats.size, stats.hits, stats.misses) == (1, 1, 1)
+
+    # Recording again restarts the clock of an id
+    index.record("b", ModerationEventStatus.Rejected, confirmed=True)
+    clock.now += 59
+    assert index.get("b") is not None
+
+
+@pytest.mark.unit
+def test_forgotten_ids_are_pending_again() -> None:
+    index = SeenIdIndex(max_size=10, ttl=60)
+    index.record("a", ModerationEventStatus.Accepted, confirmed=False)
+    index.forget("a")
+    index.forget("unknown")
+    assert index.get("a") is None
+
+
+@pytest.mark.unit
+async def test_published_decisions_are_passed_to_the_decided_hooks(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(seen_ids, "_seen_ids", SeenIdIndex(max_size=10, ttl=60))
+    monkeypatch.setattr(seen_ids, "_decided_hooks", [])
+    decided: list[str] = []
+
+    async def drop_copies(message_id: str) -> None:
+        decided.append(message_id)
+
+    async def failing(message_id: str) -> None:
+        raise RuntimeError(message_id)
+
+    seen_ids.add_decided_hook(failing)
+    seen_ids.add_decided_hook(drop_copies)
+    seen_ids.mark_deciding("a", ModerationEventStatus.Accepted)
+    assert await seen_ids.decision_of("a") == ModerationEventStatus.Accepted
+    assert await seen_ids.decision_of("a", confirmed=True) is None
+    await seen_ids.mark_decided("a", ModerationEventStatus.Accepted)
+
+    assert decided == ["a"]
+    assert seen_ids.published_decision("a") == ModerationEventStatus.Accepted
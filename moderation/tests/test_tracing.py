@@ -0,0 +1,80 @@
+"""Spans recorded by the memory exporter for a request served on the in-memory broker"""
+
+from collections.abc import AsyncIterator
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from msfwk.mqclient import RabbitMQConfig
+
+from benchmarks.fake_amqp import FakeBroker, install_fake_pool
+from benchmarks.payloads import make_payloads
+from moderation import tracing
+from moderation.apply_moderation import accept_message
+from moderation.models.config import ModerationConfig
+from moderation.mq_pool import close_mq_pool
+
+QUEUE = "manual_moderation"
+HANDLING_QUEUE = "to_handling_queue"
+
+
+@pytest.fixture
+async def broker(monkeypatch: pytest.MonkeyPatch) -> AsyncIterator[FakeBroker]:
+    """The manual moderation queue holding one event, with tracing to memory"""
+    monkeypatch.setattr(RabbitMQConfig, "MANUAL_MODERATION_QUEUE", QUEUE)
+    monkeypatch.setattr(RabbitMQConfig, "MODERATION_EXCHANGE", "moderation")
+    monkeypatch.setattr(RabbitMQConfig, "TO_HANDLING_RKEY", "to_handling")
+    monkeypatch.setattr(ModerationConfig, "TRACING_ENABLED", True)
+    monkeypatch.setattr(ModerationConfig, "TRACING_EXPORTER", "memory")
+    broker = FakeBroker()
+    broker.seed(QUEUE, make_payloads(1))
+    broker.bind(HANDLING_QUEUE, "moderation", "to_handling")
+    tracing.setup_tracing()
+    await install_fake_pool(broker)
+    tracing.clear_finished_spans()
+    yield broker
+    await close_mq_pool()
+    tracing.shutdown_tracing()
+
+
+@pytest.mark.unit
+async def test_an_accept_is_traced_from_the_request_to_each_rabbitmq_stage(broker: FakeBroker) -> None:
+    application = FastAPI()
+    tracing.trace_requests(application)
+
+    @application.post("/accept/{message_id}")
+    async def accept(message_id: str) -> dict:
+        await accept_message(message_id)
+        return {}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application), base_url="http://test") as client:
+        response = await client.post("/accept/bench-00000000")
+    assert response.status_code == 200  # noqa: PLR2004
+    assert len(broker.queues[QUEUE]) == 0
+    assert len(broker.queues[HANDLING_QUEUE]) == 1
+
+    spans = tracing.get_finished_spans()
+    roots = [span for span in spans if span.parent is None]
+    assert [root.name for root in roots] == ["moderation.request"]
+    root = roots[0]
+    assert root.attributes["path"] == "/accept/bench-00000000"
+    assert root.attributes["status_code"] == 200  # noqa: PLR2004
+
+    by_id = {span.context.span_id: span for span in spans}
+    for span in spans:
+        assert span.context.trace_id == root.context.trace_id
+        ancestor = span
+        while ancestor.parent is not None:
+            ancestor = by_id[ancestor.parent.span_id]
+        assert ancestor is root
+    stages = {span.name for span in spans}
+    assert {
+        "rabbitmq.acquire_channel",
+        "rabbitmq.get_queue",
+        "moderation.decode",
+        "rabbitmq.publish",
+        "rabbitmq.ack",
+    } <= stages
+    assert {name.split(".")[0] for name in stages} == {"moderation", "rabbitmq"}
+    publish = next(span for span in spans if span.name == "rabbitmq.publish")
+    assert publish.attributes["message_id"] == "bench-00000000"
@@ -0,0 +1,118 @@
+"""OpenTelemetry spans around the RabbitMQ stages of a request.
+
+Every request is traced by a `moderation.request` span, with a child span per stage: connect, channel checkout,
+get queue, read pass, decode, ack and publish. With `tracing_enabled` and the opentelemetry-sdk package the spans
+are exported by `tracing_exporter`:
+
+- `console`: printed on the standard output
+- `memory`: kept in the process, read back with `get_finished_spans` in tests
+- `otlp`: sent to the OTLP/HTTP collector of the standard OTEL_EXPORTER_OTLP_* variables
+
+The spans cost nothing without the package or with tracing disabled.
+"""
+
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractContextManager, nullcontext
+
+from fastapi import FastAPI, Request, Response
+from msfwk.utils.logging import get_logger
+
+from moderation.models.config import ModerationConfig
+
+try:
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SimpleSpanProcessor,
+    )
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+    from opentelemetry.trace import Span, Tracer
+except ImportError:  # pragma: no cover - opentelemetry is optional, the spans are no-ops without it
+    TracerProvider = None
+
+logger = get_logger(__name__)
+
+TRACER_NAME = "moderation"
+_NO_SPAN = nullcontext()
+
+_provider: "TracerProvider | None" = None
+_tracer: "Tracer | None" = None
+_memory_exporter: "InMemorySpanExporter | None" = None
+
+
+def setup_tracing() -> None:
+    """Install the exporter of the config, once the config is loaded"""
+    global _provider, _tracer, _memory_exporter  # noqa: PLW0603
+    if not ModerationConfig.TRACING_ENABLED:
+        return
+    if TracerProvider is None:
+        logger.warning("Tracing enabled but opentelemetry-sdk is not installed, no span is recorded")
+        return
+    _provider = TracerProvider(resource=Resource.create({"service.name": ModerationConfig.TRACING_SERVICE_NAME}))
+    if ModerationConfig.TRACING_EXPORTER == "memory":
+        _memory_exporter = InMemorySpanExporter()
+        _provider.add_span_processor(SimpleSpanProcessor(_memory_exporter))
+    elif ModerationConfig.TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (  # noqa: PLC0415
+            OTLPSpanExporter,
+        )
+
+        _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    else:
+        _provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    _tracer = _provider.get_tracer(TRACER_NAME)
+    logger.info("Tracing enabled, spans exported to %s", ModerationConfig.TRACING_EXPORTER)
+
+
+def shutdown_tracing() -> None:
+    """Export the spans still buffered and stop tracing"""
+    global _provider, _tracer  # noqa: PLW0603
+    if _provider is not None:
+        _provider.shutdown()
+    _provider = _tracer = None
+
+
+def span(name: str, **attributes: str | float | bool | None) -> "AbstractContextManager[Span | None]":
+    """Context manager recording a stage as a child of the current span, the span is None when not tracing.
+    An exception leaving the block is recorded on the span.
+
+    Args:
+        name (str): name of the stage
+        attributes: attributes of the span, the None ones are left out
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.start_as_current_span(
+        name, attributes={key: value for key, value in attributes.items() if value is not None}
+    )
+
+
+def get_finished_spans() -> "list[ReadableSpan]":
+    """The spans recorded by the `memory` exporter, oldest first"""
+    return list(_memory_exporter.get_finished_spans()) if _memory_exporter is not None else []
+
+
+def clear_finished_spans() -> None:
+    """Forget the spans recorded by the `memory` exporter"""
+    if _memory_exporter is not None:
+        _memory_exporter.clear()
+
+
+def trace_requests(application: FastAPI) -> None:
+    """Record a span per request, the parent of the spans of its stages
+
+    Args:
+        application (FastAPI): the service application
+    """
+
+    @application.middleware("http")
+    async def trace_request(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        with span("moderation.request", method=request.method, path=request.url.path) as current:
+            response = await call_next(request)
+            if current is not None:
+                current.set_attribute("status_code", response.status_code)
+            return response
@@ -1,10 +1,11 @@
-import time
-
+from aio_pika.abc import AbstractIncomingMessage
 from msfwk.exceptions import MQClientConnectionError
 from msfwk.mqclient import MQClient, RabbitMQConfig
 from msfwk.utils.logging import get_logger
 
+from moderation.metrics import ACK_SECONDS
 from moderation.models.exceptions import MQServerConnectionError
+from moderation.tracing import span
 
 logger = get_logger(__name__)
 
@@ -20,8 +21,9 @@ async def connect_to_rabbitmq(config: type[RabbitMQConfig] = RabbitMQConfig) ->
 
     """
     try:
-        client = MQClient()
-        await client.setup(config)
+        with span("rabbitmq.connect"):
+            client = MQClient()
+            await client.setup(config)
     except MQClientConnectionError as ce:
         message = f"RabbitMQ connection failed: {ce}"
         logger.exception(message, exc_info=ce)
@@ -35,21 +37,7 @@ async def connect_to_rabbitmq(config: type[RabbitMQConfig] = RabbitMQConfig) ->
         return client
 
 
-def time_calculator(func):  # noqa: ANN001, ANN201
-    """Decorator to measure the execution time of a function."""
-
-    def wrapper(*args, **kwargs):  # noqa: ANN002, ANN003, ANN202
-        start_time = time.time()  # Start time
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            message = f"Error in function '{func.__name__}': {e}"
-            logger.exception(message, exc_info=e)
-            return None
-        finally:
-            end_time = time.time()  # End time
-            execution_time = end_time - start_time
-            message = f"Execution time of '{func.__name__}': {execution_time:.6f} seconds"
-            logger.info(message)
-
-    return wrapper
+async def ack_message(message: AbstractIncomingMessage) -> None:
+    """Ack a delivery, timing the round trip"""
+    with span("rabbitmq.ack", message_id=message.message_id), ACK_SECONDS.time():
+        await message.ack()